@@ -0,0 +1,682 @@
+"""
+Asyncio (ASGI) server mode for py-adb-mirror.
+
+The Flask app in adb_screen.py holds a thread for as long as a request
+waits: a long-poll, an MJPEG stream or an adb command. This module serves
+the same routes from a single event loop instead. Captures run as asyncio
+tasks that talk to the adb server socket (or start the adb binary with
+asyncio.create_subprocess_exec), long-polls and streams wait on asyncio
+events, and a request whose client disconnects is cancelled together with
+the adb call it was waiting for. Frames, rate control, the device registry
+and the input queues are the ones from adb_screen.py.
+
+Run it with any ASGI server:
+
+    uvicorn adb_asgi:app --host 0.0.0.0 --port 5000
+
+or `python adb_asgi.py`, which starts uvicorn. WebSocket delivery (/ws) is
+only available in the Flask mode.
+"""
+
+import asyncio
+import functools
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, quote
+
+import jinja2
+from werkzeug.datastructures import MultiDict
+
+import adb_screen
+from adb_client import AdbError, CONNECT_TIMEOUT, IO_TIMEOUT, parse_devices
+# Settings that can change at runtime (CAPTURE_MODE, CAPTURE_FORMAT, ...) and
+# device_registry are read through adb_screen when used, not imported here
+from adb_screen import (
+    FRAME_MIMETYPES, FRAME_WAIT_TIMEOUT, INDEX_HTML, REPLAY_HTML, USB_BUS_CAPTURES,
+    WALL_FRAME_INTERVAL, WALL_HTML, WALL_THUMBNAIL_QUALITY, WALL_THUMBNAIL_SIZE, adb_args,
+    capture_pull, connection_status, decode_capture, device_stats, devices_status, frame_etag,
+    frame_options, frame_status, frame_transform, UNTIMED_ENDPOINTS, handle_input,
+    list_recordings, metrics, metrics_text, mjpeg_header, open_recording, record_control,
+    replay_frame, timed, use_adb_socket, wall_status,
+)
+
+# Input events are executed by each device's InputScheduler thread; these
+# threads only wait for the results so the loop does not have to
+INPUT_THREADS = 32
+
+ADB_ERRORS = (AdbError, OSError, EOFError, asyncio.TimeoutError)
+
+templates = jinja2.Environment(autoescape=True)
+index_template = templates.from_string(INDEX_HTML)
+wall_template = templates.from_string(WALL_HTML)
+replay_template = templates.from_string(REPLAY_HTML)
+input_executor = ThreadPoolExecutor(INPUT_THREADS, thread_name_prefix="input")
+
+async def run_blocking(function, *args, **kwargs):
+    """Run CPU-bound work (decoding, diffing, encoding) off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+async def run_adb(args, timeout=10):
+    """Run the adb binary and return (success, stdout bytes, error)"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "adb", *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        return False, b"", str(e)
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return False, b"", "Command timed out"
+    except asyncio.CancelledError:
+        # The client went away, do not leave adb running for nobody
+        process.kill()
+        raise
+    return process.returncode == 0, stdout, stderr.decode(errors="replace")
+
+async def host_request(reader, writer, payload):
+    """Send a host protocol request and check for OKAY"""
+    data = payload.encode()
+    writer.write(b"%04x" % len(data) + data)
+    await writer.drain()
+    status = await reader.readexactly(4)
+    if status == b"OKAY":
+        return
+    if status == b"FAIL":
+        length = int(await reader.readexactly(4), 16)
+        raise AdbError((await reader.readexactly(length)).decode(errors="replace"))
+    raise AdbError(f"Unexpected response from adb server: {status!r}")
+
+async def connect(device=None):
+    """Open a connection to the adb server, switched to device if one is given"""
+    client = device.client if device is not None else adb_screen.adb_client
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(client.host, client.port), CONNECT_TIMEOUT)
+    if device is not None:
+        try:
+            await host_request(reader, writer, f"host:transport:{device.serial}"
+                               if device.serial else "host:transport-any")
+        except BaseException:
+            writer.close()
+            raise
+    return reader, writer
+
+async def list_devices():
+    """Async adb_screen.list_devices()"""
+    if use_adb_socket():
+        try:
+            reader, writer = await connect()
+            try:
+                await host_request(reader, writer, "host:devices-l")
+                length = int(await reader.readexactly(4), 16)
+                output = await reader.readexactly(length)
+            finally:
+                writer.close()
+            return True, parse_devices(output.decode(errors="replace")), ""
+        except ADB_ERRORS as e:
+            if adb_screen.ADB_BACKEND == "socket":
+                return False, [], str(e)
+
+    success, output, error = await run_adb(["devices", "-l"])
+    if not success:
+        return False, [], error or "adb devices failed"
+    return True, parse_devices(output.decode(errors="replace")), ""
+
+async def exec_out(device, command):
+    """Async adb_screen.adb_exec_out()"""
+    if use_adb_socket():
+        try:
+            reader, writer = await connect(device)
+            try:
+                await host_request(reader, writer, "exec:" + command)
+                return True, await asyncio.wait_for(reader.read(), IO_TIMEOUT), ""
+            finally:
+                writer.close()
+        except ADB_ERRORS as e:
+            if adb_screen.ADB_BACKEND == "socket":
+                return False, b"", str(e)
+    return await run_adb(adb_args(device) + ["exec-out"] + command.split())
+
+def decode_exec_out(device, data, raw, timings):
+    start = time.time()
+    frame = decode_capture(data, raw)
+    timed(timings, "decode", start)
+    device.exec_out_checked(frame is not None)
+    if frame is None:
+        return False, "exec-out returned invalid image data"
+    return True, frame
+
+async def capture_screenshot(device, timings=None, slot=0):
+    """Async adb_screen.capture_screenshot()"""
+    mode = adb_screen.CAPTURE_MODE
+    raw = adb_screen.CAPTURE_FORMAT == "raw"
+    if mode == "exec-out" or (mode == "auto" and device.exec_out_enabled()):
+        start = time.time()
+        success, data, error = await exec_out(device, "screencap" if raw else "screencap -p")
+        timed(timings, "exec-out", start)
+        if not success:
+            return False, f"Failed to capture screenshot: {error}"
+        success, result = await run_blocking(decode_exec_out, device, data, raw, timings)
+        if success or mode == "exec-out":
+            return success, result
+
+    # screencap, pull and rm are three round trips through the blocking helpers
+    return await run_blocking(capture_pull, device, raw, timings, slot)
+
+class AsyncCapturePool:
+    """Runs every device's capture engine as a task on the event loop
+
+    Takes the place of adb_screen.CapturePool: CaptureEngine.touch() asks
+    for capturing to be scheduled, and at most USB_BUS_CAPTURES captures per
+    USB bus wait on the device at the same time. An engine's task starts
+    each capture as a task of its own, so as many as the engine's pipeline
+    allows overlap. Requests wait for new frames with wait_for_frame().
+    """
+
+    def __init__(self, per_bus=USB_BUS_CAPTURES):
+        self.per_bus = per_bus
+        self.loop = None
+        self.tasks = {}     # engine -> capture task
+        self.buses = {}     # bus -> semaphore
+        self.events = {}    # engine -> event set on its next frame
+        self.running = 0
+
+    def bind(self, loop):
+        if self.loop is None:
+            self.loop = loop
+
+    def schedule(self, engine, delay=0):
+        """Start capturing for engine, callable from any thread"""
+        self.loop.call_soon_threadsafe(self._start, engine, delay)
+
+    def _start(self, engine, delay):
+        task = self.tasks.get(engine)
+        if task is None or task.done():
+            self.tasks[engine] = self.loop.create_task(self._run(engine, delay))
+
+    def stats(self):
+        return {"workers": 0, "scheduled": sum(not task.done() for task in self.tasks.values()),
+                "running": self.running}
+
+    def _bus(self, bus):
+        if bus not in self.buses:
+            self.buses[bus] = asyncio.Semaphore(self.per_bus)
+        return self.buses[bus]
+
+    async def _run(self, engine, delay):
+        captures = set()
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                if engine.pause_if_idle():
+                    return  # captures in flight still finish and record their frames
+
+                capture, stagger = engine.begin()
+                if capture is not None:
+                    captures.add(self.loop.create_task(self._capture(engine, *capture)))
+                if capture is not None and stagger is not None:
+                    delay = stagger
+                    continue
+                if not captures:
+                    # The slots are held by captures of an earlier, paused run
+                    delay = engine.interval()
+                    continue
+                # Pipeline full, the next start follows the first capture that completes
+                done, _ = await asyncio.wait(captures, return_when=asyncio.FIRST_COMPLETED)
+                captures -= done
+                delay = min(self._delay(engine, task) for task in done)
+        except asyncio.CancelledError:
+            for task in captures:
+                task.cancel()
+            raise
+
+    def _delay(self, engine, task):
+        """The delay a finished capture task asks for, a backoff if it raised"""
+        error = task.exception()
+        if error is None:
+            return task.result()
+        engine.last_error = f"Capture failed: {error}"
+        return adb_screen.CAPTURE_ERROR_BACKOFF
+
+    async def _capture(self, engine, ticket, slot):
+        """Run one capture and record it, returns the delay before the next start"""
+        try:
+            async with self._bus(engine.device.bus):
+                self.running += 1
+                try:
+                    timings = {}
+                    start = time.time()
+                    success, result = await capture_screenshot(engine.device, timings, slot)
+                    latency = time.time() - start
+                finally:
+                    self.running -= 1
+            return await run_blocking(engine.record, success, result, latency, timings, ticket)
+        except Exception as e:
+            # Like CaptureEngine.step(): keep capturing after the usual backoff
+            return engine.fail(ticket, f"Capture failed: {e}")
+        finally:
+            event = self.events.pop(engine, None)
+            if event is not None:
+                event.set()
+
+    async def wait_for_frame(self, engine, after_seq=0, timeout=FRAME_WAIT_TIMEOUT):
+        """Wait until engine has a frame newer than after_seq, or timeout"""
+        deadline = self.loop.time() + timeout
+        while True:
+            frame = engine.latest()
+            remaining = deadline - self.loop.time()
+            if (frame is not None and frame.seq > after_seq) or remaining <= 0:
+                return frame
+            event = self.events.setdefault(engine, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        """Stop capturing, engines are scheduled again on the next touch()"""
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        for engine in self.tasks:
+            with engine.condition:
+                engine.active = False
+
+capture_pool = AsyncCapturePool()
+# Engines schedule their captures on this pool instead of the thread pool
+adb_screen.capture_pool = capture_pool
+
+class Request:
+    """The parts of an HTTP request the routes use"""
+
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1")))
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1")
+                        for name, value in scope["headers"]}
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+class Response:
+    def __init__(self, body=b"", status=200, content_type="application/json", headers=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+class StreamingResponse:
+    """A response whose body is produced by an async iterator"""
+
+    def __init__(self, chunks, content_type, headers=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.headers = headers or {}
+
+def json_response(data, status=200):
+    return Response(json.dumps(data).encode(), status)
+
+def unknown_device(serial):
+    return json_response({"success": False, "error": f"Device {serial} is not attached"}, 404)
+
+async def find_device(serial):
+    """adb_screen.device_registry.get() without blocking on the device list"""
+    registry = adb_screen.device_registry
+    if registry.stale() or (serial is not None and registry.find(serial) is None):
+        registry.update(*await list_devices())
+    return registry.get(serial, refresh=False)
+
+# path -> (methods, handler, also served under /d/<serial>/)
+ROUTES = {}
+ROUTE_PATTERN = re.compile(r"^(?:/d/(?P<serial>[^/]+))?(?P<path>/.*)$")
+
+def route(path, methods=("GET",), per_device=True):
+    def decorator(handler):
+        ROUTES[path] = (methods, handler, per_device)
+        return handler
+    return decorator
+
+@route("/")
+async def index(request, serial):
+    """Serve the web interface, for one device under /d/<serial>/"""
+    if serial is not None and await find_device(serial) is None:
+        return unknown_device(serial)
+    base = "/d/" + quote(serial, safe="") if serial else ""
+    html = index_template.render(websocket=False, tiles=False, base=base, serial=serial)
+    return Response(html.encode(), content_type="text/html; charset=utf-8")
+
+@route("/wall", per_device=False)
+async def wall(request, serial):
+    """Serve the wall view: every attached device as a live thumbnail"""
+    html = wall_template.render(size=WALL_THUMBNAIL_SIZE, quality=WALL_THUMBNAIL_QUALITY,
+                                interval=round(WALL_FRAME_INTERVAL * 1000))
+    return Response(html.encode(), content_type="text/html; charset=utf-8")
+
+@route("/wall/frames", per_device=False)
+async def wall_frames(request, serial):
+    """Latest frame of every attached device, for the wall view"""
+    registry = adb_screen.device_registry
+    if registry.stale():
+        registry.update(*await list_devices())
+    return json_response(wall_status(registry.attached))
+
+@route("/devices", per_device=False)
+async def devices(request, serial):
+    """List attached devices and which of them are being mirrored"""
+    registry = adb_screen.device_registry
+    return json_response(devices_status(registry.update(*await list_devices())))
+
+@route("/test")
+async def test_connection(request, serial):
+    """Test ADB connection"""
+    return json_response(connection_status(serial, *await list_devices()))
+
+@route("/screenshot")
+async def screenshot(request, serial):
+    """Return the sequence number of the latest captured frame (?after= waits)"""
+    device = await find_device(serial)
+    if device is None:
+        return unknown_device(serial)
+    engine = device.engine
+    engine.touch()
+    after = request.args.get('after', type=int)
+    if after is not None:
+        frame = await capture_pool.wait_for_frame(engine, after)
+    else:
+        frame = engine.latest() or await capture_pool.wait_for_frame(engine)
+    return json_response(frame_status(engine, frame))
+
+@route("/screen")
+async def get_screen(request, serial):
+    """Serve the requested (or latest) frame from memory"""
+    start = time.time()
+    options, error = frame_options(request.args)
+    if error:
+        return json_response({"error": error}, 400)
+
+    device = await find_device(serial)
+    if device is None:
+        return unknown_device(serial)
+    engine = device.engine
+    engine.touch(thumbnail=request.args.get('thumb') == '1')
+    seq = request.args.get('seq', type=int)
+    frame = (seq and engine.get(seq)) or engine.latest()
+    if frame is None:
+        return json_response({"error": "No screenshot available"}, 404)
+
+    encoding, etag = frame_etag(frame, options)
+    headers = {"ETag": f'"{etag}"', "X-Frame-Seq": str(frame.seq), "Cache-Control": "no-cache",
+               **frame_transform(frame, options)}
+    device.delivery_rates["poll"].mark()
+    if_none_match = request.headers.get("if-none-match", "")
+    if f'"{etag}"' in if_none_match or if_none_match.strip() == "*":
+        return Response(status=304, content_type=None, headers=headers)
+    data = await run_blocking(frame.encode, **options)
+    metrics.observe("delivery_seconds", time.time() - start, path="poll", **device.labels)
+    return Response(data, content_type=FRAME_MIMETYPES[encoding], headers=headers)
+
+@route("/stream")
+async def stream(request, serial):
+    """Push frames as an MJPEG (multipart/x-mixed-replace) stream"""
+    options, error = frame_options(request.args)
+    if error:
+        return json_response({"error": error}, 400)
+    # MJPEG parts are always JPEG, only quality and size are adjustable
+    options["encoding"] = "jpeg"
+
+    device = await find_device(serial)
+    if device is None:
+        return unknown_device(serial)
+    engine = device.engine
+
+    async def generate():
+        device.count_stream(1)
+        subscriber = engine.subscribe()
+        try:
+            while True:
+                engine.touch()
+                frame = await capture_pool.wait_for_frame(engine, subscriber.seq)
+                if not subscriber.accept(frame):
+                    continue
+                data = await run_blocking(frame.encode, **options)
+                device.delivery_rates["stream"].mark()
+                yield mjpeg_header(data)
+                start = time.time()
+                yield data
+                metrics.observe("delivery_seconds", time.time() - start, path="stream",
+                                **device.labels)
+        finally:
+            subscriber.close()
+            device.count_stream(-1)
+
+    return StreamingResponse(generate(), "multipart/x-mixed-replace; boundary=frame",
+                             {"Cache-Control": "no-store"})
+
+@route("/stats")
+async def stats(request, serial):
+    """Report capture and delivery frame rates"""
+    device = await find_device(serial)
+    if device is None:
+        return unknown_device(serial)
+    return json_response(device_stats(device))
+
+@route("/metrics", per_device=False)
+async def metrics_endpoint(request, serial):
+    """Prometheus metrics for all devices (per-device summaries are in /stats)"""
+    return Response(metrics_text().encode(), content_type="text/plain; version=0.0.4")
+
+async def input_route(request, serial, kind):
+    """Queue an input event and wait for its result
+
+    A request cancelled by a disconnecting client still leaves its event in
+    the device's queue; input is never half applied.
+    """
+    device = await find_device(serial)
+    if device is None:
+        return unknown_device(serial)
+    data = request.json()
+    if data is None:
+        # Not JSON at all, which Flask answers with 400 as well; JSON that is
+        # not an object is rejected by handle_input() like in the Flask routes
+        return json_response({"success": False, "error": "Invalid JSON"}, 400)
+
+    loop = asyncio.get_running_loop()
+    success, error = await loop.run_in_executor(input_executor, handle_input, device, kind, data)
+    if success:
+        return json_response({"success": True})
+    else:
+        return json_response({"success": False, "error": error})
+
+@route("/tap", methods=("POST",))
+async def tap(request, serial):
+    """Handle tap command"""
+    return await input_route(request, serial, "tap")
+
+@route("/swipe", methods=("POST",))
+async def swipe(request, serial):
+    """Handle swipe command"""
+    return await input_route(request, serial, "swipe")
+
+@route("/touch", methods=("GET", "POST"))
+async def touch(request, serial):
+    """Stream touch down/move/up events, GET reports the injection backend"""
+    if request.method == "POST":
+        return await input_route(request, serial, "touch")
+
+    device = await find_device(serial)
+    if device is None:
+        return unknown_device(serial)
+    loop = asyncio.get_running_loop()
+    capabilities = await loop.run_in_executor(input_executor, device.injector.capabilities)
+    return json_response(dict(capabilities, success=True))
+
+@route("/key", methods=("POST",))
+async def send_key(request, serial):
+    """Send a keyevent to Android"""
+    return await input_route(request, serial, "key")
+
+@route("/record", methods=("GET", "POST"))
+async def record(request, serial):
+    """Start or stop recording the session, GET reports the recording"""
+    device = await find_device(serial)
+    if device is None:
+        return unknown_device(serial)
+    if request.method == "POST":
+        # Stopping waits for the recorder to write out its buffers
+        success, error = await run_blocking(record_control, device, request.json())
+        if not success:
+            return json_response({"success": False, "error": error})
+    recorder = device.recorder
+    return json_response({"success": True, "recording": recorder.stats() if recorder else None})
+
+@route("/replay", per_device=False)
+async def replay(request, serial):
+    """Serve the replay view for recorded sessions"""
+    return Response(replay_template.render().encode(), content_type="text/html; charset=utf-8")
+
+@route("/recordings", per_device=False)
+async def recordings_list(request, serial):
+    """List recorded sessions, newest first"""
+    return json_response({"success": True, "recordings": await run_blocking(list_recordings)})
+
+@route("/recordings/frame", per_device=False)
+async def recording_frame(request, serial):
+    """The screen of a recording t seconds after it started"""
+    options, error = frame_options(request.args)
+    if error:
+        return json_response({"error": error}, 400)
+    data, result, timestamp = await run_blocking(
+        replay_frame, request.args.get('name'), request.args.get('t', 0, type=float), options)
+    if data is None:
+        return json_response({"error": result}, 404)
+    return Response(data, content_type=FRAME_MIMETYPES[result],
+                    headers={"X-Frame-Time": f"{timestamp:.3f}"})
+
+@route("/recordings/events", per_device=False)
+async def recording_events(request, serial):
+    """Input events of a recording, optionally between two timestamps"""
+    recording = await run_blocking(open_recording, request.args.get('name'))
+    if recording is None:
+        return json_response({"success": False, "error": "Unknown recording"}, 404)
+    events = await run_blocking(recording.events, request.args.get('from', 0, type=float),
+                                request.args.get('to', float("inf"), type=float))
+    return json_response({"success": True, "events": events})
+
+async def dispatch(request):
+    match = ROUTE_PATTERN.match(request.path)
+    serial = match.group("serial") if match else None
+    methods, handler, per_device = ROUTES.get(match.group("path") if match else "", (None,) * 3)
+    if handler is None or (serial is not None and not per_device):
+        return json_response({"error": "Not found"}, 404)
+    if request.method == "OPTIONS":
+        # CORS preflight, matching flask-cors in the Flask mode
+        return Response(content_type=None, headers={
+            "Access-Control-Allow-Methods": ", ".join(methods),
+            "Access-Control-Allow-Headers": request.headers.get(
+                "access-control-request-headers", "Content-Type"),
+        })
+    if request.method not in methods and not (request.method == "HEAD" and "GET" in methods):
+        return json_response({"error": "Method not allowed"}, 405)
+    start = time.time()
+    response = await handler(request, serial)
+    # Same endpoint names as the Flask view functions
+    if handler.__name__ not in UNTIMED_ENDPOINTS:
+        metrics.observe("http_request_seconds", time.time() - start, endpoint=handler.__name__)
+    return response
+
+async def send_response(send, response):
+    headers = [(b"access-control-allow-origin", b"*")]
+    if response.content_type:
+        headers.append((b"content-type", response.content_type.encode()))
+    headers += [(name.lower().encode(), str(value).encode())
+                for name, value in response.headers.items()]
+
+    if isinstance(response, StreamingResponse):
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        async for chunk in response.chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    headers.append((b"content-length", str(len(response.body)).encode()))
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    await send({"type": "http.response.body", "body": response.body})
+
+async def handle_http(scope, receive, send):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+
+    async def respond():
+        await send_response(send, await dispatch(Request(scope, body)))
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # Whatever finishes first wins: a client that goes away cancels the
+    # request, including the adb call or frame wait it is blocked on
+    tasks = [asyncio.ensure_future(respond()), asyncio.ensure_future(disconnected())]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if tasks[0] in done:
+        tasks[0].result()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            capture_pool.bind(asyncio.get_running_loop())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await capture_pool.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        # Servers running without lifespan events never sent startup
+        capture_pool.bind(asyncio.get_running_loop())
+        await handle_http(scope, receive, send)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The ASGI mode needs an ASGI server: pip install uvicorn")
+
+    print("=" * 60)
+    print("🚀 ADB Screen Mirror & Control Server (asyncio)")
+    print("=" * 60)
+    print("\n🌐 Open your browser and go to:")
+    print("   http://localhost:5000")
+    print("\n⏹  Press Ctrl+C to stop the server")
+    print("=" * 60)
+    print()
+
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,262 @@
+"""
+Minimal pure-Python client for the adb host protocol.
+
+Talks to the adb server (normally localhost:5037) directly instead of running
+the adb binary for every command. A request is four hex digits of length
+followed by the payload, and the server answers OKAY, or FAIL followed by a
+length-prefixed message. After "host:transport:<serial>" a socket is bound to
+the device and carries exactly one service (shell:, exec:, sync:), so the
+pool keeps sockets that are already switched to the device ready for the
+next service, and sync connections are kept open between pulls.
+"""
+
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+CONNECT_TIMEOUT = 2      # seconds to reach the adb server
+IO_TIMEOUT = 10          # seconds a read from the server may take
+POOL_SIZE = 2            # idle device connections kept ready per client
+POOL_MAX_AGE = 30        # seconds before an idle pooled connection is replaced
+
+
+class AdbError(Exception):
+    """The adb server refused a request"""
+
+
+def parse_devices(output):
+    """Parse `adb devices -l` output into dicts with serial, state and properties"""
+    devices = []
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 2 or line.startswith(("List of devices", "*")):
+            continue
+        device = {"serial": parts[0], "state": parts[1]}
+        for part in parts[2:]:
+            if ":" in part:
+                key, value = part.split(":", 1)
+                device[key] = value
+        devices.append(device)
+    return devices
+
+
+class AdbConnection:
+    """One socket to the adb server"""
+
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT):
+        self.sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(IO_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.created = time.time()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def recv_exact(self, size):
+        """Read exactly size bytes, raising ConnectionError on EOF"""
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = self.sock.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionError("adb server closed the connection")
+            buffer += chunk
+        return bytes(buffer)
+
+    def read_until_close(self):
+        chunks = []
+        while True:
+            chunk = self.sock.recv(256 * 1024)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def read_length_prefixed(self):
+        length = int(self.recv_exact(4), 16)
+        return self.recv_exact(length)
+
+    def request(self, payload):
+        """Send a host protocol request and check for OKAY"""
+        data = payload.encode()
+        self.send(b"%04x" % len(data) + data)
+        status = self.recv_exact(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbError(self.read_length_prefixed().decode(errors="replace"))
+        raise AdbError(f"Unexpected response from adb server: {status!r}")
+
+
+class AdbClient:
+    """Services of one device (or the only device when serial is None)"""
+
+    def __init__(self, serial=None, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT,
+                 pool_size=POOL_SIZE):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.pool = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+        self.sync_conn = None
+        self.sync_lock = threading.Lock()
+
+    def _connect(self):
+        return AdbConnection(self.host, self.port)
+
+    def host_request(self, payload):
+        """Run a host: request that answers with a length-prefixed payload"""
+        conn = self._connect()
+        try:
+            conn.request(payload)
+            return conn.read_length_prefixed()
+        finally:
+            conn.close()
+
+    def version(self):
+        return int(self.host_request("host:version"), 16)
+
+    def devices(self):
+        """Return a list of dicts with serial, state and the devices -l properties"""
+        return parse_devices(self.host_request("host:devices-l").decode(errors="replace"))
+
+    def _transport(self):
+        conn = self._connect()
+        try:
+            conn.request(f"host:transport:{self.serial}" if self.serial
+                         else "host:transport-any")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _checkout(self):
+        """Take a pooled device connection, or open a new one"""
+        with self.lock:
+            while self.pool:
+                conn = self.pool.popleft()
+                if time.time() - conn.created < POOL_MAX_AGE:
+                    return conn, True
+                conn.close()
+        return self._transport(), False
+
+    def _refill(self):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.pool) >= self.pool_size:
+                        return
+                try:
+                    conn = self._transport()
+                except (AdbError, OSError):
+                    return
+                with self.lock:
+                    self.pool.append(conn)
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def _schedule_refill(self):
+        with self.lock:
+            if self.refilling or len(self.pool) >= self.pool_size:
+                return
+            self.refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def open_service(self, service):
+        """Open a device service and return its connection
+
+        A pooled connection can have gone stale (device replugged, server
+        restarted); in that case the request is retried once on a fresh one.
+        """
+        while True:
+            conn, pooled = self._checkout()
+            try:
+                conn.request(service)
+                break
+            except OSError:
+                conn.close()
+                if not pooled:
+                    raise
+            except AdbError:
+                conn.close()
+                raise
+        self._schedule_refill()
+        return conn
+
+    def exec_out(self, command):
+        """Run command with the exec: service and return raw stdout bytes"""
+        conn = self.open_service("exec:" + command)
+        try:
+            return conn.read_until_close()
+        finally:
+            conn.close()
+
+    def shell(self, command):
+        """Run command with the shell: service and return its output"""
+        conn = self.open_service("shell:" + command)
+        try:
+            return conn.read_until_close().decode(errors="replace")
+        finally:
+            conn.close()
+
+    def open_shell(self):
+        """Open an interactive shell connection, owned by the caller"""
+        conn = self.open_service("shell:")
+        conn.sock.settimeout(None)
+        return conn
+
+    def _sync_recv(self, conn, path):
+        encoded = path.encode()
+        conn.send(b"RECV" + struct.pack("<I", len(encoded)) + encoded)
+        chunks = []
+        while True:
+            header = conn.recv_exact(8)
+            kind, length = header[:4], struct.unpack("<I", header[4:])[0]
+            if kind == b"DATA":
+                chunks.append(conn.recv_exact(length))
+            elif kind == b"DONE":
+                return b"".join(chunks)
+            elif kind == b"FAIL":
+                raise AdbError(conn.recv_exact(length).decode(errors="replace"))
+            else:
+                raise ConnectionError(f"Unexpected sync response: {kind!r}")
+
+    def pull(self, path):
+        """Return the contents of a device file, reusing one sync connection"""
+        with self.sync_lock:
+            for attempt in range(2):
+                if self.sync_conn is None:
+                    self.sync_conn = self.open_service("sync:")
+                try:
+                    return self._sync_recv(self.sync_conn, path)
+                except AdbError:
+                    # adbd ends the sync session after a FAIL
+                    self.sync_conn.close()
+                    self.sync_conn = None
+                    raise
+                except OSError:
+                    self.sync_conn.close()
+                    self.sync_conn = None
+                    if attempt:
+                        raise
+
+    def close(self):
+        with self.lock:
+            while self.pool:
+                self.pool.popleft().close()
+        with self.sync_lock:
+            if self.sync_conn is not None:
+                self.sync_conn.close()
+                self.sync_conn = None
@@ -11,31 +11,217 @@ Usage:
     3. Open your browser to: http://localhost:5000
 """
 
-from flask import Flask, send_file, jsonify, request, render_template_string
+from flask import Flask, Response, jsonify, request, render_template_string, url_for
 from flask_cors import CORS
 import subprocess
+import threading
 import time
 import os
 import io
+import json
+import struct
+import hashlib
+import queue
+import re
+import socket
+import tempfile
+import mmap
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 from PIL import Image
 import base64
+import bisect
+from collections import Counter, OrderedDict, deque
+from adb_client import AdbClient, AdbError, parse_devices
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    # What sending to or receiving from a WebSocket raises once the client is gone
+    WS_CLOSED_ERRORS = (ConnectionClosed, OSError)
+except ImportError:  # WebSocket delivery is optional
+    Sock = None
+    WS_CLOSED_ERRORS = (OSError,)
+
+try:
+    import numpy as np
+except ImportError:  # Dirty tiles need NumPy, change detection falls back to bytes
+    np = None
 
 app = Flask(__name__)
 CORS(app)
+sock = Sock(app) if Sock is not None else None
 
 # Configuration
+# "auto" talks to the adb server socket directly and falls back to running the
+# adb binary when that fails, "socket" and "subprocess" force one of the two
+ADB_BACKEND = "auto"
 SCREENSHOT_PATH = "/data/local/tmp/screen.png"
-LOCAL_SCREENSHOT = "screen.png"
+RAW_SCREENSHOT_PATH = "/data/local/tmp/screen.raw"
+# Where the adb binary pulls screenshots to: RAM-backed /dev/shm when there is one
+PULL_DIRECTORY = "/dev/shm" if os.path.isdir("/dev/shm") else None
+# "exec-out" reads the image straight from the adb pipe, "pull" uses the old
+# screencap -> pull -> rm round-trip, "auto" tries exec-out and falls back to pull
+CAPTURE_MODE = "auto"
+EXEC_OUT_MAX_FAILURES = 3    # invalid exec-out images in a row before "auto" switches to pull
+EXEC_OUT_RETRY_AFTER = 300   # seconds on pull before exec-out is tried again
+# "png" lets the device compress (screencap -p), "raw" transfers the bare
+# framebuffer and leaves decoding/encoding to the host, much faster on slow CPUs
+CAPTURE_FORMAT = "png"
+# Defaults for frames served by /screen, /stream and /ws (overridable per request
+# with ?encoding=, ?quality= and ?max=). PNG captures are served untouched unless
+# another encoding or a max size is asked for.
+FRAME_ENCODING = "jpeg"
+FRAME_QUALITY = 80
+FRAME_MAX_SIZE = 0           # longest side in pixels, 0 keeps full resolution
+# Where frames are decoded, scaled and encoded: "process" uses worker processes
+# that read the frame from shared memory, "inline" the requesting thread, and
+# "auto" the workers on hosts with more than one core
+ENCODE_POOL = "auto"
+ENCODE_WORKERS = 0           # worker processes, 0 for one per core
+ENCODE_TIMEOUT = 10          # seconds a pooled encode may take before it is done inline
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+FRAME_BUFFER_SIZE = 4        # recent frames kept in memory per device
+FRAME_MEMORY_LIMIT = 64 * 1024 * 1024  # bytes all buffered frames may use, 0 for no limit
+MIN_FRAME_INTERVAL = 0.1     # seconds, upper bound on the capture rate
+MAX_FRAME_INTERVAL = 2.0     # seconds, slowest rate when backing off
+IDLE_FRAME_INTERVAL = 1.0    # seconds between captures once the screen is static
+IDLE_AFTER_UNCHANGED = 5     # unchanged captures before slowing to the idle rate
+SATURATION_FACTOR = 1.5      # latency above this times the baseline means saturated
+INPUT_BOOST_DURATION = 3.0   # seconds of full speed capturing after an input event
+SHELL_COMMAND_TIMEOUT = 10   # seconds an input command may take in the persistent shell
+INPUT_QUEUE_SIZE = 32        # pending input commands before new ones are rejected
+INPUT_BATCH_MAX = 16         # input commands coalesced into one shell invocation
+INPUT_STALE_AFTER = 0.5      # seconds before a waiting swipe may be superseded
+INPUT_WAIT_TIMEOUT = 30      # seconds a request waits for its input event to run
+INPUT_COORDINATE_MAX = 65535 # largest accepted x/y in device pixels
+INPUT_DURATION_MAX = 60000   # longest accepted swipe in milliseconds
+SWIPE_PATH_STEP = 0.05       # seconds of a replayed swipe path sent as one shell line
+SWIPE_PATH_CHUNK = 16        # most path points per shell line (~120 characters each)
+# Keys are Android keycodes, by number or by KEYCODE_* name
+KEYCODE_PATTERN = re.compile(r"(\d{1,4}|KEYCODE_[A-Z0-9_]+)")
+ADB_COMMAND_TIMEOUT = 10     # seconds a run of the adb binary may take
+SPAWN_POOL_SIZE = 1          # `adb shell` processes kept started per device
+SPAWN_MAX_AGE = 30           # seconds before an unused started process is replaced
+# "auto" injects touches with sendevent when the device has a writable multitouch
+# input node and falls back to `input`; "sendevent" or "input" force one of them
+TOUCH_BACKEND = "auto"
+GEOMETRY_MAX_AGE = 60        # seconds before display size, density and rotation are probed again
+GEOMETRY_COMMANDS = ("wm size", "wm density", "dumpsys input")
+GEOMETRY_SEPARATOR = "--adb-screen-geometry--"  # echoed between the probe commands
+CAPTURE_IDLE_TIMEOUT = 10    # seconds without viewers before capturing pauses
+CAPTURE_ERROR_BACKOFF = 1    # seconds to wait after a failed capture
+CAPTURE_WORKERS = 0          # capture threads shared by all devices, 0 sizes the pool
+                             # from host cores and the USB buses in use
+USB_BUS_CAPTURES = 2         # captures running at once on one USB bus
+# Captures kept in flight per device, so the device encodes the next screenshot
+# while the previous one crosses the USB link. 0 tunes the depth between 1 and
+# CAPTURE_PIPELINE_MAX from the measured frame rate.
+CAPTURE_PIPELINE_DEPTH = 0
+CAPTURE_PIPELINE_MAX = 3
+PIPELINE_TUNE_INTERVAL = 5   # seconds of capturing measured per pipeline depth
+PIPELINE_TUNE_GAIN = 1.1     # frame rate factor a deeper pipeline must reach to be kept
+PIPELINE_TUNE_HOLD = 30      # seconds before a rejected deeper pipeline is tried again
+DEVICE_REFRESH_INTERVAL = 2  # seconds a device list from adb is reused
+# Wall view (/wall): devices nobody watches at full size are captured at a low
+# rate and shown as small thumbnails, encoded once per frame on the capture pool
+WALL_FRAME_INTERVAL = 1.0    # seconds between captures of thumbnail-only devices
+WALL_THUMBNAIL_SIZE = 240    # longest side of a thumbnail in pixels
+WALL_THUMBNAIL_QUALITY = 50
+FOCUS_TIMEOUT = 3            # seconds a full-size viewer keeps a device at full rate
+FRAME_WAIT_TIMEOUT = 5       # seconds a request waits for the first frame
+RATE_WINDOW = 5              # seconds over which FPS figures are averaged
+# Upper bounds in seconds of the latency histogram buckets exported on /metrics
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC_PREFIX = "adb_mirror_"
+WS_MAX_IN_FLIGHT = 1         # unacknowledged frames allowed per WebSocket client
+TILE_SIZE = 64               # dirty tile edge in device pixels
+TILE_MAX_AREA = 0.5          # above this changed fraction a full frame is sent
+# H.264 video from `screenrecord` (Android 5+), the "video" WebSocket delivery mode
+VIDEO_BIT_RATE = 8000000     # bits per second requested from the encoder
+VIDEO_TIME_LIMIT = 180       # seconds screenrecord runs before it is restarted
+VIDEO_FLUSH_DELAY = 0.01     # seconds of silence after which a picture is complete
+VIDEO_GOP_LIMIT = 16 * 1024 * 1024  # bytes kept since the last keyframe for joining viewers
+# Session recordings (/record, /replay): one directory per session in RECORDINGS_DIR
+RECORDINGS_DIR = os.environ.get("ADB_MIRROR_RECORDINGS", "recordings")
+RECORDING_ENCODING = "jpeg"  # keyframes and delta tiles
+RECORDING_QUALITY = 80
+RECORDING_KEYFRAME_INTERVAL = 10  # seconds between full frames, the most a seek has to replay
+RECORDING_SEGMENT_SIZE = 64 * 1024 * 1024  # bytes of frames per segment file
+RECORDING_FLUSH_INTERVAL = 1      # seconds between writes of the buffered data to disk
+RECORDING_BUFFER_SIZE = 1024 * 1024
+
+FRAME_MIMETYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Raw screencap pixel formats: bytes per pixel and Pillow (mode, raw decoder mode)
+RAW_PIXEL_FORMATS = {
+    1: (4, "RGBA", "RGBA"),   # RGBA_8888
+    2: (4, "RGB", "RGBX"),    # RGBX_8888
+    3: (3, "RGB", "RGB"),     # RGB_888
+    4: (2, "RGB", "BGR;16"),  # RGB_565
+    5: (4, "RGBA", "BGRA"),   # BGRA_8888
+}
 
-def run_adb_command(command):
-    """Execute an ADB command and return the result"""
+# WebSocket frame message: type, seq, timestamp, width, height, encoding.
+# Width and height are the full-resolution (device) dimensions of the frame,
+# the payload itself may be downscaled.
+WS_FRAME_HEADER = struct.Struct("!BIdHHB")
+WS_MSG_FRAME = 1
+# Dirty tiles message: the frame header (type WS_MSG_TILES), a uint16 tile count,
+# then per tile x, y, width, height (device pixels), payload length, payload
+WS_MSG_TILES = 2
+WS_TILE_COUNT = struct.Struct("!H")
+WS_TILE_HEADER = struct.Struct("!HHHHI")
+WS_ENCODINGS = {"png": 1, "jpeg": 2, "webp": 3}
+# H.264 access unit: type WS_MSG_VIDEO, seq, timestamp, keyframe flag, then the
+# Annex B bytes. The codec string comes first as a {"type": "config"} text message.
+WS_VIDEO_HEADER = struct.Struct("!BIdB")
+WS_MSG_VIDEO = 3
+
+# Recording index entry: timestamp, offset in the segment's data file, length, kind
+RECORD_INDEX = struct.Struct("<dQIB")
+RECORD_KEYFRAME = 1          # the whole screen, RECORDING_ENCODING
+RECORD_DELTA = 2             # changed tiles: WS_TILE_COUNT, then WS_TILE_HEADER + data each
+RECORD_INPUT = 3             # an input event as JSON
+
+# H.264 NAL unit types
+NAL_SLICE = 1
+NAL_IDR_SLICE = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_START_CODE = b"\x00\x00\x00\x01"
+
+# Linux input event codes used for sendevent touch injection
+EV_SYN = 0
+EV_KEY = 1
+EV_ABS = 3
+SYN_REPORT = 0
+SYN_MT_REPORT = 2
+BTN_TOUCH = 330
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+
+# Native adb protocol client for host requests (device list) and for the
+# default device when no device could be enumerated
+adb_client = AdbClient()
+
+def run_adb_command(args):
+    """Execute an ADB command and return the result
+
+    args is the argument list after "adb"; it is executed directly, without
+    a shell in between, so no argument is ever interpreted by /bin/sh.
+    """
     try:
         result = subprocess.run(
-            command,
-            shell=True,
+            ["adb"] + args,
             capture_output=True,
             text=True,
-            timeout=10
+            timeout=ADB_COMMAND_TIMEOUT
         )
         return result.returncode == 0, result.stdout, result.stderr
     except subprocess.TimeoutExpired:
@@ -43,32 +229,2845 @@ def run_adb_command(command):
     except Exception as e:
         return False, "", str(e)
 
-def capture_screenshot():
-    """Capture screenshot from Android device"""
+def run_adb_binary(args):
+    """Execute an ADB command and return its raw stdout bytes"""
+    try:
+        result = subprocess.run(
+            ["adb"] + args,
+            capture_output=True,
+            timeout=ADB_COMMAND_TIMEOUT
+        )
+        return result.returncode == 0, result.stdout, result.stderr.decode(errors="replace")
+    except subprocess.TimeoutExpired:
+        return False, b"", "Command timed out"
+    except Exception as e:
+        return False, b"", str(e)
+
+def use_adb_socket():
+    return ADB_BACKEND in ("auto", "socket")
+
+def adb_args(device):
+    """adb binary arguments that select the device"""
+    return ["-s", device.serial] if device.serial else []
+
+def list_devices():
+    """Return (success, devices, error), devices as dicts from `adb devices -l`"""
+    if use_adb_socket():
+        try:
+            return True, adb_client.devices(), ""
+        except (AdbError, OSError) as e:
+            if ADB_BACKEND == "socket":
+                return False, [], str(e)
+    success, output, error = run_adb_command(["devices", "-l"])
+    if not success:
+        return False, [], error or "adb devices failed"
+    return True, parse_devices(output), ""
+
+def adb_exec_out(device, command):
+    """Run command through exec-out and return (success, stdout bytes, error)"""
+    if use_adb_socket():
+        try:
+            return True, device.client.exec_out(command), ""
+        except (AdbError, OSError) as e:
+            if ADB_BACKEND == "socket":
+                return False, b"", str(e)
+    return run_adb_binary(adb_args(device) + ["exec-out"] + command.split())
+
+def adb_exec_out_stream(device, command):
+    """Start command through exec-out and return (success, (read, close), error)
+
+    read(size) returns the next chunk of stdout, b"" at the end; close()
+    stops the command and may be called from another thread.
+    """
+    if use_adb_socket():
+        try:
+            conn = device.client.open_service("exec:" + command)
+            conn.sock.settimeout(None)
+
+            def close():
+                try:
+                    # Wakes up a reader blocked in recv(), close() alone does not
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                conn.close()
+
+            return True, (conn.sock.recv, close), ""
+        except (AdbError, OSError) as e:
+            if ADB_BACKEND == "socket":
+                return False, None, str(e)
+
+    try:
+        process = subprocess.Popen(["adb"] + adb_args(device) + ["exec-out"] + command.split(),
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        return False, None, str(e)
+
+    def close():
+        process.kill()
+        process.wait()
+
+    return True, (process.stdout.read1, close), ""
+
+class SpawnPool:
+    """Started `adb shell` processes for one-off commands through the adb binary
+
+    Every run of the adb binary pays for a fork/exec, the connection to the
+    adb server and the switch to the device before the command can start.
+    The pool keeps processes that got that far ahead of time, waiting on
+    stdin: a command line is written to one of them followed by `exit $?`,
+    so the shell exits with the command's status even where adbd does not
+    pass on the end of stdin (old devices). The used process is replaced in
+    the background, so calls that are not back to back never wait for a
+    spawn. Nothing is started before the adb binary is needed at all.
+    """
+
+    def __init__(self, device, size=SPAWN_POOL_SIZE):
+        self.device = device
+        self.size = size
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+        self.counters = {"spawned": 0, "reused": 0}
+
+    def _spawn(self):
+        process = subprocess.Popen(
+            ["adb"] + adb_args(self.device) + ["shell"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        with self.lock:
+            self.counters["spawned"] += 1
+        return process, time.time()
+
+    def _checkout(self):
+        """Take a started process, or start one now"""
+        with self.lock:
+            while self.idle:
+                process, started = self.idle.popleft()
+                if time.time() - started < SPAWN_MAX_AGE and process.poll() is None:
+                    self.counters["reused"] += 1
+                    return process
+                process.kill()
+                process.wait()
+        return self._spawn()[0]
+
+    def _refill(self):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.idle) >= self.size:
+                        return
+                try:
+                    spawned = self._spawn()
+                except OSError:
+                    return
+                with self.lock:
+                    self.idle.append(spawned)
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def _schedule_refill(self):
+        with self.lock:
+            if self.refilling or len(self.idle) >= self.size:
+                return
+            self.refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def run(self, command, timeout=ADB_COMMAND_TIMEOUT):
+        """Run a shell command line and return (success, output, error)"""
+        try:
+            process = self._checkout()
+        except OSError as e:
+            return False, "", str(e)
+        self._schedule_refill()
+        try:
+            stdout, stderr = process.communicate((command + "\nexit $?\n").encode(), timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            return False, "", "Command timed out"
+        return (process.returncode == 0, stdout.decode(errors="replace"),
+                stderr.decode(errors="replace"))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, idle=len(self.idle))
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                process, _ = self.idle.popleft()
+                process.kill()
+                process.wait()
+
+def adb_shell(device, command):
+    """Run a one-off shell command and return (success, output, error)
+
+    command is a device shell line built from constants and validated
+    numbers only; the adb binary gets it from a started SpawnPool process.
+    """
+    if use_adb_socket():
+        try:
+            return True, device.client.shell(command), ""
+        except (AdbError, OSError) as e:
+            if ADB_BACKEND == "socket":
+                return False, "", str(e)
+    return device.spawn_pool.run(command)
+
+def adb_pull(device, device_path):
+    """Fetch a device file and return (success, contents, error)
+
+    The socket backend reads the file over a kept-open sync connection
+    straight into memory. The adb binary can only pull to a file, so it gets
+    a private temporary one in PULL_DIRECTORY that is removed right away.
+    """
+    if use_adb_socket():
+        try:
+            return True, device.client.pull(device_path), ""
+        except (AdbError, OSError) as e:
+            if ADB_BACKEND == "socket":
+                return False, b"", str(e)
+
+    handle, local_path = tempfile.mkstemp(suffix=os.path.splitext(device_path)[1],
+                                          dir=PULL_DIRECTORY)
+    os.close(handle)
+    try:
+        success, _, error = run_adb_command(adb_args(device) + ["pull", device_path, local_path])
+        if not success:
+            return False, b"", error
+        with open(local_path, "rb") as f:
+            return True, f.read(), ""
+    finally:
+        os.remove(local_path)
+
+def parse_raw_screencap(data):
+    """Turn raw screencap output (header + pixel buffer) into a PIL image
+
+    The header is width, height and pixel format as little-endian uint32,
+    followed by a colour space field on Android 8+. Returns None if the data
+    does not add up, e.g. because the transport mangled the bytes.
+    """
+    if len(data) < 12:
+        return None
+
+    width, height, pixel_format = struct.unpack("<III", data[:12])
+    if pixel_format not in RAW_PIXEL_FORMATS:
+        return None
+
+    bytes_per_pixel, mode, raw_mode = RAW_PIXEL_FORMATS[pixel_format]
+    size = width * height * bytes_per_pixel
+    header_size = len(data) - size
+    if header_size not in (12, 16):
+        return None
+
+    # A memoryview slice maps the pixels without copying the buffer
+    image = Image.frombuffer(mode, (width, height), memoryview(data)[header_size:],
+                             "raw", raw_mode, 0, 1)
+    # Pillow maps RGBX buffers as-is, which PNG cannot store
+    return image if image.mode == mode else image.convert(mode)
+
+def decode_capture(data, raw):
+    """Validate captured bytes and return PNG bytes or a PIL image (raw)"""
+    if raw:
+        return parse_raw_screencap(data)
+    # The IHDR chunk with the dimensions ends at byte 24
+    return data if data.startswith(PNG_SIGNATURE) and len(data) >= 24 else None
+
+def timed(timings, stage, start):
+    """Record the seconds elapsed since start under stage and return the time now"""
+    now = time.time()
+    if timings is not None:
+        timings[stage] = now - start
+    return now
+
+def capture_exec_out(device, raw=False, timings=None):
+    """Capture a screenshot through a single adb exec-out pipe"""
+    start = time.time()
+    success, data, error = adb_exec_out(device, "screencap" if raw else "screencap -p")
+    timed(timings, "exec-out", start)
+    if not success:
+        return False, f"Failed to capture screenshot: {error}"
+
+    start = time.time()
+    frame = decode_capture(data, raw)
+    timed(timings, "decode", start)
+    # A device that mangles binary stdout keeps doing it, see Device.exec_out_enabled()
+    device.exec_out_checked(frame is not None)
+    if frame is None:
+        return False, "exec-out returned invalid image data"
+
+    return True, frame
+
+def screenshot_path(raw, slot=0):
+    """Device-side file of a pulled screenshot, one per capture in flight"""
+    # screencap picks PNG or raw output from the file extension
+    path = RAW_SCREENSHOT_PATH if raw else SCREENSHOT_PATH
+    if slot:
+        base, extension = os.path.splitext(path)
+        path = f"{base}-{slot}{extension}"
+    return path
+
+def capture_pull(device, raw=False, timings=None, slot=0):
+    """Capture a screenshot via screencap on the device, pull and rm"""
+    device_path = screenshot_path(raw, slot)
+
     # Take screenshot on device
-    success, _, error = run_adb_command(f"adb shell screencap -p {SCREENSHOT_PATH}")
+    start = time.time()
+    success, _, error = adb_shell(device, f"screencap {device_path}")
+    start = timed(timings, "screencap", start)
     if not success:
         return False, f"Failed to capture screenshot: {error}"
 
-    # Pull screenshot to computer
-    success, _, error = run_adb_command(f"adb pull {SCREENSHOT_PATH} {LOCAL_SCREENSHOT}")
+    # Pull screenshot into memory
+    success, data, error = adb_pull(device, device_path)
+    start = timed(timings, "pull", start)
     if not success:
         return False, f"Failed to pull screenshot: {error}"
 
     # Delete screenshot from device
-    run_adb_command(f"adb shell rm {SCREENSHOT_PATH}")
+    adb_shell(device, f"rm {device_path}")
+    start = timed(timings, "rm", start)
+
+    frame = decode_capture(data, raw)
+    timed(timings, "decode", start)
+    if frame is None:
+        return False, "Pulled screenshot is not a valid image"
+    return True, frame
 
-    return True, LOCAL_SCREENSHOT
+def capture_screenshot(device, timings=None, slot=0):
+    """Capture screenshot from Android device
+
+    Returns PNG bytes, or a PIL image when CAPTURE_FORMAT is "raw". If a
+    timings dict is given, the seconds spent in each stage are stored in it.
+    Captures running at the same time pass different slots.
+    """
+    raw = CAPTURE_FORMAT == "raw"
+    if CAPTURE_MODE == "exec-out" or (CAPTURE_MODE == "auto" and device.exec_out_enabled()):
+        success, result = capture_exec_out(device, raw, timings)
+        if not success and CAPTURE_MODE == "auto" and device.exec_out_failures:
+            # Invalid image data: pull this one, exec-out may work next time
+            success, result = capture_pull(device, raw, timings, slot)
+    else:
+        success, result = capture_pull(device, raw, timings, slot)
+
+    return success, result
+
+class RateMeter:
+    """Counts events and reports their rate over a sliding window"""
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.events = deque()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def _trim(self, now):
+        while self.events and self.events[0] < now - self.window:
+            self.events.popleft()
+
+    def mark(self):
+        now = time.time()
+        with self.lock:
+            self.events.append(now)
+            self.total += 1
+            self._trim(now)
+
+    def rate(self):
+        with self.lock:
+            self._trim(time.time())
+            return len(self.events) / self.window
+
+class Histogram:
+    """Distribution of durations in seconds over fixed buckets, like Prometheus"""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def bounds(self):
+        """Bucket upper bounds as exported: the configured ones, then +Inf"""
+        return [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, fraction):
+        """Estimate a quantile by interpolating within its bucket"""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = max(self.buckets[index - 1] if index else 0, self.min)
+                upper = min(self.buckets[index] if index < len(self.buckets) else self.max,
+                            self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return 0
+
+    def summary(self):
+        return {"count": self.count,
+                "mean_ms": round(self.sum / self.count * 1000, 2) if self.count else None,
+                "p50_ms": round(self.quantile(0.5) * 1000, 2),
+                "p90_ms": round(self.quantile(0.9) * 1000, 2),
+                "p99_ms": round(self.quantile(0.99) * 1000, 2)}
+
+class Metrics:
+    """Latency histograms by name and labels, for /metrics and /stats
+
+    Names are given without METRIC_PREFIX and end in _seconds. Every
+    observation carries device and model labels where a device is involved,
+    so the per-frame budget can be compared across phones.
+    """
+
+    HELP = {
+        "capture_seconds": "Time to capture one frame from the device",
+        "capture_stage_seconds": "Time spent in each stage of a capture",
+        "encode_seconds": "Time to encode one frame variant on the host",
+        "delivery_seconds": "Time to hand one frame to a viewer, per delivery path",
+        "input_seconds": "Time from queueing an input event until it ran",
+        "input_shell_seconds": "Time the device shell took for one batch of input commands",
+        "http_request_seconds": "Time spent in HTTP request handlers",
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, ((label, value), ...)) -> Histogram
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def summary(self, **match):
+        """Summaries of the histograms whose labels include match
+
+        Returns {name: summary} or {name: {other label values: summary}}.
+        """
+        result = {}
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                labels = dict(labels)
+                if any(labels.get(key) != value for key, value in match.items()):
+                    continue
+                short = name[:-len("_seconds")]
+                rest = [value for key, value in labels.items() if key not in match]
+                if rest:
+                    result.setdefault(short, {})["/".join(rest)] = histogram.summary()
+                else:
+                    result[short] = histogram.summary()
+        return result
+
+    def prometheus(self):
+        """The histograms in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            described = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = METRIC_PREFIX + name
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {metric} {self.HELP.get(name, name)}")
+                    lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.bounds(), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{prometheus_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{metric}_sum{prometheus_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{prometheus_labels(labels)} {histogram.count}")
+        return lines
+
+def prometheus_labels(labels, **extra):
+    """Render label pairs as {name="value",...}, escaped for the text format"""
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+metrics = Metrics()
+
+class RateController:
+    """Picks the capture interval from measured capture latency
+
+    Captures run back to back at up to 1 / MIN_FRAME_INTERVAL FPS while the
+    device keeps up. When latency climbs well above the best recent latency
+    the device or USB link is saturated and the interval backs off
+    multiplicatively; once latency recovers it shrinks again. A static screen
+    slows capturing to IDLE_FRAME_INTERVAL, and input events switch to full
+    speed for INPUT_BOOST_DURATION seconds since the screen is about to change.
+    """
 
-def send_tap(x, y):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interval = MIN_FRAME_INTERVAL
+        self.latency = None          # smoothed capture latency
+        self.recent = deque(maxlen=20)
+        self.stages = {}             # smoothed latency per capture stage
+        self.unchanged_streak = 0
+        self.boost_until = 0
+        self.state = "normal"
+
+    def notify_input(self):
+        with self.lock:
+            self.boost_until = time.time() + INPUT_BOOST_DURATION
+            self.unchanged_streak = 0
+
+    def update(self, latency, changed, timings=None):
+        """Feed one capture's measurements, return how long to sleep"""
+        with self.lock:
+            self.recent.append(latency)
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+            for stage, seconds in (timings or {}).items():
+                previous = self.stages.get(stage, seconds)
+                self.stages[stage] = 0.7 * previous + 0.3 * seconds
+            self.unchanged_streak = 0 if changed else self.unchanged_streak + 1
+            baseline = min(self.recent)
+
+            if time.time() < self.boost_until:
+                self.state = "boost"
+                self.interval = MIN_FRAME_INTERVAL
+            elif self.latency > SATURATION_FACTOR * baseline and len(self.recent) > 3:
+                self.state = "backoff"
+                self.interval = min(MAX_FRAME_INTERVAL, max(self.interval, self.latency) * 1.5)
+            elif self.unchanged_streak >= IDLE_AFTER_UNCHANGED:
+                self.state = "idle"
+                self.interval = min(max(self.interval * 1.25, MIN_FRAME_INTERVAL), IDLE_FRAME_INTERVAL)
+            else:
+                self.state = "normal"
+                self.interval = max(MIN_FRAME_INTERVAL, self.interval * 0.8)
+
+            return max(0, self.interval - latency)
+
+    def status(self):
+        with self.lock:
+            latency = self.latency or 0
+            return {
+                "state": self.state,
+                "target_fps": round(1 / max(self.interval, latency, 1e-3), 2),
+                "target_interval_ms": round(self.interval * 1000),
+                "capture_latency_ms": round(latency * 1000),
+                "stage_latency_ms": {stage: round(seconds * 1000)
+                                     for stage, seconds in self.stages.items()},
+            }
+
+class CapturePipeline:
+    """Keeps several captures of one device in flight and picks how many
+
+    A capture passes through the device CPU (screencap compressing the
+    screen), the USB link and the host (decoding); run strictly one after
+    another, each of them idles while the others work. With a depth of N up
+    to N captures overlap, started latency / N apart. Every capture gets a
+    ticket in start order: one that completes after a later-started capture
+    was published is stale and dropped, so frames never go back in time. A
+    capture also holds a slot while it runs, which gives it its own
+    screenshot file on the device in pull mode.
+
+    With CAPTURE_PIPELINE_DEPTH = 0 the depth is tuned while capturing is
+    bound by capture latency rather than by the target interval: after
+    PIPELINE_TUNE_INTERVAL seconds at one depth, one more capture in flight
+    is tried and kept only if the frame rate rises by PIPELINE_TUNE_GAIN.
+    A saturated device (rate controller backing off) loses one.
+    """
+
+    def __init__(self, depth=None):
+        self.lock = threading.Lock()
+        self.fixed = CAPTURE_PIPELINE_DEPTH if depth is None else depth
+        self.depth = self.fixed or 1
+        self.in_flight = {}     # ticket -> slot
+        self.tickets = 0
+        self.published = 0      # newest ticket that produced a frame
+        self.last_start = 0
+        self.stale = 0
+        self.window = (time.time(), 0)   # start and captures of the tuning window
+        self.trial = None       # (depth, fps) to go back to if the deeper trial is no better
+        self.hold_until = 0
+
+    def begin(self):
+        """Start a capture, returns (ticket, slot) or None when depth captures run"""
+        with self.lock:
+            if len(self.in_flight) >= self.depth:
+                return None
+            self.tickets += 1
+            used = set(self.in_flight.values())
+            slot = next(slot for slot in range(self.depth) if slot not in used)
+            self.in_flight[self.tickets] = slot
+            self.last_start = time.time()
+            return self.tickets, slot
+
+    def spacing(self, interval, latency):
+        """Seconds between capture starts"""
+        return max(interval, (latency or 0) / self.depth) if self.depth > 1 else interval
+
+    def stagger(self, interval, latency):
+        """Seconds until another capture may start beside the running ones, or None"""
+        with self.lock:
+            if len(self.in_flight) >= self.depth:
+                return None
+            return self.spacing(interval, latency)
+
+    def next_delay(self, interval, latency):
+        """Seconds from now until the capture after the newest started one"""
+        with self.lock:
+            return max(0, self.last_start + self.spacing(interval, latency) - time.time())
+
+    def finish(self, ticket):
+        """Release a capture's slot, returns False if it is stale"""
+        with self.lock:
+            self.in_flight.pop(ticket, None)
+            if ticket < self.published:
+                self.stale += 1
+                return False
+            self.published = ticket
+            return True
+
+    def tune(self, state, interval, latency):
+        """Adjust the depth after a published capture, given the rate controller's view"""
+        if self.fixed:
+            return
+        with self.lock:
+            now = time.time()
+            start, count = self.window
+            count += 1
+            if state == "backoff" and self.depth > 1:
+                self.depth -= 1
+                self.trial = None
+                self.hold_until = now + PIPELINE_TUNE_HOLD
+                self.window = (now, 0)
+                return
+            if latency / self.depth <= interval:
+                # The target interval limits the rate, more overlap cannot help
+                self.trial = None
+                self.window = (now, 0)
+                return
+            if now - start < PIPELINE_TUNE_INTERVAL:
+                self.window = (start, count)
+                return
+
+            fps = count / (now - start)
+            self.window = (now, 0)
+            if self.trial is not None:
+                depth, previous_fps = self.trial
+                self.trial = None
+                if fps < previous_fps * PIPELINE_TUNE_GAIN:
+                    self.depth = depth
+                    self.hold_until = now + PIPELINE_TUNE_HOLD
+                    return
+            if self.depth < CAPTURE_PIPELINE_MAX and now >= self.hold_until:
+                self.trial = (self.depth, fps)
+                self.depth += 1
+
+    def stats(self):
+        with self.lock:
+            return {"depth": self.depth, "mode": "fixed" if self.fixed else "auto",
+                    "in_flight": len(self.in_flight), "stale_dropped": self.stale,
+                    "trying": self.trial is not None}
+
+def render_image(image, encoding, quality, max_size, rect=None):
+    """Scale image (or the rect region of it) to max_size and encode it
+
+    A region is scaled by the same factor as the whole image would be.
+    """
+    if rect is not None:
+        x, y, width, height = rect
+        full_size = max(image.size)
+        image = image.crop((x, y, x + width, y + height))
+        if max_size and full_size > max_size:
+            scale = max_size / full_size
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                 Image.BILINEAR)
+    elif max_size and max(image.size) > max_size:
+        image = image.copy()
+        image.thumbnail((max_size, max_size), Image.BILINEAR)
+
+    output = io.BytesIO()
+    if encoding == "png":
+        image.save(output, format="PNG", compress_level=1)
+    elif encoding == "webp":
+        image.convert("RGB").save(output, format="WEBP", quality=quality)
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+def render_shared(source, encoding, quality, max_size, rect=None):
+    """render_image() in an encode worker, on a frame shared by Frame.shared_source()"""
+    name, length, mode, size = source
+    block = shared_memory.SharedMemory(name)
+    image = None
+    try:
+        if mode is None:
+            image = Image.open(io.BytesIO(block.buf[:length]))
+        else:
+            # Maps the shared pixels without copying them
+            image = Image.frombuffer(mode, size, block.buf[:length], "raw", mode, 0, 1)
+        return render_image(image, encoding, quality, max_size, rect)
+    finally:
+        # The image holds on to the buffer, which has to go before close()
+        image = None
+        block.close()
+
+def release_shared(block):
+    block.close()
+    block.unlink()
+
+class EncodePool:
+    """Worker processes that decode, scale and encode frames on every core
+
+    Encoding holds the GIL for much of its work, so on one interpreter it
+    competes with the threads that serve input and other viewers. The pool
+    moves it to ENCODE_WORKERS processes: a frame is copied once into a
+    shared memory block (see Frame.shared_source()) and workers read it from
+    there, only the encoded bytes travel back. Every device and every variant
+    goes through the same pool, so the host's cores are shared by all of
+    them. Workers start with forkserver where available, since forking a
+    process full of threads is unsafe. If the pool breaks, encoding
+    continues inline.
+    """
+
+    def __init__(self, mode=None, workers=None):
+        self.mode = ENCODE_POOL if mode is None else mode
+        self.workers = workers if workers is not None else ENCODE_WORKERS
+        self.executor = None
+        self.failed = None
+        self.lock = threading.Lock()
+        self.counters = {"pooled": 0, "inline": 0, "errors": 0}
+
+    def enabled(self):
+        if self.failed is not None:
+            return False
+        if self.mode == "auto":
+            return (os.cpu_count() or 1) > 1
+        return self.mode == "process"
+
+    def size(self):
+        return self.workers or os.cpu_count() or 1
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn")
+                self.executor = ProcessPoolExecutor(self.size(), mp_context=context)
+            return self.executor
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def render(self, frame, encoding, quality, max_size, rect=None):
+        """Encode frame in a worker, returns None when it has to be done inline"""
+        if not self.enabled():
+            self._count("inline")
+            return None
+        try:
+            future = self._executor().submit(render_shared, frame.shared_source(),
+                                             encoding, quality, max_size, rect)
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            # Workers or shared memory cannot be set up here, stop using them
+            self.failed = str(e)
+            self._count("errors")
+            return None
+        try:
+            data = future.result(ENCODE_TIMEOUT)
+        except BrokenProcessPool as e:
+            # A worker died, stop using them
+            self.failed = str(e)
+            self._count("errors")
+            return None
+        except Exception:
+            # One frame the workers could not handle, e.g. a timeout, or
+            # an error raised while rendering it
+            self._count("errors")
+            return None
+        self._count("pooled")
+        return data
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, enabled=self.enabled(), mode=self.mode,
+                        workers=self.size() if self.executor is not None else 0,
+                        error=self.failed)
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+
+encode_pool = EncodePool()
+
+class Frame:
+    """A captured frame together with its sequence number and timing
+
+    The source is either the PNG produced by the device or a PIL image from a
+    raw capture. Other encodings and sizes are produced on demand with
+    encode() and cached, so every variant is encoded at most once per frame:
+    viewers asking for a variant that is being encoded wait for it. The
+    encoding itself runs on the encode pool when there is one.
+    """
+
+    def __init__(self, seq, source, timestamp, latency, labels=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.latency = latency
+        self.labels = labels or {}  # metric labels of the device it came from
+        self.display = None   # DisplayGeometry.snapshot() of the device when captured
+        self.lock = threading.Lock()
+        self.variants = {}
+        self.encoding = {}    # variant key -> event set once it is encoded
+        self._pixels = None
+        self._shared = None   # (shared memory block, descriptor) for encode workers
+        if isinstance(source, Image.Image):
+            self.png = None
+            self.digest = None
+            self._image = source
+            self.width, self.height = source.size
+        else:
+            self.png = source
+            self.digest = hashlib.blake2b(source, digest_size=16).digest()
+            self._image = None
+            # Dimensions straight from the PNG IHDR chunk, no decode needed
+            self.width, self.height = struct.unpack(">II", source[16:24])
+
+    def image(self):
+        """Return the frame as a decoded PIL image"""
+        if self._image is None:
+            image = Image.open(io.BytesIO(self.png))
+            image.load()
+            self._image = image
+        return self._image
+
+    def pixels(self):
+        """Return the frame as a NumPy array of shape (height, width, channels)"""
+        if self._pixels is None:
+            self._pixels = np.asarray(self.image())
+        return self._pixels
+
+    def shared_source(self):
+        """Copy the source into shared memory once, returns what render_shared() needs
+
+        PNG sources are shared as they are and decoded by the workers; raw
+        captures are shared as bare pixels. The block is freed with the frame.
+        """
+        with self.lock:
+            if self._shared is None:
+                if self.png is not None:
+                    data, mode = self.png, None
+                else:
+                    data, mode = self._image.tobytes(), self._image.mode
+                block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+                weakref.finalize(self, release_shared, block)
+                block.buf[:len(data)] = data
+                self._shared = (block, (block.name, len(data), mode, (self.width, self.height)))
+            return self._shared[1]
+
+    def nbytes(self):
+        """Memory held by the frame: source, decoded copies and encoded variants"""
+        with self.lock:
+            size = sum(len(data) for data in self.variants.values())
+            if self._shared is not None:
+                size += self._shared[1][1]
+        if self.png is not None:
+            size += len(self.png)
+        if self._image is not None:
+            size += self.width * self.height * len(self._image.getbands())
+        if self._pixels is not None:
+            size += self._pixels.nbytes
+        return size
+
+    def same_as(self, other):
+        """Return True if other shows exactly the same picture"""
+        if self.png is not None and other.png is not None:
+            # Identical pixels give identical PNGs, no need to decode
+            return self.digest == other.digest
+        if np is not None:
+            a, b = self.pixels(), other.pixels()
+            return a.shape == b.shape and np.array_equal(a, b)
+        return self.image().tobytes() == other.image().tobytes()
+
+    def dirty_rects(self, other, tile_size=TILE_SIZE):
+        """Return the rectangles (x, y, width, height) that changed since other
+
+        The frame is compared in tile_size tiles; changed tiles are merged
+        into horizontal runs and runs spanning consecutive rows into larger
+        rectangles. Returns None if the frames cannot be compared.
+        """
+        if np is None:
+            return None
+        a, b = self.pixels(), other.pixels()
+        if a.shape != b.shape:
+            return None
+
+        height, width = a.shape[:2]
+        changed = (a != b).any(axis=2) if a.ndim == 3 else a != b
+        rows = -(-height // tile_size)
+        cols = -(-width // tile_size)
+        padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+        padded[:height, :width] = changed
+        tiles = padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+        rects = []
+        open_rects = {}  # (first col, last col) -> rect still growing downwards
+        for row in range(rows):
+            runs = []
+            dirty = np.flatnonzero(tiles[row])
+            if len(dirty):
+                breaks = np.flatnonzero(np.diff(dirty) > 1)
+                starts = np.concatenate(([dirty[0]], dirty[breaks + 1]))
+                ends = np.concatenate((dirty[breaks], [dirty[-1]]))
+                runs = list(zip(starts.tolist(), ends.tolist()))
+
+            next_open = {}
+            for run in runs:
+                rect = open_rects.get(run)
+                if rect is None:
+                    rect = [run[0] * tile_size, row * tile_size,
+                            min((run[1] + 1) * tile_size, width) - run[0] * tile_size, 0]
+                    rects.append(rect)
+                rect[3] = min((row + 1) * tile_size, height) - rect[1]
+                next_open[run] = rect
+            open_rects = next_open
+
+        return [tuple(rect) for rect in rects]
+
+    def encode_region(self, rect, encoding, quality=FRAME_QUALITY, max_size=FRAME_MAX_SIZE):
+        """Encode one rectangle of the frame, scaled like encode() with max_size"""
+        return self._encode(encoding, min(max(quality, 1), 100), max_size, tuple(rect))
+
+    def encode(self, encoding=None, quality=FRAME_QUALITY, max_size=FRAME_MAX_SIZE):
+        """Return the frame as encoding ("png", "jpeg" or "webp") bytes
+
+        max_size limits the longest side; 0 keeps full resolution.
+        """
+        encoding = frame_encoding(self, encoding, max_size)
+        if encoding == "png" and self.png is not None and not max_size:
+            return self.png
+
+        quality = min(max(quality, 1), 100)
+        key = (encoding, quality if encoding != "png" else 0, max_size)
+        while True:
+            with self.lock:
+                data = self.variants.get(key)
+                if data is not None:
+                    return data
+                pending = self.encoding.get(key)
+                if pending is None:
+                    self.encoding[key] = threading.Event()
+                    break
+            # Another viewer is encoding this variant, use its result
+            pending.wait()
+
+        try:
+            start = time.time()
+            data = self._encode(encoding, quality, max_size)
+            metrics.observe("encode_seconds", time.time() - start, encoding=encoding, **self.labels)
+            with self.lock:
+                self.variants[key] = data
+        finally:
+            with self.lock:
+                self.encoding.pop(key).set()
+        return data
+
+    def _encode(self, encoding, quality, max_size, rect=None):
+        data = encode_pool.render(self, encoding, quality, max_size, rect)
+        if data is None:
+            data = render_image(self.image(), encoding, quality, max_size, rect)
+        return data
+
+def frame_encoding(frame, encoding, max_size):
+    """Resolve the encoding actually used by frame.encode()"""
+    if encoding is None:
+        return "png" if frame.png is not None and not max_size else FRAME_ENCODING
+    return encoding
+
+def frame_transform(frame, options):
+    """Headers that map a frame served with the given options to device pixels
+
+    Device x = served x / X-Frame-Scale, in the display rotation the frame
+    was captured in.
+    """
+    longest = max(frame.width, frame.height)
+    max_size = options["max_size"]
+    scale = max_size / longest if max_size and longest > max_size else 1
+    display = frame.display or {}
+    return {"X-Frame-Width": str(frame.width), "X-Frame-Height": str(frame.height),
+            "X-Frame-Scale": f"{scale:.6g}", "X-Display-Rotation": str(display.get("rotation", 0))}
+
+def frame_etag(frame, options):
+    """Return (encoding, ETag) of frame as served with the given options"""
+    encoding = frame_encoding(frame, options["encoding"], options["max_size"])
+    return encoding, f'{frame.seq}-{encoding}-{options["quality"]}-{options["max_size"]}'
+
+def mjpeg_header(data):
+    """Headers of one multipart/x-mixed-replace MJPEG part
+
+    Streams send these followed by data itself, so frames are written out
+    without being copied into a bigger buffer first.
+    """
+    return (b"\r\n--frame\r\n"
+            b"Content-Type: image/jpeg\r\n"
+            b"Content-Length: " + str(len(data)).encode() + b"\r\n\r\n")
+
+def frame_options(args):
+    """Read encoding, quality and max size from request query arguments
+
+    Returns (options dict, error message).
+    """
+    encoding = args.get('encoding')
+    if encoding is not None and encoding not in FRAME_MIMETYPES:
+        return None, f"Unsupported encoding: {encoding}"
+    # Clamped here so requests that encode the same bytes share an ETag
+    quality = min(max(args.get('quality', FRAME_QUALITY, type=int), 1), 100)
+    max_size = args.get('max', FRAME_MAX_SIZE, type=int)
+    return {"encoding": encoding, "quality": quality, "max_size": max(max_size, 0)}, None
+
+class FrameStore:
+    """Buffered frames of every device, kept in memory by (serial, seq)
+
+    Frames hold the bytes the device sent (or the image of a raw capture)
+    and the variants encoded from them, and handlers serve those objects
+    as they are, so nothing goes through the disk. Each device keeps its
+    newest buffer_size frames. Viewers pin the frame they are working on
+    with acquire() and release(), which keeps it addressable by seq until
+    they are done. When limit is exceeded the oldest unpinned frames of any
+    device are evicted first; a device's newest frame is never evicted.
+    """
+
+    def __init__(self, buffer_size=FRAME_BUFFER_SIZE, limit=FRAME_MEMORY_LIMIT):
+        self.buffer_size = buffer_size
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()  # (serial, seq) -> frame, oldest first
+        self.newest = {}             # serial -> newest frame
+        self.refs = {}               # (serial, seq) -> viewers holding the frame
+        self.evicted = 0
+
+    def add(self, serial, frame):
+        with self.lock:
+            self.frames[(serial, frame.seq)] = frame
+            self.newest[serial] = frame
+            self._evict()
+
+    def latest(self, serial):
+        with self.lock:
+            return self.newest.get(serial)
+
+    def get(self, serial, seq):
+        with self.lock:
+            return self.frames.get((serial, seq))
+
+    def acquire(self, serial, frame):
+        """Pin frame so it is not evicted while a viewer sends it"""
+        key = (serial, frame.seq)
+        with self.lock:
+            self.refs[key] = self.refs.get(key, 0) + 1
+
+    def release(self, serial, frame):
+        key = (serial, frame.seq)
+        with self.lock:
+            self.refs[key] -= 1
+            if not self.refs[key]:
+                del self.refs[key]
+                self._evict()
+
+    def _evict(self):
+        """Drop unpinned frames beyond the buffer size, then oldest first until under limit"""
+        counts = Counter(serial for serial, _ in self.frames)
+        total = self._total() if self.limit else 0
+        for key, frame in list(self.frames.items()):
+            serial = key[0]
+            if key in self.refs or frame is self.newest[serial]:
+                continue
+            if counts[serial] > self.buffer_size:
+                pass
+            elif self.limit and total > self.limit:
+                self.evicted += 1
+            else:
+                continue
+            del self.frames[key]
+            counts[serial] -= 1
+            if self.limit:
+                total -= frame.nbytes()
+
+    def _total(self):
+        return sum(frame.nbytes() for frame in self.frames.values())
+
+    def stats(self):
+        with self.lock:
+            return {"frames": len(self.frames), "bytes": self._total(), "limit": self.limit,
+                    "pinned": len(self.refs), "evicted": self.evicted}
+
+frame_store = FrameStore()
+
+class CapturePool:
+    """Worker threads shared by the capture engines of all devices
+
+    Engines ask to be run again after the delay their rate controller picked.
+    A free worker takes the engine that has been due the longest, skipping
+    engines whose USB bus already has USB_BUS_CAPTURES captures in flight, so
+    phones behind one hub share its bandwidth instead of stalling each other,
+    and a rack of devices needs a bounded number of threads rather than one
+    each.
+    """
+
+    def __init__(self, workers=CAPTURE_WORKERS, per_bus=USB_BUS_CAPTURES):
+        self.workers = workers
+        self.per_bus = per_bus
+        self.condition = threading.Condition()
+        self.due = {}       # engine -> time its next capture should start
+        self.busy = {}      # bus -> captures running on it
+        self.buses = set()
+        self.threads = []
+
+    def size(self):
+        if self.workers:
+            return self.workers
+        # Captures mostly wait on the device, so every bus can keep per_bus
+        # workers busy; decoding and diffing want at least one per core
+        return max(os.cpu_count() or 1, self.per_bus * len(self.buses))
+
+    def schedule(self, engine, delay=0):
+        """Run engine.step() after delay seconds, or earlier if it is already due"""
+        with self.condition:
+            self._due(engine, delay)
+            self.buses.add(engine.device.bus)
+            while len(self.threads) < self.size():
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.condition.notify()
+
+    def _due(self, engine, delay):
+        when = time.time() + delay
+        self.due[engine] = min(self.due.get(engine, when), when)
+
+    def stats(self):
+        with self.condition:
+            return {"workers": len(self.threads), "scheduled": len(self.due),
+                    "running": sum(self.busy.values())}
+
+    def _take(self):
+        with self.condition:
+            while True:
+                ready = [(when, engine) for engine, when in self.due.items()
+                         if self.busy.get(engine.device.bus, 0) < self.per_bus]
+                if not ready:
+                    self.condition.wait()
+                    continue
+                when, engine = min(ready, key=lambda item: item[0])
+                remaining = when - time.time()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                del self.due[engine]
+                self.busy[engine.device.bus] = self.busy.get(engine.device.bus, 0) + 1
+                return engine
+
+    def _work(self):
+        while True:
+            engine = self._take()
+            delay = None
+            try:
+                delay = engine.step()
+            except Exception as e:
+                # step() records failed captures itself; whatever else goes
+                # wrong must not end the worker or leave the engine unscheduled
+                engine.last_error = f"Capture failed: {e}"
+                delay = CAPTURE_ERROR_BACKOFF
+            finally:
+                with self.condition:
+                    self.busy[engine.device.bus] -= 1
+                    if delay is not None:
+                        self._due(engine, delay)
+                    self.condition.notify_all()
+
+capture_pool = CapturePool()
+
+class CaptureEngine:
+    """Keeps capturing frames from one device on the shared capture pool
+
+    Frames go into the shared frame store so HTTP handlers only ever read
+    the latest ready frame instead of talking to the device themselves. Capturing
+    starts on the first request and pauses once nobody asked for a frame for
+    CAPTURE_IDLE_TIMEOUT seconds, so device load does not depend on how many
+    viewers are connected. While only wall view thumbnails are watched the
+    engine captures at most every WALL_FRAME_INTERVAL and encodes the
+    thumbnail right away, so all wall viewers share one small JPEG per frame.
+    Several captures can be in flight at once (see CapturePipeline): each
+    step() that starts one asks the pool for the next overlapping step.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.unchanged = 0
+        self.last_error = None
+        self.last_request = 0
+        self.last_focus = 0
+        self.active = False
+        self.subscribers = 0
+        self.skipped = 0
+        self.rate = RateMeter()
+        self.controller = RateController()
+        self.pipeline = CapturePipeline()
+        # Completed captures are recorded one at a time, in any order
+        self.record_lock = threading.Lock()
+
+    def touch(self, thumbnail=False):
+        """Record viewer interest and make sure capturing is scheduled
+
+        Viewers that only show a thumbnail pass thumbnail=True and do not
+        raise the capture rate.
+        """
+        with self.condition:
+            self.last_request = time.time()
+            if not thumbnail:
+                self.last_focus = self.last_request
+            if not self.active:
+                self.active = True
+                capture_pool.schedule(self)
+
+    def focused(self):
+        """Whether a full-size viewer asked for a frame recently"""
+        return time.time() - self.last_focus < FOCUS_TIMEOUT
+
+    def latest(self):
+        """Return the newest frame or None"""
+        return frame_store.latest(self.device.serial)
+
+    def get(self, seq):
+        """Return the frame with the given sequence number if still buffered"""
+        return frame_store.get(self.device.serial, seq)
+
+    def wait_for_frame(self, after_seq=0, timeout=FRAME_WAIT_TIMEOUT):
+        """Block until a frame newer than after_seq exists, or timeout"""
+        deadline = time.time() + timeout
+        with self.condition:
+            frame = self.latest()
+            while frame is None or frame.seq <= after_seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+                frame = self.latest()
+            return frame
+
+    def subscribe(self, thumbnail=False):
+        """Return a Subscriber that follows this engine's frames"""
+        return Subscriber(self, thumbnail)
+
+    def pause_if_idle(self):
+        """Stop capturing if nobody asked for a frame lately, returns True if so"""
+        with self.condition:
+            if time.time() - self.last_request >= CAPTURE_IDLE_TIMEOUT:
+                self.active = False
+            return not self.active
+
+    def interval(self):
+        """Target seconds between capture starts"""
+        if self.focused():
+            return self.controller.interval
+        return max(self.controller.interval, WALL_FRAME_INTERVAL)
+
+    def begin(self):
+        """Start a capture if the pipeline has room, returns (ticket, slot) or None
+
+        Also returns how many seconds later another capture may start beside
+        this one, or None.
+        """
+        capture = self.pipeline.begin()
+        if capture is None:
+            return None, None
+        return capture, self.pipeline.stagger(self.interval(), self.controller.latency)
+
+    def step(self):
+        """Capture one frame, returns the delay before the next or None to pause
+
+        None is also returned when the pipeline is full; the captures in
+        flight schedule the next one.
+        """
+        if self.pause_if_idle():
+            return None
+        capture, stagger = self.begin()
+        if capture is None:
+            return None
+        ticket, slot = capture
+        if stagger is not None:
+            capture_pool.schedule(self, stagger)
+
+        timings = {}
+        start = time.time()
+        try:
+            success, result = capture_screenshot(self.device, timings, slot)
+            return self.record(success, result, time.time() - start, timings, ticket)
+        except Exception as e:
+            # Image data the device mangled in a way decode_capture() lets
+            # through, for one; keep capturing after the usual backoff
+            return self.fail(ticket, f"Capture failed: {e}")
+
+    def fail(self, ticket, error):
+        """Record a capture that raised, returns the delay before the next"""
+        self.pipeline.finish(ticket)
+        with self.condition:
+            self.last_error = error
+            self.condition.notify_all()
+        return CAPTURE_ERROR_BACKOFF
+
+    def record(self, success, result, latency, timings, ticket):
+        """Store the outcome of one capture, returns the delay before the next"""
+        with self.record_lock:
+            return self._record(success, result, latency, timings, ticket)
+
+    def _record(self, success, result, latency, timings, ticket):
+        if not self.pipeline.finish(ticket):
+            # A capture started later already delivered a newer screen
+            return self.pipeline.next_delay(self.interval(), self.controller.latency)
+        if not success:
+            with self.condition:
+                self.last_error = result
+                self.condition.notify_all()
+            return CAPTURE_ERROR_BACKOFF
+
+        labels = self.device.labels
+        frame = Frame(self.seq + 1, result, time.time(), latency, labels)
+        self.device.geometry.observe(frame)
+        frame.display = self.device.geometry.snapshot()
+        previous = self.latest()
+        self.rate.mark()
+
+        # An unchanged screen keeps the previous sequence number, so pollers
+        # get 304s and streams have nothing to push
+        diff_start = time.time()
+        changed = previous is None or not frame.same_as(previous)
+        timed(timings, "diff", diff_start)
+        metrics.observe("capture_seconds", latency, **labels)
+        for stage, seconds in timings.items():
+            metrics.observe("capture_stage_seconds", seconds, stage=stage, **labels)
+
+        with self.condition:
+            if changed:
+                self.seq += 1
+                frame_store.add(self.device.serial, frame)
+                self.condition.notify_all()
+            else:
+                self.unchanged += 1
+            self.last_error = None
+
+        self.controller.update(latency, changed, timings)
+        self.pipeline.tune(self.controller.state, self.interval(), self.controller.latency)
+        if not self.focused() and changed:
+            frame.encode("jpeg", WALL_THUMBNAIL_QUALITY, WALL_THUMBNAIL_SIZE)
+        return self.pipeline.next_delay(self.interval(), self.controller.latency)
+
+class Subscriber:
+    """One viewer's position in a device's stream of frames
+
+    The engine is the only producer; any number of subscribers read its
+    frames from the frame store. next() returns the newest frame the subscriber has not
+    seen. Frames captured while the viewer was still busy with the previous
+    one are skipped (and counted) instead of queued, so a slow viewer never
+    falls more than one frame behind and never holds up the capture or
+    other viewers. The frame last taken stays pinned in the store until the
+    next one is taken or the subscriber is closed.
+    """
+
+    def __init__(self, engine, thumbnail=False):
+        self.engine = engine
+        self.thumbnail = thumbnail
+        self.seq = 0
+        self.delivered = 0
+        self.frame = None
+        with engine.condition:
+            engine.subscribers += 1
+
+    def accept(self, frame):
+        """Take frame if it is newer than the last one, returns True if taken"""
+        if frame is None or frame.seq <= self.seq:
+            return False
+        if self.seq:
+            with self.engine.condition:
+                self.engine.skipped += frame.seq - self.seq - 1
+        self._pin(frame)
+        self.seq = frame.seq
+        self.delivered += 1
+        return True
+
+    def _pin(self, frame):
+        serial = self.engine.device.serial
+        if frame is not None:
+            frame_store.acquire(serial, frame)
+        if self.frame is not None:
+            frame_store.release(serial, self.frame)
+        self.frame = frame
+
+    def next(self, timeout=FRAME_WAIT_TIMEOUT):
+        """Wait for a newer frame, returns it or None on timeout"""
+        self.engine.touch(self.thumbnail)
+        frame = self.engine.wait_for_frame(self.seq, timeout)
+        return frame if self.accept(frame) else None
+
+    def close(self):
+        self._pin(None)
+        with self.engine.condition:
+            self.engine.subscribers -= 1
+
+class AnnexBSplitter:
+    """Splits an H.264 Annex B byte stream into NAL units
+
+    Units are separated by 00 00 01 start codes (00 00 00 01 in front of
+    parameter sets and pictures). A unit is only known to be complete once
+    the next start code arrives, so flush() hands out the rest of the buffer
+    when the stream has gone quiet.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scanned = 0
+
+    def feed(self, data):
+        """Add data and return the NAL units it completed"""
+        self.buffer += data
+        units = []
+        start = self.buffer.find(b"\x00\x00\x01")
+        if start == -1:
+            # Keep a start code split across chunks
+            del self.buffer[:-2]
+            self.scanned = 0
+            return units
+        while True:
+            end = self.buffer.find(b"\x00\x00\x01", max(start + 3, self.scanned))
+            if end == -1:
+                break
+            units.append(self._unit(start + 3, end))
+            start = end
+        del self.buffer[:start]
+        self.scanned = max(len(self.buffer) - 2, 0)
+        return [unit for unit in units if unit]
+
+    def flush(self):
+        """Return the buffered unit as complete, if there is one"""
+        start = self.buffer.find(b"\x00\x00\x01")
+        unit = self._unit(start + 3, len(self.buffer)) if start != -1 else b""
+        self.buffer.clear()
+        self.scanned = 0
+        return [unit] if unit else []
+
+    def _unit(self, start, end):
+        # Zero bytes before a start code belong to it (or are trailing padding)
+        return bytes(memoryview(self.buffer)[start:end]).rstrip(b"\x00")
+
+class VideoStream:
+    """H.264 video of one device from `screenrecord`, shared by all video viewers
+
+    One screenrecord process per device writes an Annex B stream that is
+    split into NAL units and grouped into access units, one picture each.
+    Keyframes carry the SPS and PPS so decoding can start at any of them,
+    and everything since the last keyframe is kept so a viewer joining in
+    between starts there. A viewer that falls behind the last keyframe skips
+    ahead to it. screenrecord stops by itself after VIDEO_TIME_LIMIT seconds
+    and is restarted right away; CAPTURE_IDLE_TIMEOUT seconds after the last
+    viewer left it is stopped.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.condition = threading.Condition()
+        self.units = []      # (seq, keyframe, timestamp, data) since the last keyframe
+        self.gop_bytes = 0
+        self.synced = False  # False while waiting for a keyframe
+        self.seq = 0
+        self.sps = None
+        self.pps = None
+        self.codec = None
+        self.size = None
+        self.picture = []    # NAL units of the picture being received
+        self.viewers = 0
+        self.last_viewer = 0
+        self.running = False
+        self.error = None
+        self.restarts = 0
+        self.skipped = 0
+        self.rate = RateMeter()
+
+    def subscribe(self):
+        """Register a viewer and make sure screenrecord is running"""
+        with self.condition:
+            self.viewers += 1
+            if not self.running:
+                self.running = True
+                self.error = None
+                # Units of an earlier run are stale, start at the new keyframe
+                self.units = []
+                self.synced = False
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.viewers -= 1
+            self.last_viewer = time.time()
+
+    def idle(self):
+        with self.condition:
+            return not self.viewers and time.time() - self.last_viewer >= CAPTURE_IDLE_TIMEOUT
+
+    def config(self):
+        """Decoder configuration for viewers, or None before the first SPS"""
+        if self.codec is None:
+            return None
+        width, height = self.size or (0, 0)
+        return {"type": "config", "codec": self.codec, "width": width, "height": height}
+
+    def units_after(self, seq, timeout=FRAME_WAIT_TIMEOUT):
+        """Wait for access units newer than seq and return them
+
+        A viewer that missed units (they were dropped with the previous group
+        of pictures) gets everything from the last keyframe instead.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.running and (not self.units or self.units[-1][0] <= seq):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self.condition.wait(remaining)
+            if self.units and self.units[0][0] > seq + 1:
+                if seq:
+                    self.skipped += self.units[0][0] - seq - 1
+                return list(self.units)
+            return [unit for unit in self.units if unit[0] > seq]
+
+    def stats(self):
+        return {"viewers": self.viewers, "running": self.running, "fps": round(self.rate.rate(), 2),
+                "codec": self.codec, "restarts": self.restarts, "units_skipped": self.skipped,
+                "error": self.error}
+
+    def _run(self):
+        if self.size is None:
+            success, output, _ = adb_shell(self.device, "wm size")
+            sizes = re.findall(r"(\d+)x(\d+)", output) if success else []
+            self.size = tuple(int(value) for value in sizes[-1]) if sizes else (0, 0)
+
+        while not self.idle():
+            started = self.seq
+            error = self._record()
+            if self.seq == started and not self.idle():
+                # Not a single picture: old Android, or no encoder available
+                with self.condition:
+                    self.error = error or "screenrecord produced no H.264 video"
+                    break
+            self.restarts += 1
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def _record(self):
+        """Run screenrecord until it exits or viewers are gone, returns an error or None"""
+        command = (f"screenrecord --output-format=h264 --bit-rate {VIDEO_BIT_RATE} "
+                   f"--time-limit {VIDEO_TIME_LIMIT} -")
+        success, source, error = adb_exec_out_stream(self.device, command)
+        if not success:
+            return f"Failed to start screenrecord: {error}"
+        read, close = source
+
+        chunks = queue.Queue()
+
+        def pump():
+            try:
+                for chunk in iter(lambda: read(256 * 1024), b""):
+                    chunks.put(chunk)
+            except OSError:
+                pass
+            chunks.put(b"")
+
+        threading.Thread(target=pump, daemon=True).start()
+        splitter = AnnexBSplitter()
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=VIDEO_FLUSH_DELAY)
+                except queue.Empty:
+                    # Nothing more for now: the last picture is complete
+                    self._add_units(splitter.flush())
+                    self._publish()
+                    if self.idle():
+                        return None
+                    continue
+                if not chunk:
+                    break
+                self._add_units(splitter.feed(chunk))
+            self._add_units(splitter.flush())
+            self._publish()
+        finally:
+            close()
+        return None
+
+    def _add_units(self, units):
+        for unit in units:
+            kind = unit[0] & 0x1f
+            if kind == NAL_SPS:
+                self.sps = unit
+                # avc1.PPCCLL: profile, constraint flags and level from the SPS
+                self.codec = "avc1." + unit[1:4].hex()
+                continue
+            if kind == NAL_PPS:
+                self.pps = unit
+                continue
+            # first_mb_in_slice == 0 (a leading 1 bit) starts a new picture
+            if kind in (NAL_SLICE, NAL_IDR_SLICE) and unit[1] & 0x80 and self._has_slice():
+                self._publish()
+            self.picture.append(unit)
+
+    def _has_slice(self):
+        return any(unit[0] & 0x1f in (NAL_SLICE, NAL_IDR_SLICE) for unit in self.picture)
+
+    def _publish(self):
+        """Hand the received picture to viewers as one access unit"""
+        if not self._has_slice():
+            return
+        units, self.picture = self.picture, []
+        keyframe = any(unit[0] & 0x1f == NAL_IDR_SLICE for unit in units)
+        if keyframe and self.sps is not None and self.pps is not None:
+            units = [self.sps, self.pps] + units
+        data = b"".join(NAL_START_CODE + unit for unit in units)
+
+        with self.condition:
+            self.seq += 1
+            if keyframe:
+                self.units = []
+                self.gop_bytes = 0
+                self.synced = True
+            if not self.synced:
+                return
+            if self.gop_bytes + len(data) > VIDEO_GOP_LIMIT:
+                # Too long without a keyframe, joining viewers wait for the next one
+                self.units = []
+                self.synced = False
+                return
+            self.units.append((self.seq, keyframe, time.time(), data))
+            self.gop_bytes += len(data)
+            self.rate.mark()
+            self.condition.notify_all()
+
+class AdbShell:
+    """A long-lived interactive `adb shell` that commands are written to
+
+    Each command is followed by an echo of a sentinel and the exit status, and
+    output is read up to that sentinel. The sentinel is split with quotes in
+    the command line so devices that echo their input (pty shells on old
+    Android versions) do not trigger it early. The session is an interactive
+    shell: service on the adb server socket, or an `adb shell` process with
+    the subprocess backend, and it is restarted automatically when it dies or
+    a command times out.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.process = None
+        self.conn = None
+        self.lines = None
+        self.finished = None
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.restarts = 0
+
+    def _alive(self):
+        if self.conn is not None:
+            return not self.finished.is_set()
+        return self.process is not None and self.process.poll() is None
+
+    def _start(self):
+        if use_adb_socket():
+            try:
+                self.conn = self.device.client.open_shell()
+            except (AdbError, OSError):
+                if ADB_BACKEND == "socket":
+                    raise
+
+        if self.conn is not None:
+            stream = self.conn.sock.makefile("rb")
+        else:
+            self.process = subprocess.Popen(
+                ["adb"] + adb_args(self.device) + ["shell"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0
+            )
+            stream = self.process.stdout
+
+        self.lines = queue.Queue()
+        self.finished = threading.Event()
+        threading.Thread(target=self._read, args=(stream, self.lines, self.finished),
+                         daemon=True).start()
+
+    @staticmethod
+    def _read(stream, lines, finished):
+        try:
+            for line in iter(stream.readline, b""):
+                lines.put(line.decode(errors="replace").rstrip("\r\n"))
+        except (OSError, ValueError):
+            pass
+        finished.set()
+        lines.put(None)
+
+    def _write(self, data):
+        if self.conn is not None:
+            self.conn.send(data)
+        else:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.kill()
+            self.process = None
+
+    def run(self, command, timeout=SHELL_COMMAND_TIMEOUT):
+        """Run command in the shell and return (success, output)"""
+        with self.lock:
+            if not self._alive():
+                if self.process is not None or self.conn is not None:
+                    self.restarts += 1
+                    self.close()
+                try:
+                    self._start()
+                except (AdbError, OSError) as e:
+                    self.close()
+                    return False, str(e)
+
+            self.counter += 1
+            marker = f"__ADB_MIRROR_DONE_{self.counter}__"
+            sentinel = re.compile(re.escape(marker) + r" (\d+)")
+            line = f'{command}; echo "__ADB_MIRROR_""DONE_{self.counter}__ $?"\n'
+
+            try:
+                self._write(line.encode())
+            except OSError as e:
+                self.close()
+                return False, f"adb shell died: {e}"
+
+            output = []
+            deadline = time.time() + timeout
+            while True:
+                try:
+                    text = self.lines.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    self.close()
+                    return False, "Command timed out"
+                if text is None:
+                    self.close()
+                    return False, "adb shell exited: " + "\n".join(output)
+
+                match = sentinel.search(text)
+                if match:
+                    success = match.group(1) == "0"
+                    return success, "\n".join(output)
+                if command not in text:
+                    output.append(text)
+
+class InputScheduler:
+    """Serializes, coalesces and sheds input events for one device
+
+    Events run strictly in arrival order on a single worker. Whatever queued
+    up while the previous batch was running goes out as one shell line
+    (`input tap ...; input tap ...`), saving a round-trip per event; the exit
+    status of every command is echoed after it, so each event gets its own
+    result. When the device falls behind, a swipe that waited longer than
+    INPUT_STALE_AFTER is dropped if a newer swipe follows it, and touch moves
+    are dropped whenever the next queued event is another move, so drags
+    follow the newest pointer position. Taps, keys and touch steps are never
+    dropped. With INPUT_QUEUE_SIZE events already waiting, new ones are
+    rejected instead of piling up behind a stuck device. Every event has
+    INPUT_WAIT_TIMEOUT seconds from being queued: a batch gets no longer
+    than its earliest event has left, and events out of time are failed
+    without running, so the caller is told what actually happened.
+    """
+
+    STATUS_MARKER = re.compile(r"__ADB_MIRROR_STATUS_(\d+)__ (\d+)")
+
+    def __init__(self, device, size=INPUT_QUEUE_SIZE):
+        self.device = device
+        self.shell = AdbShell(device)
+        self.pending = queue.Queue(maxsize=size)
+        self.lock = threading.Lock()
+        self.counters = {"queued": 0, "executed": 0, "coalesced": 0,
+                         "dropped": 0, "rejected": 0, "batches": 0}
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, pending=self.pending.qsize())
+
+    def submit(self, kind, command):
+        """Queue an input command and wait for it, returns (success, error)"""
+        queued = time.time()
+        item = {"kind": kind, "command": command, "queued": queued,
+                "deadline": queued + INPUT_WAIT_TIMEOUT, "done": threading.Event(), "result": None}
+        try:
+            self.pending.put_nowait(item)
+        except queue.Full:
+            self._count("rejected")
+            return False, "Input queue full, device is not keeping up"
+        self._count("queued")
+
+        # The worker answers by the deadline; the margin covers stopping a timed out shell
+        if not item["done"].wait(INPUT_WAIT_TIMEOUT + SHELL_COMMAND_TIMEOUT):
+            return False, "Input command timed out in queue"
+        return item["result"]
+
+    def _next_batch(self):
+        batch = [self.pending.get()]
+        while len(batch) < INPUT_BATCH_MAX:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _shed(self, batch):
+        """Split a batch into events to run and superseded events to drop"""
+        now = time.time()
+        keep, dropped = [], []
+        for index, item in enumerate(batch):
+            superseded = (
+                item["kind"] == "swipe"
+                and now - item["queued"] > INPUT_STALE_AFTER
+                and any(later["kind"] == "swipe" for later in batch[index + 1:])
+            ) or (
+                item["kind"] == "move"
+                and index + 1 < len(batch) and batch[index + 1]["kind"] == "move"
+            )
+            (dropped if superseded else keep).append(item)
+        return keep, dropped
+
+    def _execute(self, batch):
+        """Run a batch as one shell line and return (success, error) per event"""
+        command = "; ".join(f'{item["command"]}; echo "__ADB_MIRROR_""STATUS_{index}__ $?"'
+                            for index, item in enumerate(batch))
+        timeout = min(SHELL_COMMAND_TIMEOUT * len(batch),
+                      min(item["deadline"] for item in batch) - time.time())
+        success, output = self.shell.run(command, timeout)
+
+        results, lines = [], []
+        for line in output.splitlines():
+            match = self.STATUS_MARKER.search(line)
+            if match and int(match.group(1)) == len(results):
+                ok = match.group(2) == "0"
+                results.append((ok, "" if ok else "\n".join(lines).strip() or "Command failed"))
+                lines = []
+            else:
+                lines.append(line)
+        # The shell died or timed out before these ran to the end
+        error = (output if not success else "") or "Command failed"
+        return results + [(False, error)] * (len(batch) - len(results))
+
+    def _run(self):
+        while True:
+            batch, dropped = self._shed(self._next_batch())
+
+            for item in dropped:
+                item["result"] = (False, "Dropped, superseded by newer input")
+                item["done"].set()
+            self._count("dropped", len(dropped))
+
+            now = time.time()
+            for item in batch:
+                if item["deadline"] <= now:
+                    item["result"] = (False, "Input command timed out in queue")
+                    item["done"].set()
+            batch = [item for item in batch if item["deadline"] > now]
+            if not batch:
+                continue
+
+            start = time.time()
+            results = self._execute(batch)
+            now = time.time()
+            metrics.observe("input_shell_seconds", now - start, **self.device.labels)
+            self._count("batches")
+            self._count("executed", len(batch))
+            self._count("coalesced", len(batch) - 1)
+
+            for item, result in zip(batch, results):
+                metrics.observe("input_seconds", now - item["queued"], kind=item["kind"],
+                                **self.device.labels)
+                item["result"] = result
+                item["done"].set()
+
+def send_tap(device, x, y):
     """Send tap command to device"""
-    success, _, error = run_adb_command(f"adb shell input tap {x} {y}")
+    return device.input.submit("tap", f"input tap {x} {y}")
+
+def send_swipe(device, x1, y1, x2, y2, duration):
+    """Send swipe command to device"""
+    # ADB swipe command: input swipe x1 y1 x2 y2 duration
+    return device.input.submit("swipe", f"input swipe {x1} {y1} {x2} {y2} {duration}")
+
+def send_keyevent(device, key):
+    """Send a keyevent to device"""
+    # ADB: input keyevent <KEYCODE>
+    return device.input.submit("key", f"input keyevent {key}")
+
+def parse_getevent(output):
+    """Find the touchscreen in `getevent -p` output
+
+    Returns a dict with the device path, the ABS_MT_POSITION_X/Y ranges and
+    whether the device uses slots / tracking ids (protocol B), or None.
+    """
+    devices = []
+    current = None
+    for line in output.splitlines():
+        match = re.match(r"\s*add device \d+: (\S+)", line)
+        if match:
+            current = {"path": match.group(1), "abs": {}}
+            devices.append(current)
+            continue
+        match = re.search(r"([0-9a-f]{4})\s+:\s+value -?\d+, min (-?\d+), max (-?\d+)", line)
+        if match and current is not None:
+            current["abs"][int(match.group(1), 16)] = (int(match.group(2)), int(match.group(3)))
+
+    for device in devices:
+        axes = device["abs"]
+        if ABS_MT_POSITION_X in axes and ABS_MT_POSITION_Y in axes:
+            return {
+                "path": device["path"],
+                "x_range": axes[ABS_MT_POSITION_X],
+                "y_range": axes[ABS_MT_POSITION_Y],
+                "slots": ABS_MT_SLOT in axes,
+                "tracking": ABS_MT_TRACKING_ID in axes,
+            }
+    return None
+
+def geometry_command():
+    """The shell line running GEOMETRY_COMMANDS with a separator line between them"""
+    return f"; echo {GEOMETRY_SEPARATOR}; ".join(GEOMETRY_COMMANDS)
+
+def parse_geometry(output):
+    """Parse the output of geometry_command()
+
+    Each command's output is parsed on its own: sizes and densities come
+    from `wm` only, as `dumpsys input` lists sizes of its own (viewports,
+    input devices). Returns a dict with the natural (unrotated) size, the
+    density and the rotation in quarter turns; values that were not found
+    are None. An override size or density (listed last) wins, it is what
+    apps and screencap use.
+    """
+    sections = re.split(rf"^{re.escape(GEOMETRY_SEPARATOR)}\r?$", output, flags=re.MULTILINE)
+    size_output, density_output, input_output = (sections + ["", "", ""])[:3]
+    sizes = re.findall(r"size: (\d+)x(\d+)", size_output)
+    densities = re.findall(r"density: (\d+)", density_output)
+    rotation = re.search(r"SurfaceOrientation: (\d)", input_output)
+    return {
+        "natural": tuple(int(value) for value in sizes[-1]) if sizes else None,
+        "density": int(densities[-1]) if densities else None,
+        "rotation": int(rotation.group(1)) % 4 if rotation else None,
+    }
+
+class DisplayGeometry:
+    """Cached size, density and rotation of one device's display
+
+    Display pixels are those of the screen as captured, in its current
+    rotation; natural pixels are those of the unrotated panel, which raw
+    touchscreen events use. The device is probed by the thread that captured
+    its first frame, before that frame is published, so every frame carries
+    the values (or by input, if it needs them first). It is probed again in
+    the background when a capture comes back with a different size, i.e.
+    the device rotated or its resolution changed, or the values are older
+    than GEOMETRY_MAX_AGE. Requests never wait for a refresh.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.lock = threading.Lock()
+        self.natural = None
+        self.density = None
+        self.rotation = 0
+        self.frame_size = None   # size of the newest captured frame
+        self.probed = 0          # time of the last probe
+        self.probes = 0
+        self.refreshing = False
+
+    def _probe(self):
+        success, output, _ = adb_shell(self.device, geometry_command())
+        geometry = parse_geometry(output) if success else {}
+        with self.lock:
+            self.natural = geometry.get("natural") or self.natural
+            self.density = geometry.get("density") or self.density
+            rotation = geometry.get("rotation")
+            if rotation is None and self.natural and self.frame_size:
+                # No rotation reported: a frame that is landscape while the
+                # panel is portrait (or the other way) was captured rotated,
+                # though 90 and 270 degrees look the same from here
+                width, height = self.frame_size
+                rotation = int((width > height) != (self.natural[0] > self.natural[1]))
+            self.rotation = rotation or 0
+            self.probed = time.time()
+            self.probes += 1
+
+    def _refresh(self):
+        try:
+            self._probe()
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def _schedule_refresh(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def observe(self, frame):
+        """Note the size of a captured frame, probing again if it changed"""
+        size = (frame.width, frame.height)
+        with self.lock:
+            changed = size != self.frame_size
+            self.frame_size = size
+            stale = time.time() - self.probed > GEOMETRY_MAX_AGE
+        if not self.probed:
+            self._probe()
+        elif changed or stale:
+            self._schedule_refresh()
+
+    def _ensure(self):
+        if not self.probed:
+            self._probe()
+
+    def size(self):
+        """Display size in the current rotation, or None if it is unknown"""
+        self._ensure()
+        with self.lock:
+            if self.frame_size:
+                return self.frame_size
+            if self.natural:
+                width, height = self.natural
+                return (height, width) if self.rotation % 2 else (width, height)
+            return None
+
+    def to_natural(self, x, y):
+        """Map a display pixel to the panel, returns ((x, y), natural size) or None"""
+        self._ensure()
+        with self.lock:
+            natural, rotation = self.natural, self.rotation
+            if natural is None and self.frame_size:
+                width, height = self.frame_size
+                natural = (height, width) if rotation % 2 else (width, height)
+        if natural is None:
+            return None
+        width, height = natural
+        if rotation == 1:
+            x, y = width - 1 - y, x
+        elif rotation == 2:
+            x, y = width - 1 - x, height - 1 - y
+        elif rotation == 3:
+            x, y = y, height - 1 - x
+        return (x, y), natural
+
+    def snapshot(self):
+        """The cached values as a dict, without probing"""
+        with self.lock:
+            return {"rotation": self.rotation, "density": self.density,
+                    "natural_width": self.natural[0] if self.natural else None,
+                    "natural_height": self.natural[1] if self.natural else None}
+
+    def stats(self):
+        return dict(self.snapshot(), probes=self.probes,
+                    age=round(time.time() - self.probed, 1) if self.probed else None)
+
+class TouchInjector:
+    """Press, move and release touches on one device
+
+    On first use the device is probed with `getevent -p` for a multitouch
+    input node the shell user can write to. If there is one, touches are
+    written to it as raw events with sendevent through the input scheduler's
+    persistent shell, so drags follow the pointer while it moves and no
+    `input` (Dalvik/ART) process is started. Otherwise the gesture is
+    buffered and replayed with `input swipe` / `input tap` on release.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.lock = threading.Lock()
+        self.probed = False
+        self.touchscreen = None
+        self.tracking_id = 0
+        self.gesture = None   # fallback: [start point, last point, start time]
+
+    def probe(self):
+        """Return the touchscreen capabilities, or None to use `input`"""
+        with self.lock:
+            if self.probed:
+                return self.touchscreen
+            self.probed = True
+            if TOUCH_BACKEND == "input":
+                return None
+
+            success, output, _ = adb_shell(self.device, "getevent -p")
+            touchscreen = parse_getevent(output) if success else None
+            if touchscreen is not None:
+                success, output, _ = adb_shell(self.device,
+                                               f"test -w {touchscreen['path']} && echo writable")
+                if not success or "writable" not in output:
+                    touchscreen = None
+            self.touchscreen = touchscreen
+            return touchscreen
+
+    def capabilities(self):
+        touchscreen = self.probe()
+        return {"backend": "sendevent" if touchscreen else "input", "touchscreen": touchscreen}
+
+    def _scale(self, x, y):
+        """Map screen pixels to the input device's coordinate range
+
+        The touchscreen does not rotate with the display, so the point is
+        first turned back to the panel's natural orientation.
+        """
+        (x_min, x_max), (y_min, y_max) = self.touchscreen["x_range"], self.touchscreen["y_range"]
+        natural = self.device.geometry.to_natural(x, y)
+        if natural is not None:
+            (x, y), (width, height) = natural
+        else:
+            # Most touchscreens report one unit per pixel
+            width, height = x_max - x_min + 1, y_max - y_min + 1
+        ax = x_min + round(float(x) * (x_max - x_min) / max(width - 1, 1))
+        ay = y_min + round(float(y) * (y_max - y_min) / max(height - 1, 1))
+        return min(max(ax, x_min), x_max), min(max(ay, y_min), y_max)
+
+    def _events(self, action, x=None, y=None):
+        """sendevent commands for one press/move/release step"""
+        events = []
+        protocol_b = self.touchscreen["tracking"]
+        if action == "down" and protocol_b:
+            self.tracking_id = (self.tracking_id + 1) % 65536
+            if self.touchscreen["slots"]:
+                events.append((EV_ABS, ABS_MT_SLOT, 0))
+            events.append((EV_ABS, ABS_MT_TRACKING_ID, self.tracking_id))
+        if action in ("down", "move"):
+            ax, ay = self._scale(x, y)
+            events += [(EV_ABS, ABS_MT_POSITION_X, ax), (EV_ABS, ABS_MT_POSITION_Y, ay)]
+            if not protocol_b:
+                events.append((EV_SYN, SYN_MT_REPORT, 0))
+        if action == "down":
+            events.append((EV_KEY, BTN_TOUCH, 1))
+        if action == "up":
+            if protocol_b:
+                events.append((EV_ABS, ABS_MT_TRACKING_ID, -1))
+            else:
+                events.append((EV_SYN, SYN_MT_REPORT, 0))
+            events.append((EV_KEY, BTN_TOUCH, 0))
+        events.append((EV_SYN, SYN_REPORT, 0))
+
+        path = self.touchscreen["path"]
+        return [f"sendevent {path} {kind} {code} {value}" for kind, code, value in events]
+
+    def touch(self, action, x=None, y=None):
+        """Stream one step of a gesture, returns (success, error)"""
+        if self.probe() is None:
+            return self._touch_fallback(action, x, y)
+        command = "; ".join(self._events(action, x, y))
+        return self.device.input.submit("move" if action == "move" else "touch", command)
+
+    def _touch_fallback(self, action, x, y):
+        with self.lock:
+            if action == "down":
+                self.gesture = [(x, y), (x, y), time.time()]
+                return True, ""
+            if self.gesture is None:
+                return False, "No touch in progress"
+            if action == "move":
+                self.gesture[1] = (x, y)
+                return True, ""
+            start, last, started = self.gesture
+            self.gesture = None
+
+        end = (x, y) if x is not None else last
+        duration = min(max(int((time.time() - started) * 1000), 100), 1000)
+        if start == end and duration < 300:
+            return send_tap(self.device, *start)
+        return send_swipe(self.device, *start, *end, duration)
+
+    def swipe_path(self, points, duration):
+        """Replay a whole recorded path as one gesture, returns (success, error)
+
+        With sendevent the points are spread evenly over duration: they go
+        out in slices of SWIPE_PATH_STEP seconds (at most SWIPE_PATH_CHUNK
+        points each), every slice one shell line submitted when its time
+        comes, so a slow drag is not played back as a fling and no line
+        outgrows the shell.
+        """
+        if self.probe() is None:
+            return send_swipe(self.device, *points[0], *points[-1], duration)
+
+        last = max(len(points) - 1, 1)
+        slices = []   # (seconds after the start, points)
+        for index, point in enumerate(points):
+            offset = duration / 1000 * index / last
+            if not slices or len(slices[-1][1]) >= SWIPE_PATH_CHUNK \
+                    or offset - slices[-1][0] >= SWIPE_PATH_STEP:
+                slices.append((offset, []))
+            slices[-1][1].append(point)
+
+        start = time.time()
+        for number, (offset, chunk) in enumerate(slices):
+            commands = []
+            for index, point in enumerate(chunk):
+                commands += self._events("down" if not number and not index else "move", *point)
+            if number == len(slices) - 1:
+                commands += self._events("up")
+            delay = start + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            # Not "move" or "swipe": the scheduler must not shed part of a path
+            success, error = self.device.input.submit("touch", "; ".join(commands))
+            if not success:
+                if number:
+                    # Do not leave the finger down halfway through the path
+                    self.device.input.submit("touch", "; ".join(self._events("up")))
+                return success, error
+        return True, ""
+
+class SessionRecorder:
+    """Writes one device's frames and input events to a recording on disk
+
+    A recording is a directory holding session.json and numbered segments.
+    Each segment is a data file of payloads back to back plus an index of
+    fixed-size RECORD_INDEX entries in time order, which readers map into
+    memory and binary search. The screen is stored as a keyframe every
+    RECORDING_KEYFRAME_INTERVAL seconds and at the start of each segment,
+    and in between as deltas that only hold the changed tiles, so seeking
+    never replays more than one keyframe interval. Input events sent while
+    recording are stored as JSON entries in between.
+
+    The recorder follows the capture engine as a Subscriber on a thread of
+    its own: diffing, encoding and writing never hold up capturing, and a
+    recorder that falls behind skips to the newest frame like any viewer.
+    Writes are buffered and flushed every RECORDING_FLUSH_INTERVAL seconds,
+    data before index, so a reader never sees an entry whose data is missing.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.started = time.time()
+        self.ended = None
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        serial = re.sub(r"[^A-Za-z0-9_.-]", "_", device.labels["device"])
+        self.name = f"{serial}-{stamp}-{int(self.started * 1000) % 1000:03d}"
+        self.path = os.path.join(RECORDINGS_DIR, self.name)
+        os.makedirs(self.path)
+        self.segment = -1
+        self.data = None
+        self.index = None
+        self.offset = 0
+        self.entries = []          # index entries written with the next flush
+        self.last_timestamp = 0
+        self.previous = None       # last frame written
+        self.last_keyframe = 0
+        self.inputs = deque()      # (timestamp, payload) waiting for the writer
+        self.size = None
+        self.error = None
+        self.counters = {"keyframes": 0, "deltas": 0, "inputs": 0, "bytes": 0}
+        self.stopping = threading.Event()
+        self._write_session()
+        self._open_segment()
+        self.subscriber = device.engine.subscribe()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _write_session(self, ended=None):
+        session = {"device": self.device.serial, "model": self.device.labels["model"],
+                   "started": self.started, "ended": ended, "encoding": RECORDING_ENCODING,
+                   "width": self.size[0] if self.size else None,
+                   "height": self.size[1] if self.size else None}
+        with open(os.path.join(self.path, "session.json"), "w") as f:
+            json.dump(session, f)
+
+    def _open_segment(self):
+        self._close_segment()
+        self.segment += 1
+        base = os.path.join(self.path, f"segment-{self.segment:05d}")
+        self.data = open(base + ".dat", "wb", buffering=RECORDING_BUFFER_SIZE)
+        self.index = open(base + ".idx", "wb")
+        self.offset = 0
+
+    def _close_segment(self):
+        if self.data is not None:
+            self._flush()
+            self.data.close()
+            self.index.close()
+
+    def _flush(self):
+        self.data.flush()
+        self.index.write(b"".join(self.entries))
+        self.index.flush()
+        self.entries = []
+
+    def _append(self, kind, timestamp, payload):
+        # Entries must stay in time order for the binary search
+        timestamp = max(timestamp, self.last_timestamp)
+        self.last_timestamp = timestamp
+        self.data.write(payload)
+        self.entries.append(RECORD_INDEX.pack(timestamp, self.offset, len(payload), kind))
+        self.offset += len(payload)
+        self.counters["bytes"] += len(payload)
+
+    def add_input(self, kind, data):
+        """Queue an input event, called from request threads"""
+        self.inputs.append((time.time(), json.dumps(dict(data, type=kind)).encode()))
+
+    def _write_inputs(self, until):
+        while self.inputs and self.inputs[0][0] <= until:
+            timestamp, payload = self.inputs.popleft()
+            self._append(RECORD_INPUT, timestamp, payload)
+            self.counters["inputs"] += 1
+
+    def _write_frame(self, frame):
+        if self.offset >= RECORDING_SEGMENT_SIZE:
+            self._open_segment()
+            self.previous = None
+
+        rects = None
+        if (self.previous is not None and self.offset
+                and frame.timestamp - self.last_keyframe < RECORDING_KEYFRAME_INTERVAL):
+            rects = frame.dirty_rects(self.previous)
+        if rects is not None and sum(w * h for _, _, w, h in rects) > \
+                TILE_MAX_AREA * frame.width * frame.height:
+            rects = None
+
+        if rects is None:
+            payload = frame.encode(RECORDING_ENCODING, RECORDING_QUALITY, 0)
+            self._append(RECORD_KEYFRAME, frame.timestamp, payload)
+            self.last_keyframe = frame.timestamp
+            self.counters["keyframes"] += 1
+        elif rects:
+            parts = [WS_TILE_COUNT.pack(len(rects))]
+            for rect in rects:
+                data = frame.encode_region(rect, RECORDING_ENCODING, RECORDING_QUALITY, 0)
+                parts += [WS_TILE_HEADER.pack(*rect, len(data)), data]
+            self._append(RECORD_DELTA, frame.timestamp, b"".join(parts))
+            self.counters["deltas"] += 1
+        self.previous = frame
+        if self.size is None:
+            self.size = (frame.width, frame.height)
+            self._write_session()
+
+    def _run(self):
+        flushed = time.time()
+        try:
+            while not self.stopping.is_set():
+                frame = self.subscriber.next(RECORDING_FLUSH_INTERVAL)
+                if frame is not None:
+                    self._write_inputs(frame.timestamp)
+                    self._write_frame(frame)
+                if time.time() - flushed >= RECORDING_FLUSH_INTERVAL:
+                    self._write_inputs(time.time() - RECORDING_FLUSH_INTERVAL)
+                    self._flush()
+                    flushed = time.time()
+            self._write_inputs(time.time())
+            self._close_segment()
+            self._write_session(ended=self.ended)
+        except OSError as e:
+            # Disk full or gone: stop recording, keep what was written
+            self.error = str(e)
+        finally:
+            self.previous = None
+            self.subscriber.close()
+
+    def stop(self):
+        self.ended = time.time()
+        self.stopping.set()
+        self.thread.join()
+
+    def stats(self):
+        seconds = (self.ended or time.time()) - self.started
+        return dict(self.counters, name=self.name, seconds=round(seconds, 1),
+                    segments=self.segment + 1, recording=not self.stopping.is_set(),
+                    error=self.error)
+
+class IndexTimestamps:
+    """The timestamps of a mapped recording index, as a sequence for bisect"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index) // RECORD_INDEX.size
+
+    def __getitem__(self, position):
+        return RECORD_INDEX.unpack_from(self.index, position * RECORD_INDEX.size)[0]
+
+class Recording:
+    """Random access to a recording written by SessionRecorder
+
+    Segments are memory-mapped, so a seek touches only the index pages the
+    binary search visits and the payloads it replays: the keyframe before
+    the requested time and the deltas after it. The screen produced by the
+    last seek is kept, and a seek forward within the same keyframe interval
+    (the usual case while playing or scrubbing) continues from there.
+    Recordings still being written can be read; their last segment is
+    mapped again when it grew, and the outgrown maps are closed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, "session.json")) as f:
+            self.session = json.load(f)
+        self.lock = threading.Lock()
+        self.maps = {}      # segment -> (index size, index map, data map)
+        self.cursor = None  # (segment, position, image) of the last seek
+
+    def segments(self):
+        return sorted(name[:-4] for name in os.listdir(self.path) if name.endswith(".idx"))
+
+    def _map(self, segment):
+        """Return the (index, data) maps of a segment, empty if nothing is flushed yet"""
+        base = os.path.join(self.path, segment)
+        size = os.path.getsize(base + ".idx")
+        size -= size % RECORD_INDEX.size
+        cached = self.maps.get(segment)
+        if cached is not None and cached[0] == size:
+            return cached[1], cached[2]
+        if not size:
+            return b"", b""
+        with open(base + ".idx", "rb") as index_file, open(base + ".dat", "rb") as data_file:
+            index = mmap.mmap(index_file.fileno(), size, access=mmap.ACCESS_READ)
+            data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if cached is not None:
+            cached[1].close()
+            cached[2].close()
+        self.maps[segment] = (size, index, data)
+        return index, data
+
+    def close(self):
+        """Unmap every segment, a later read maps them again"""
+        with self.lock:
+            for _, index, data in self.maps.values():
+                index.close()
+                data.close()
+            self.maps = {}
+            self.cursor = None
+
+    def span(self):
+        """First and last timestamp, or None for an empty recording"""
+        with self.lock:
+            segments = self.segments()
+            first = last = None
+            for segment in segments:
+                timestamps = IndexTimestamps(self._map(segment)[0])
+                if len(timestamps):
+                    first = timestamps[0] if first is None else first
+                    last = timestamps[len(timestamps) - 1]
+            return None if first is None else (first, last)
+
+    def summary(self):
+        span = self.span()
+        return dict(self.session, name=self.name, duration=round(span[1] - span[0], 3) if span else 0,
+                    bytes=sum(os.path.getsize(os.path.join(self.path, name))
+                              for name in os.listdir(self.path)))
+
+    def _apply(self, image, kind, payload):
+        if kind == RECORD_KEYFRAME:
+            return Image.open(io.BytesIO(payload)).convert("RGB")
+        count, = WS_TILE_COUNT.unpack_from(payload)
+        offset = WS_TILE_COUNT.size
+        for _ in range(count):
+            x, y, _, _, length = WS_TILE_HEADER.unpack_from(payload, offset)
+            offset += WS_TILE_HEADER.size
+            tile = Image.open(io.BytesIO(payload[offset:offset + length]))
+            image.paste(tile.convert("RGB"), (x, y))
+            offset += length
+        return image
+
+    def frame_at(self, timestamp):
+        """Return (image, timestamp) of the screen shown at timestamp, or None
+
+        The image is shared with later seeks; encode it before letting go of
+        the lock this takes.
+        """
+        with self.lock:
+            segments = [segment for segment in self.segments() if len(self._map(segment)[0])]
+            if not segments:
+                return None
+            starts = [IndexTimestamps(self._map(segment)[0])[0] for segment in segments]
+            segment = segments[max(0, bisect.bisect_right(starts, timestamp) - 1)]
+            index, data = self._map(segment)
+            timestamps = IndexTimestamps(index)
+            target = max(0, bisect.bisect_right(timestamps, timestamp) - 1)
+
+            def entry(position):
+                return RECORD_INDEX.unpack_from(index, position * RECORD_INDEX.size)
+
+            # Last frame at or before the target (the first one if the target
+            # is earlier), then the keyframe it builds on
+            while target > 0 and entry(target)[3] == RECORD_INPUT:
+                target -= 1
+            while target < len(timestamps) - 1 and entry(target)[3] == RECORD_INPUT:
+                target += 1
+            start = target
+            while start > 0 and entry(start)[3] != RECORD_KEYFRAME:
+                start -= 1
+            if entry(start)[3] != RECORD_KEYFRAME:
+                return None
+
+            image = None
+            if self.cursor is not None and self.cursor[0] == segment \
+                    and start <= self.cursor[1] <= target:
+                _, start, image = self.cursor
+                start += 1
+            for position in range(start, target + 1):
+                _, offset, length, kind = entry(position)
+                if kind != RECORD_INPUT:
+                    image = self._apply(image, kind, data[offset:offset + length])
+            self.cursor = (segment, target, image)
+            return image, entry(target)[0]
+
+    def events(self, start=0, end=float("inf")):
+        """Input events recorded between two timestamps, oldest first"""
+        with self.lock:
+            result = []
+            for segment in self.segments():
+                index, data = self._map(segment)
+                for position in range(len(index) // RECORD_INDEX.size):
+                    timestamp, offset, length, kind = RECORD_INDEX.unpack_from(
+                        index, position * RECORD_INDEX.size)
+                    if kind == RECORD_INPUT and start <= timestamp <= end:
+                        result.append(dict(json.loads(data[offset:offset + length]),
+                                           timestamp=timestamp))
+            return result
+
+recordings = OrderedDict()   # name -> Recording, the most recently replayed ones
+recordings_lock = threading.Lock()
+
+def open_recording(name):
+    """Return the Recording called name, or None if there is no such recording"""
+    if not name or name != os.path.basename(name) or name.startswith("."):
+        return None
+    path = os.path.join(RECORDINGS_DIR, name)
+    if not os.path.isfile(os.path.join(path, "session.json")):
+        return None
+    with recordings_lock:
+        recording = recordings.pop(name, None) or Recording(path)
+        recordings[name] = recording
+        while len(recordings) > 4:
+            recordings.popitem(last=False)[1].close()
+        return recording
+
+def list_recordings():
+    """Summaries of every recording, newest first"""
+    if not os.path.isdir(RECORDINGS_DIR):
+        return []
+    result = []
+    for name in sorted(os.listdir(RECORDINGS_DIR), reverse=True):
+        recording = open_recording(name)
+        if recording is not None:
+            result.append(recording.summary())
+    return result
+
+def record_control(device, data):
+    """Start or stop recording a device, returns (success, error)"""
+    action = data.get('action') if isinstance(data, dict) else None
+    if action == "start":
+        if device.recorder is not None and not device.recorder.stopping.is_set():
+            return False, "Already recording"
+        try:
+            device.recorder = SessionRecorder(device)
+        except OSError as e:
+            return False, f"Cannot record: {e}"
+        return True, ""
+    if action == "stop":
+        recorder = device.recorder
+        if recorder is None or recorder.stopping.is_set():
+            return False, "Not recording"
+        recorder.stop()
+        return True, ""
+    return False, "Action must be start or stop"
+
+def replay_frame(name, offset, options):
+    """Encode the screen of recording name at offset seconds into it
+
+    Returns (data, encoding, timestamp) or (None, error, None).
+    """
+    recording = open_recording(name)
+    if recording is None:
+        return None, "Unknown recording", None
+    encoding = options["encoding"] if options["encoding"] in ("png", "webp") else "jpeg"
+    result = recording.frame_at(recording.session["started"] + offset)
+    if result is None:
+        return None, "Nothing recorded yet", None
+    image, timestamp = result
+    with recording.lock:
+        data = render_image(image, encoding, min(max(options["quality"], 1), 100),
+                            options["max_size"])
+    return data, encoding, timestamp - recording.session["started"]
+
+class Device:
+    """Everything the mirror keeps per phone
+
+    serial is None for the adb server's only device, used when the device
+    list cannot be read. bus is the USB bus the phone hangs off (from the usb:
+    property of `adb devices -l`), which the capture pool uses to spread load;
+    network devices get a bus of their own.
+    """
+
+    def __init__(self, serial=None, usb=None, model=None):
+        self.serial = serial
+        self.usb = usb
+        # Metric labels, to compare where time goes across phones
+        self.labels = {"device": serial or "default", "model": model or "unknown"}
+        self.bus = "usb:" + usb.split("-")[0] if usb else serial
+        # Same adb server as the host client
+        self.client = AdbClient(serial, adb_client.host, adb_client.port) if serial else adb_client
+        # Invalid exec-out images in a row (old devices rewrite LF to CRLF) and when the last was
+        self.exec_out_failures = 0
+        self.exec_out_failed = 0
+        self.engine = CaptureEngine(self)
+        self.video = VideoStream(self)
+        self.spawn_pool = SpawnPool(self)
+        self.geometry = DisplayGeometry(self)
+        self.input = InputScheduler(self)
+        self.injector = TouchInjector(self)
+        self.recorder = None  # SessionRecorder while /record is on (and after, until restarted)
+        # Frames handed out per delivery path, to compare polling against streaming
+        self.delivery_rates = {"poll": RateMeter(), "stream": RateMeter(),
+                               "websocket": RateMeter()}
+        self.lock = threading.Lock()
+        self.stream_clients = 0
+
+    def exec_out_enabled(self):
+        """Whether "auto" captures should use exec-out
+
+        Only after EXEC_OUT_MAX_FAILURES invalid images in a row are
+        captures pulled instead, and exec-out is tried again every
+        EXEC_OUT_RETRY_AFTER seconds in case the cause was transient.
+        """
+        with self.lock:
+            return (self.exec_out_failures < EXEC_OUT_MAX_FAILURES
+                    or time.time() - self.exec_out_failed >= EXEC_OUT_RETRY_AFTER)
+
+    def exec_out_checked(self, valid):
+        """Note whether exec-out returned a valid image"""
+        with self.lock:
+            if valid:
+                self.exec_out_failures = 0
+            else:
+                self.exec_out_failures += 1
+                self.exec_out_failed = time.time()
+
+    def count_stream(self, change):
+        """Add change (1 or -1) to the open MJPEG streams, from any thread"""
+        with self.lock:
+            self.stream_clients += change
+
+class DeviceRegistry:
+    """Device objects by serial, created as devices are first asked for
+
+    The attached devices are listed from adb at most every
+    DEVICE_REFRESH_INTERVAL seconds. Unknown serials are rejected, so a
+    typo in a URL does not start a capture engine for a phone that is not
+    there.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.attached = []
+        self.refreshed = 0
+        self.last_error = None
+
+    def stale(self):
+        return time.time() - self.refreshed >= DEVICE_REFRESH_INTERVAL
+
+    def update(self, success, attached, error):
+        """Store the result of list_devices(), returns the attached devices"""
+        with self.lock:
+            self.refreshed = time.time()
+            self.last_error = None if success else error
+            if success:
+                self.attached = attached
+            return self.attached
+
+    def refresh(self, force=False):
+        """Return the attached devices as listed by `adb devices -l`"""
+        if not force and not self.stale():
+            return self.attached
+        return self.update(*list_devices())
+
+    def find(self, serial):
+        """The `adb devices -l` entry for serial, or None"""
+        return next((info for info in self.attached if info["serial"] == serial), None)
+
+    def get(self, serial=None, refresh=True):
+        """Return the Device for serial, or None if no such device is attached
+
+        Without a serial the first online device is used, or the adb default
+        device when nothing could be listed. With refresh=False the last
+        device list is used as is.
+        """
+        attached = self.refresh() if refresh else self.attached
+        online = [info for info in attached if info["state"] == "device"]
+        if serial is None:
+            info = online[0] if online else None
+        else:
+            info = self.find(serial)
+            if info is None and refresh:
+                self.refresh(force=True)
+                info = self.find(serial)
+            if info is None:
+                return None
+
+        key = info["serial"] if info else None
+        with self.lock:
+            device = self.devices.get(key)
+            if device is None:
+                device = self.devices[key] = Device(key, info.get("usb") if info else None,
+                                                    info.get("model") if info else None)
+            return device
+
+    def active(self):
+        """Devices that have been used since the server started"""
+        with self.lock:
+            return list(self.devices.values())
+
+device_registry = DeviceRegistry()
+
+def parse_integer(value, maximum):
+    """Return value as an int in 0..maximum, or None if it is not a number in range
+
+    Accepts ints, floats (rounded) and numeric strings; everything that ends
+    up in a device shell line goes through here or KEYCODE_PATTERN.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        number = round(float(value))
+    except (ValueError, OverflowError):
+        return None
+    return number if 0 <= number <= maximum else None
+
+def parse_fraction(value):
+    """Return value as a float in 0..1, or None if it is not a number in range"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if 0 <= number <= 1 else None
+
+def parse_point(data, x_name='x', y_name='y', size=None):
+    """Return (x, y) as validated device pixels, or None
+
+    With size the coordinates are fractions of the display (0..1, as sent
+    with "normalized": true) and are mapped onto its pixels.
+    """
+    if size is not None:
+        x, y = parse_fraction(data.get(x_name)), parse_fraction(data.get(y_name))
+        if x is None or y is None:
+            return None
+        return round(x * (size[0] - 1)), round(y * (size[1] - 1))
+    x = parse_integer(data.get(x_name), INPUT_COORDINATE_MAX)
+    y = parse_integer(data.get(y_name), INPUT_COORDINATE_MAX)
+    return None if x is None or y is None else (x, y)
+
+def handle_input(device, kind, data):
+    """Validate an input event and send it, used by HTTP routes and the WebSocket"""
+    if not isinstance(data, dict):
+        return False, "Expected a JSON object"
+    success, error = send_input(device, kind, data)
+    recorder = device.recorder
+    if success and recorder is not None:
+        recorder.add_input(kind, data)
     return success, error
 
-@app.route('/')
-def index():
-    """Serve the web interface"""
-    html = """
+def send_input(device, kind, data):
+    # The screen is about to change, capture at full speed for a while
+    device.engine.controller.notify_input()
+
+    size = None
+    if data.get('normalized') and kind != "key":
+        size = device.geometry.size()
+        if size is None:
+            return False, "Display size unknown, send device pixels instead"
+
+    if kind == "tap":
+        if data.get('x') is None or data.get('y') is None:
+            return False, "Missing x or y coordinate"
+        point = parse_point(data, size=size)
+        if point is None:
+            return False, "Invalid x or y coordinate"
+        return send_tap(device, *point)
+
+    if kind == "swipe":
+        duration = parse_integer(data.get('duration', 300), INPUT_DURATION_MAX)  # Default 300ms
+        if duration is None:
+            return False, "Invalid duration"
+        path = data.get('path')
+        if path:
+            # Full gesture shape: [[x, y], ...] in device pixels (or fractions)
+            if not isinstance(path, list) or not all(
+                    isinstance(point, (list, tuple)) and len(point) == 2 for point in path):
+                return False, "Invalid path"
+            points = [parse_point({'x': x, 'y': y}, size=size) for x, y in path]
+            if None in points:
+                return False, "Invalid path"
+            return device.injector.swipe_path(points, duration)
+        if None in [data.get(name) for name in ('x1', 'y1', 'x2', 'y2')]:
+            return False, "Missing coordinates"
+        start = parse_point(data, 'x1', 'y1', size)
+        end = parse_point(data, 'x2', 'y2', size)
+        if start is None or end is None:
+            return False, "Invalid coordinates"
+        return send_swipe(device, *start, *end, duration)
+
+    if kind == "touch":
+        action = data.get('action')
+        if action not in ("down", "move", "up"):
+            return False, "Touch action must be down, move or up"
+        if action == "up":
+            return device.injector.touch(action)
+        if data.get('x') is None or data.get('y') is None:
+            return False, "Missing x or y coordinate"
+        point = parse_point(data, size=size)
+        if point is None:
+            return False, "Invalid x or y coordinate"
+        return device.injector.touch(action, *point)
+
+    if kind == "key":
+        key = data.get('key')
+        if key is None:
+            return False, "Missing key"
+        if isinstance(key, bool) or not isinstance(key, (int, str)) \
+                or not KEYCODE_PATTERN.fullmatch(str(key)):
+            return False, "Invalid key, expected a keycode number or KEYCODE_ name"
+        return send_keyevent(device, key)
+
+    return False, f"Unknown input type: {kind}"
+
+INDEX_HTML = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -221,13 +3220,18 @@ def index():
             min-height: 400px;
         }
 
-        #screenImage {
+        #screenImage, #screenCanvas {
             max-width: 100%;
             height: auto;
             display: none;
             cursor: crosshair;
         }
 
+        #overlayCanvas {
+            position: absolute;
+            pointer-events: none;
+        }
+
         .screen-placeholder {
             padding: 100px 20px;
             text-align: center;
@@ -284,24 +3288,74 @@ def index():
 <body>
     <div class="container">
         <h1>ADB Screen Mirror & Control(1.0)</h1>
-        <p class="subtitle">Control your Android device - Python backend is running!</p>
+        <p class="subtitle">Control your Android device - Python backend is running! <a href="/wall">All devices</a> · <a href="/replay">Recordings</a></p>
 
         <div id="status" class="status info">
             Ready to connect. Click "Start Mirroring" to begin.
         </div>
 
         <div class="controls">
+            <div class="control-group">
+                <label for="deviceSelect">Device</label>
+                <select id="deviceSelect">
+                    <option value="">Default device</option>
+                </select>
+            </div>
+
             <div class="control-group">
                 <label for="refreshRate">Refresh Rate (ms)</label>
                 <select id="refreshRate">
+                    <option value="0" selected>Auto (server paced)</option>
                     <option value="500">500ms (2 FPS)</option>
                     <option value="750">750ms (1.3 FPS)</option>
-                    <option value="1000" selected>1000ms (1 FPS)</option>
+                    <option value="1000">1000ms (1 FPS)</option>
                     <option value="1500">1500ms (0.7 FPS)</option>
                     <option value="2000">2000ms (0.5 FPS)</option>
                 </select>
             </div>
 
+            <div class="control-group">
+                <label for="deliveryMode">Delivery</label>
+                <select id="deliveryMode">
+                    <option value="poll" selected>Polling</option>
+                    <option value="stream">MJPEG stream</option>
+                    {% if websocket %}<option value="ws">WebSocket</option>{% endif %}
+                    {% if websocket and tiles %}<option value="ws-tiles">WebSocket + dirty tiles</option>{% endif %}
+                    {% if websocket %}<option value="video">H.264 video (screenrecord)</option>{% endif %}
+                </select>
+            </div>
+
+            <div class="control-group">
+                <label for="encoding">Encoding</label>
+                <select id="encoding">
+                    <option value="" selected>Auto</option>
+                    <option value="jpeg">JPEG</option>
+                    <option value="webp">WebP</option>
+                    <option value="png">PNG</option>
+                </select>
+            </div>
+
+            <div class="control-group">
+                <label for="quality">Quality</label>
+                <select id="quality">
+                    <option value="90">90</option>
+                    <option value="80" selected>80</option>
+                    <option value="60">60</option>
+                    <option value="40">40</option>
+                </select>
+            </div>
+
+            <div class="control-group">
+                <label for="maxSize">Max Size</label>
+                <select id="maxSize">
+                    <option value="0" selected>Full</option>
+                    <option value="1280">1280px</option>
+                    <option value="960">960px</option>
+                    <option value="720">720px</option>
+                    <option value="480">480px</option>
+                </select>
+            </div>
+
             <div class="control-group">
                 <button id="startBtn" class="btn-primary">▶ Start Mirroring</button>
             </div>
@@ -314,6 +3368,10 @@ def index():
                 <button id="testBtn" class="btn-primary">🔍 Test ADB Connection</button>
             </div>
 
+            <div class="control-group">
+                <button id="recordBtn" class="btn-primary">⏺ Record</button>
+            </div>
+
             <div class="control-group">
     <button class="btn-primary" onclick="sendKey('3')">🏠 Home</button>
 </div>
@@ -349,6 +3407,8 @@ def index():
                 <p>Screen will appear here once mirroring starts</p>
             </div>
             <img id="screenImage" alt="Android Screen">
+            <canvas id="screenCanvas"></canvas>
+            <canvas id="overlayCanvas"></canvas>
         </div>
 
         <div class="stats">
@@ -372,19 +3432,30 @@ def index():
                 <div class="stat-value" id="latency">0ms</div>
                 <div class="stat-label">Avg Latency</div>
             </div>
+            <div class="stat-item">
+                <div class="stat-value" id="fps">0</div>
+                <div class="stat-label">FPS (delivered / captured)</div>
+            </div>
         </div>
     </div>
 
+    <!-- Runs in a Web Worker: turns encoded frames and tiles into ImageBitmaps -->
+    <script id="decodeWorkerSource" type="text/plain">
+        self.onmessage = async (event) => {
+            const { id, blobs } = event.data;
+            try {
+                const bitmaps = await Promise.all(blobs.map(blob => createImageBitmap(blob)));
+                self.postMessage({ id, bitmaps }, bitmaps);
+            } catch (error) {
+                self.postMessage({ id, error: error.message || 'Cannot decode frame' });
+            }
+        };
+    </script>
+
     <script>
         async function sendKey(keycode) {
     try {
-        const res = await fetch('/key', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ key: keycode })
-        });
-
-        const data = await res.json();
+        const data = await sendInput('key', { key: keycode });
 
         if (!data.success) {
             updateStatus(`Key failed: ${data.error}`, 'error');
@@ -398,13 +3469,45 @@ def index():
 }
 
 
-        let intervalId = null;
+        // URL prefix of the device this page controls ("" for the default one)
+        const base = {{ base|tojson }};
+        const currentSerial = {{ serial|tojson }};
+
+        let pollGeneration = 0;
         let frameCount = 0;
         let tapCount = 0;
         let swipeCount = 0;
         let errorCount = 0;
         let latencies = [];
         let isRunning = false;
+        let lastSeq = 0;
+        let statsIntervalId = null;
+
+        // WebSocket delivery
+        let ws = null;
+        let wsRequestId = 0;
+        const wsPending = new Map();
+
+        // Frames, dirty tiles and H.264 video are all drawn onto this canvas;
+        // only the MJPEG stream needs the image element. Images are decoded
+        // in parallel but drawn in the order they arrived.
+        const screenCanvas = document.getElementById('screenCanvas');
+        const screenCtx = screenCanvas.getContext('2d');
+        let renderChain = Promise.resolve();
+
+        // Tap ripples and the swipe trail are drawn on a canvas layered on top
+        const overlayCanvas = document.getElementById('overlayCanvas');
+        const overlayCtx = overlayCanvas.getContext('2d');
+        const overlay = { ripples: [], trail: null, frame: 0 };
+
+        // H.264 video is decoded with WebCodecs
+        let decoder = null;
+        let videoKeySeen = false;
+
+        // Full-resolution frame size; frames may be downscaled for display.
+        // Input is sent as fractions of the screen and mapped by the server.
+        let deviceWidth = 0;
+        let deviceHeight = 0;
 
         // Swipe tracking
         let isRightMouseDown = false;
@@ -413,13 +3516,49 @@ def index():
         let swipePath = [];
         let swipeStartTime = 0;
 
+        // Touch streaming: events are sent in order, and while one is in
+        // flight only the newest move is kept
+        let touchChain = Promise.resolve({ success: true });
+        let queuedMove = null;
+
         const startBtn = document.getElementById('startBtn');
         const stopBtn = document.getElementById('stopBtn');
         const testBtn = document.getElementById('testBtn');
+        const recordBtn = document.getElementById('recordBtn');
         const screenImage = document.getElementById('screenImage');
         const placeholder = document.getElementById('placeholder');
         const statusDiv = document.getElementById('status');
         const refreshRateSelect = document.getElementById('refreshRate');
+        const deliveryModeSelect = document.getElementById('deliveryMode');
+        const encodingSelect = document.getElementById('encoding');
+        const qualitySelect = document.getElementById('quality');
+        const maxSizeSelect = document.getElementById('maxSize');
+        const deviceSelect = document.getElementById('deviceSelect');
+        const frameOptionSelects = [encodingSelect, qualitySelect, maxSizeSelect];
+
+        function frameQuery() {
+            const params = new URLSearchParams();
+            if (encodingSelect.value) params.set('encoding', encodingSelect.value);
+            params.set('quality', qualitySelect.value);
+            params.set('max', maxSizeSelect.value);
+            return params.toString();
+        }
+
+        // The element showing the screen: the canvas, or the image for MJPEG
+        function screenElement() {
+            return screenImage.style.display === 'block' ? screenImage : screenCanvas;
+        }
+
+        function onScreen(type, listener) {
+            screenImage.addEventListener(type, listener);
+            screenCanvas.addEventListener(type, listener);
+        }
+
+        // A point on the displayed screen as fractions (0..1) of its size
+        function normalizedPoint(x, y, rect) {
+            const clamp = (value) => Math.min(Math.max(value, 0), 1);
+            return { x: clamp(x / rect.width), y: clamp(y / rect.height), normalized: true };
+        }
 
         function updateStatus(message, type = 'info') {
             statusDiv.className = `status ${type}`;
@@ -439,25 +3578,306 @@ def index():
             }
         }
 
-        async function captureScreen() {
+        // Send an input event over the WebSocket when connected, else via HTTP
+        async function sendInput(type, payload) {
+            if (ws && ws.readyState === WebSocket.OPEN) {
+                const id = ++wsRequestId;
+                return new Promise((resolve) => {
+                    wsPending.set(id, resolve);
+                    ws.send(JSON.stringify({ type, id, ...payload }));
+                });
+            }
+
+            const response = await fetch(`${base}/${type}`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload)
+            });
+            return response.json();
+        }
+
+        function sendTouch(action, x, y) {
+            const point = { action, ...normalizedPoint(x, y, screenElement().getBoundingClientRect()) };
+
+            if (action === 'move') {
+                const pending = queuedMove !== null;
+                queuedMove = point;
+                if (pending) return touchChain;
+            }
+            touchChain = touchChain.then(() => {
+                let next = point;
+                if (action === 'move') {
+                    next = queuedMove;
+                    queuedMove = null;
+                }
+                return sendInput('touch', next);
+            }).catch((error) => ({ success: false, error: error.message }));
+            return touchChain;
+        }
+
+        // Images are decoded by a worker so the page stays responsive; without
+        // worker support they are decoded here, as bitmaps or image elements
+        const decodeWorker = ('Worker' in window && 'createImageBitmap' in window)
+            ? new Worker(URL.createObjectURL(new Blob(
+                [document.getElementById('decodeWorkerSource').textContent],
+                { type: 'text/javascript' })))
+            : null;
+        const decodePending = new Map();
+        let decodeId = 0;
+
+        if (decodeWorker) {
+            decodeWorker.onmessage = (event) => {
+                const { id, bitmaps, error } = event.data;
+                const { resolve, reject } = decodePending.get(id);
+                decodePending.delete(id);
+                if (error) reject(new Error(error));
+                else resolve(bitmaps);
+            };
+        }
+
+        function decodeOnPage(blob) {
+            if ('createImageBitmap' in window) return createImageBitmap(blob);
+            return new Promise((resolve, reject) => {
+                const image = new Image();
+                const url = URL.createObjectURL(blob);
+                image.onload = () => { URL.revokeObjectURL(url); resolve(image); };
+                image.onerror = () => { URL.revokeObjectURL(url); reject(new Error('Cannot decode frame')); };
+                image.src = url;
+            });
+        }
+
+        // Decode blobs into drawable images, resolves with them in order
+        function decodeImages(blobs) {
+            if (!decodeWorker) return Promise.all(blobs.map(decodeOnPage));
+            const id = ++decodeId;
+            return new Promise((resolve, reject) => {
+                decodePending.set(id, { resolve, reject });
+                decodeWorker.postMessage({ id, blobs });
+            });
+        }
+
+        function releaseImage(image) {
+            if (image.close) image.close();
+        }
+
+        // Queue drawing after the frames that arrived earlier
+        function render(decoded, draw) {
+            renderChain = renderChain.then(async () => draw(await decoded)).catch((error) => {
+                errorCount++;
+                updateStats();
+                updateStatus(`Error: ${error.message}`, 'error');
+            });
+            return renderChain;
+        }
+
+        function showCanvas() {
+            screenCanvas.style.display = 'block';
+            screenImage.style.display = 'none';
+            placeholder.style.display = 'none';
+        }
+
+        function drawFrame(image) {
+            if (screenCanvas.width !== image.width || screenCanvas.height !== image.height) {
+                screenCanvas.width = image.width;
+                screenCanvas.height = image.height;
+            }
+            screenCtx.drawImage(image, 0, 0);
+            releaseImage(image);
+            showCanvas();
+        }
+
+        function frameShown(latency) {
+            frameCount++;
+            latencies.push(latency);
+            if (latencies.length > 10) latencies.shift();
+            updateStats();
+        }
+
+        function frameDrawn(seq, timestamp) {
+            // Acknowledge so the server sends the next (newest) frame
+            if (ws && ws.readyState === WebSocket.OPEN) {
+                ws.send(JSON.stringify({ type: 'ack', seq }));
+            }
+            frameShown(Math.max(0, Date.now() - Math.round(timestamp * 1000)));
+        }
+
+        function showFrame(blob, seq, timestamp) {
+            render(decodeImages([blob]), ([image]) => {
+                drawFrame(image);
+                frameDrawn(seq, timestamp);
+            });
+        }
+
+        function compositeFrame(buffer, seq, timestamp, mimeType) {
+            const view = new DataView(buffer);
+
+            if (view.getUint8(0) === 1) {
+                showFrame(new Blob([buffer.slice(18)], { type: mimeType }), seq, timestamp);
+                return;
+            }
+
+            // Tile: x, y, width, height u16 (device pixels), length u32, payload
+            const tiles = [];
+            let offset = 20;
+            for (let i = 0; i < view.getUint16(18); i++) {
+                const length = view.getUint32(offset + 8);
+                tiles.push({
+                    x: view.getUint16(offset),
+                    y: view.getUint16(offset + 2),
+                    blob: new Blob([buffer.slice(offset + 12, offset + 12 + length)], { type: mimeType })
+                });
+                offset += 12 + length;
+            }
+
+            render(decodeImages(tiles.map(tile => tile.blob)), (images) => {
+                const scale = screenCanvas.width / deviceWidth;
+                images.forEach((image, i) => {
+                    screenCtx.drawImage(image, Math.round(tiles[i].x * scale), Math.round(tiles[i].y * scale));
+                    releaseImage(image);
+                });
+                frameDrawn(seq, timestamp);
+            });
+        }
+
+        function configureVideo(config) {
+            if (decoder) decoder.close();
+            decoder = new VideoDecoder({
+                output: showVideoFrame,
+                error: (error) => updateStatus(`Video decoding failed: ${error.message}`, 'error')
+            });
+            // Without a description the chunks are Annex B with in-band SPS/PPS
+            decoder.configure({ codec: config.codec, optimizeForLatency: true });
+            deviceWidth = config.width;
+            deviceHeight = config.height;
+            videoKeySeen = false;
+        }
+
+        function decodeVideo(buffer) {
+            // Header: type u8, seq u32, timestamp f64, keyframe u8
+            const view = new DataView(buffer);
+            const keyframe = view.getUint8(13) === 1;
+            if (!decoder || decoder.state !== 'configured') return;
+            if (!keyframe && !videoKeySeen) return;
+            videoKeySeen = true;
+            decoder.decode(new EncodedVideoChunk({
+                type: keyframe ? 'key' : 'delta',
+                timestamp: Math.round(view.getFloat64(5) * 1e6),
+                data: new Uint8Array(buffer, 14)
+            }));
+        }
+
+        function showVideoFrame(frame) {
+            if (screenCanvas.width !== frame.displayWidth || screenCanvas.height !== frame.displayHeight) {
+                screenCanvas.width = frame.displayWidth;
+                screenCanvas.height = frame.displayHeight;
+            }
+            screenCtx.drawImage(frame, 0, 0);
+            const latency = Math.max(0, Date.now() - Math.round(frame.timestamp / 1000));
+            frame.close();
+
+            showCanvas();
+            frameShown(latency);
+        }
+
+        function startWebSocket(tiles, video) {
+            const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const query = video ? 'video=1' : frameQuery() + (tiles ? '&tiles=1' : '');
+            ws = new WebSocket(`${protocol}//${location.host}${base}/ws?${query}`);
+            ws.binaryType = 'arraybuffer';
+
+            ws.onopen = () => updateStatus(`Mirroring active - ${video ? 'H.264 video' : 'WebSocket'}`, 'success');
+
+            ws.onmessage = (event) => {
+                if (typeof event.data === 'string') {
+                    const message = JSON.parse(event.data);
+                    if (message.type === 'config') {
+                        configureVideo(message);
+                        return;
+                    }
+                    if (message.type === 'error') {
+                        updateStatus(`Video stream failed: ${message.error}`, 'error');
+                        return;
+                    }
+                    const resolve = wsPending.get(message.id);
+                    if (resolve) {
+                        wsPending.delete(message.id);
+                        resolve(message);
+                    }
+                    return;
+                }
+
+                if (video) {
+                    decodeVideo(event.data);
+                    return;
+                }
+
+                // Header: type u8, seq u32, timestamp f64, width u16, height u16, encoding u8
+                const view = new DataView(event.data);
+                const seq = view.getUint32(1);
+                const timestamp = view.getFloat64(5);
+                deviceWidth = view.getUint16(13);
+                deviceHeight = view.getUint16(15);
+                const encoding = ['', 'image/png', 'image/jpeg', 'image/webp'][view.getUint8(17)];
+                if (tiles) {
+                    compositeFrame(event.data, seq, timestamp, encoding);
+                } else {
+                    showFrame(new Blob([event.data.slice(18)], { type: encoding }), seq, timestamp);
+                }
+            };
+
+            ws.onclose = () => {
+                wsPending.forEach((resolve) => resolve({ success: false, error: 'WebSocket closed' }));
+                wsPending.clear();
+                if (isRunning) updateStatus('WebSocket closed', 'error');
+            };
+        }
+
+        async function pollStats() {
+            try {
+                const response = await fetch(`${base}/stats`);
+                const data = await response.json();
+                const mode = deliveryModeSelect.value;
+                const delivered = mode === 'stream'
+                    ? data.stream_fps / Math.max(data.stream_clients, 1)
+                    : mode.startsWith('ws') ? data.websocket_fps
+                    : mode === 'video' ? data.video.fps : data.poll_fps;
+                const captured = mode === 'video' ? data.video.fps : data.capture_fps;
+                document.getElementById('fps').textContent =
+                    `${delivered.toFixed(1)} / ${captured.toFixed(1)}`;
+                if (deliveryModeSelect.value === 'stream') {
+                    document.getElementById('frameCount').textContent = data.frames_captured;
+                }
+            } catch (error) {
+                // Stats are informational only
+            }
+        }
+
+        const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+        async function captureScreen(waitForNew) {
             const startTime = Date.now();
 
             try {
-                const response = await fetch('/screenshot');
+                const response = await fetch(waitForNew
+                    ? `${base}/screenshot?after=${lastSeq}` : `${base}/screenshot`);
                 const data = await response.json();
 
                 if (data.success) {
-                    screenImage.src = '/screen?' + new Date().getTime();
-                    screenImage.style.display = 'block';
-                    placeholder.style.display = 'none';
-                    frameCount++;
+                    // Nothing new since the last poll
+                    if (data.seq === lastSeq) return true;
+                    lastSeq = data.seq;
+                    deviceWidth = data.width;
+                    deviceHeight = data.height;
 
-                    const latency = Date.now() - startTime;
-                    latencies.push(latency);
-                    if (latencies.length > 10) latencies.shift();
+                    const frame = await fetch(`${base}/screen?seq=${data.seq}&${frameQuery()}`);
+                    if (!frame.ok) throw new Error(`Frame request failed (${frame.status})`);
+                    const [image] = await decodeImages([await frame.blob()]);
+                    drawFrame(image);
 
-                    updateStats();
+                    const latency = Date.now() - startTime;
+                    frameShown(latency);
                     updateStatus(`Mirroring active - Last frame: ${latency}ms`, 'success');
+                    return true;
                 } else {
                     throw new Error(data.error);
                 }
@@ -465,38 +3885,110 @@ def index():
                 errorCount++;
                 updateStats();
                 updateStatus(`Error: ${error.message}`, 'error');
+                return false;
+            }
+        }
+
+        // One request at a time: the next poll starts only after the previous
+        // one finished, so slow devices never pile up overlapping requests
+        async function pollLoop(generation) {
+            const refreshRate = parseInt(refreshRateSelect.value);
+            while (isRunning && generation === pollGeneration) {
+                const started = Date.now();
+                const ok = await captureScreen(refreshRate === 0);
+                const wait = ok ? refreshRate - (Date.now() - started) : 1000;
+                if (wait > 0) await sleep(wait);
+            }
+        }
+
+        async function loadDevices() {
+            try {
+                const data = await (await fetch('/devices')).json();
+                (data.devices || []).forEach((device) => {
+                    const option = document.createElement('option');
+                    option.value = device.serial;
+                    option.textContent = device.model
+                        ? `${device.model.replace(/_/g, ' ')} (${device.serial})`
+                        : `${device.serial} (${device.state})`;
+                    deviceSelect.appendChild(option);
+                });
+                deviceSelect.value = currentSerial || '';
+            } catch (error) {
+                // Only the default device can be picked
             }
         }
 
+        deviceSelect.addEventListener('change', () => {
+            const serial = deviceSelect.value;
+            location.href = serial ? `/d/${encodeURIComponent(serial)}/` : '/';
+        });
+
+        loadDevices();
+
         startBtn.addEventListener('click', async () => {
             if (isRunning) return;
+            if (deliveryModeSelect.value === 'video' && !('VideoDecoder' in window)) {
+                updateStatus('This browser cannot decode H.264 (no WebCodecs), pick another delivery mode', 'error');
+                return;
+            }
 
             isRunning = true;
             startBtn.disabled = true;
             stopBtn.disabled = false;
             refreshRateSelect.disabled = true;
+            deliveryModeSelect.disabled = true;
+            frameOptionSelects.forEach(select => select.disabled = true);
+            statsIntervalId = setInterval(pollStats, 2000);
 
-            updateStatus('Starting mirroring... <span class="loading"></span>', 'info');
+            if (deliveryModeSelect.value === 'video') {
+                startWebSocket(false, true);
+                return;
+            }
+            if (deliveryModeSelect.value === 'stream') {
+                screenImage.src = `${base}/stream?${frameQuery()}`;
+                screenImage.style.display = 'block';
+                screenCanvas.style.display = 'none';
+                placeholder.style.display = 'none';
+                updateStatus('Mirroring active - MJPEG stream', 'success');
+                return;
+            }
 
-            const refreshRate = parseInt(refreshRateSelect.value);
+            if (deliveryModeSelect.value.startsWith('ws')) {
+                startWebSocket(deliveryModeSelect.value === 'ws-tiles', false);
+                return;
+            }
 
-            // Capture first frame
-            await captureScreen();
+            updateStatus('Starting mirroring... <span class="loading"></span>', 'info');
 
-            // Start interval
-            intervalId = setInterval(captureScreen, refreshRate);
+            pollLoop(++pollGeneration);
         });
 
         stopBtn.addEventListener('click', () => {
             if (!isRunning) return;
 
             isRunning = false;
-            clearInterval(intervalId);
-            intervalId = null;
+            pollGeneration++;
+            clearInterval(statsIntervalId);
+            statsIntervalId = null;
+
+            if (deliveryModeSelect.value === 'stream') {
+                // Dropping the src closes the multipart connection
+                screenImage.removeAttribute('src');
+            }
+            if (ws) {
+                ws.close();
+                ws = null;
+            }
+            if (decoder) {
+                decoder.close();
+                decoder = null;
+            }
 
             startBtn.disabled = false;
             stopBtn.disabled = true;
             refreshRateSelect.disabled = false;
+            deliveryModeSelect.disabled = false;
+            frameOptionSelects.forEach(select => select.disabled = false);
 
             updateStatus('Mirroring stopped', 'info');
         });
@@ -506,7 +3998,7 @@ def index():
             testBtn.disabled = true;
 
             try {
-                const response = await fetch('/test');
+                const response = await fetch(`${base}/test`);
                 const data = await response.json();
 
                 if (data.success) {
@@ -521,47 +4013,59 @@ def index():
             }
         });
 
-        screenImage.addEventListener('click', async (e) => {
-            // Prevent if right mouse button was used for swipe
-            if (e.button !== 0) return;
-
-            const rect = screenImage.getBoundingClientRect();
-            const scaleX = screenImage.naturalWidth / rect.width;
-            const scaleY = screenImage.naturalHeight / rect.height;
+        function showRecording(recording) {
+            const active = Boolean(recording && recording.recording);
+            recordBtn.textContent = active ? '⏹ Stop Recording' : '⏺ Record';
+            recordBtn.className = active ? 'btn-danger' : 'btn-primary';
+            return active;
+        }
 
-            const x = Math.round((e.clientX - rect.left) * scaleX);
-            const y = Math.round((e.clientY - rect.top) * scaleY);
+        recordBtn.addEventListener('click', async () => {
+            const action = recordBtn.className === 'btn-danger' ? 'stop' : 'start';
+            recordBtn.disabled = true;
 
             try {
-                const response = await fetch('/tap', {
+                const response = await fetch(`${base}/record`, {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ x, y })
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({action})
                 });
-
                 const data = await response.json();
 
+                if (!data.success) {
+                    updateStatus(`Recording failed: ${data.error}`, 'error');
+                } else if (showRecording(data.recording)) {
+                    updateStatus(`⏺ Recording to ${data.recording.name}`, 'success');
+                } else {
+                    updateStatus(`Recording saved: <a href="/replay?name=${encodeURIComponent(data.recording.name)}">${data.recording.name}</a>`, 'success');
+                }
+            } catch (error) {
+                updateStatus(`❌ Cannot connect to backend: ${error.message}`, 'error');
+            } finally {
+                recordBtn.disabled = false;
+            }
+        });
+
+        fetch(`${base}/record`).then(response => response.json())
+            .then(data => showRecording(data.recording)).catch(() => {});
+
+        onScreen('click', async (e) => {
+            // Prevent if right mouse button was used for swipe
+            if (e.button !== 0) return;
+
+            const rect = screenElement().getBoundingClientRect();
+
+            try {
+                const data = await sendInput('tap', normalizedPoint(e.clientX - rect.left, e.clientY - rect.top, rect));
+
                 if (data.success) {
                     tapCount++;
                     updateStats();
 
                     // Visual feedback
-                    const ripple = document.createElement('div');
-                    ripple.style.cssText = `
-                        position: absolute;
-                        left: ${e.clientX - rect.left}px;
-                        top: ${e.clientY - rect.top}px;
-                        width: 40px;
-                        height: 40px;
-                        margin-left: -20px;
-                        margin-top: -20px;
-                        border: 2px solid #667eea;
-                        border-radius: 50%;
-                        pointer-events: none;
-                        animation: ripple 0.6s ease-out;
-                    `;
-                    screenImage.parentElement.appendChild(ripple);
-                    setTimeout(() => ripple.remove(), 600);
+                    placeOverlay();
+                    overlay.ripples.push({ x: e.clientX - rect.left, y: e.clientY - rect.top, start: performance.now() });
+                    requestOverlay();
                 } else {
                     throw new Error(data.error);
                 }
@@ -573,70 +4077,67 @@ def index():
         });
 
         // Right-click swipe functionality
-        screenImage.addEventListener('mousedown', (e) => {
+        onScreen('mousedown', (e) => {
             if (e.button === 2) { // Right mouse button
                 e.preventDefault();
                 isRightMouseDown = true;
 
-                const rect = screenImage.getBoundingClientRect();
+                const rect = screenElement().getBoundingClientRect();
                 swipeStartX = e.clientX - rect.left;
                 swipeStartY = e.clientY - rect.top;
                 swipeStartTime = Date.now();
                 swipePath = [{ x: swipeStartX, y: swipeStartY }];
+                queuedMove = null;
+                sendTouch('down', swipeStartX, swipeStartY);
 
                 // Draw starting point
-                drawSwipePoint(swipeStartX, swipeStartY);
-                updateStatus('🖱️ Recording swipe... Release right button to execute', 'info');
+                placeOverlay();
+                overlay.trail = { points: swipePath, fadeStart: 0 };
+                requestOverlay();
+                updateStatus('🖱️ Swiping... Release right button to lift the finger', 'info');
             }
         });
 
-        screenImage.addEventListener('mousemove', (e) => {
+        onScreen('mousemove', (e) => {
             if (isRightMouseDown) {
-                const rect = screenImage.getBoundingClientRect();
+                const rect = screenElement().getBoundingClientRect();
                 const currentX = e.clientX - rect.left;
                 const currentY = e.clientY - rect.top;
 
                 swipePath.push({ x: currentX, y: currentY });
+                sendTouch('move', currentX, currentY);
 
-                // Draw swipe line
-                drawSwipeLine(swipePath[swipePath.length - 2], swipePath[swipePath.length - 1]);
+                // Draw swipe line, at most once per display frame
+                requestOverlay();
             }
         });
 
-        screenImage.addEventListener('mouseup', async (e) => {
+        onScreen('mouseup', async (e) => {
             if (e.button === 2 && isRightMouseDown) {
                 e.preventDefault();
                 isRightMouseDown = false;
 
-                const rect = screenImage.getBoundingClientRect();
-                const scaleX = screenImage.naturalWidth / rect.width;
-                const scaleY = screenImage.naturalHeight / rect.height;
+                const rect = screenElement().getBoundingClientRect();
 
                 const endX = e.clientX - rect.left;
                 const endY = e.clientY - rect.top;
 
-                // Convert to device coordinates
-                const x1 = Math.round(swipeStartX * scaleX);
-                const y1 = Math.round(swipeStartY * scaleY);
-                const x2 = Math.round(endX * scaleX);
-                const y2 = Math.round(endY * scaleY);
-
-                // Calculate swipe duration based on mouse movement time
-                const duration = Math.min(Math.max(Date.now() - swipeStartTime, 100), 1000);
+                // Screen position in percent, for the status line
+                const percent = (value, size) => Math.round(Math.min(Math.max(value / size, 0), 1) * 100);
+                const x1 = percent(swipeStartX, rect.width);
+                const y1 = percent(swipeStartY, rect.height);
+                const x2 = percent(endX, rect.width);
+                const y2 = percent(endY, rect.height);
+                const duration = Date.now() - swipeStartTime;
 
                 try {
-                    const response = await fetch('/swipe', {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ x1, y1, x2, y2, duration })
-                    });
-
-                    const data = await response.json();
+                    // The finger already followed the mouse; lift it at the end point
+                    const data = await sendTouch('up', endX, endY);
 
                     if (data.success) {
                         swipeCount++;
                         updateStats();
-                        updateStatus(`✅ Swipe executed: (${x1},${y1}) → (${x2},${y2}) in ${duration}ms`, 'success');
+                        updateStatus(`✅ Swipe executed: (${x1}%,${y1}%) → (${x2}%,${y2}%) in ${duration}ms`, 'success');
                     } else {
                         throw new Error(data.error);
                     }
@@ -647,127 +4148,849 @@ def index():
                 }
 
                 // Clear swipe visualization after a moment
-                setTimeout(clearSwipeVisualization, 800);
+                const trail = overlay.trail;
+                setTimeout(() => clearSwipeVisualization(trail), 800);
             }
         });
 
         // Prevent context menu on right-click
-        screenImage.addEventListener('contextmenu', (e) => {
+        onScreen('contextmenu', (e) => {
             e.preventDefault();
         });
 
-        function drawSwipePoint(x, y) {
-            const point = document.createElement('div');
-            point.className = 'swipe-point';
-            point.style.cssText = `
-                position: absolute;
-                left: ${x}px;
-                top: ${y}px;
-                width: 12px;
-                height: 12px;
-                margin-left: -6px;
-                margin-top: -6px;
-                background: #28a745;
-                border: 2px solid white;
-                border-radius: 50%;
-                pointer-events: none;
-                z-index: 1000;
-                box-shadow: 0 2px 8px rgba(40, 167, 69, 0.5);
-            `;
-            screenImage.parentElement.appendChild(point);
-        }
-
-        function drawSwipeLine(from, to) {
-            const line = document.createElement('div');
-            line.className = 'swipe-line';
-
-            const length = Math.sqrt(Math.pow(to.x - from.x, 2) + Math.pow(to.y - from.y, 2));
-            const angle = Math.atan2(to.y - from.y, to.x - from.x) * 180 / Math.PI;
-
-            line.style.cssText = `
-                position: absolute;
-                left: ${from.x}px;
-                top: ${from.y}px;
-                width: ${length}px;
-                height: 3px;
-                background: linear-gradient(to right, #28a745, #20c997);
-                transform-origin: 0 0;
-                transform: rotate(${angle}deg);
-                pointer-events: none;
-                z-index: 999;
-                box-shadow: 0 1px 4px rgba(40, 167, 69, 0.4);
-            `;
-            screenImage.parentElement.appendChild(line);
-        }
-
-        function clearSwipeVisualization() {
-            const swipeElements = screenImage.parentElement.querySelectorAll('.swipe-point, .swipe-line');
-            swipeElements.forEach(el => {
-                el.style.transition = 'opacity 0.3s';
-                el.style.opacity = '0';
-                setTimeout(() => el.remove(), 300);
+        // Lay the overlay exactly over the screen, at the display's pixel density
+        function placeOverlay() {
+            const rect = screenElement().getBoundingClientRect();
+            const container = overlayCanvas.parentElement.getBoundingClientRect();
+            const ratio = window.devicePixelRatio || 1;
+            overlayCanvas.style.left = `${rect.left - container.left}px`;
+            overlayCanvas.style.top = `${rect.top - container.top}px`;
+            overlayCanvas.style.width = `${rect.width}px`;
+            overlayCanvas.style.height = `${rect.height}px`;
+            overlayCanvas.width = Math.round(rect.width * ratio);
+            overlayCanvas.height = Math.round(rect.height * ratio);
+            overlayCtx.setTransform(ratio, 0, 0, ratio, 0, 0);
+        }
+
+        function requestOverlay() {
+            if (!overlay.frame) overlay.frame = requestAnimationFrame(drawOverlay);
+        }
+
+        function drawSwipeTrail(points, alpha) {
+            overlayCtx.globalAlpha = alpha;
+            overlayCtx.lineWidth = 3;
+            overlayCtx.lineCap = 'round';
+            overlayCtx.lineJoin = 'round';
+            overlayCtx.strokeStyle = '#20c997';
+            overlayCtx.shadowColor = 'rgba(40, 167, 69, 0.5)';
+            overlayCtx.shadowBlur = 4;
+            overlayCtx.beginPath();
+            points.forEach((point, i) => i ? overlayCtx.lineTo(point.x, point.y) : overlayCtx.moveTo(point.x, point.y));
+            overlayCtx.stroke();
+
+            // Starting point
+            overlayCtx.shadowBlur = 8;
+            overlayCtx.beginPath();
+            overlayCtx.arc(points[0].x, points[0].y, 7, 0, 2 * Math.PI);
+            overlayCtx.fillStyle = '#28a745';
+            overlayCtx.fill();
+            overlayCtx.shadowBlur = 0;
+            overlayCtx.lineWidth = 2;
+            overlayCtx.strokeStyle = 'white';
+            overlayCtx.stroke();
+        }
+
+        // Redraw the whole overlay; keeps going while something is animating
+        function drawOverlay(now) {
+            overlay.frame = 0;
+            overlayCtx.clearRect(0, 0, overlayCanvas.width, overlayCanvas.height);
+
+            overlay.ripples = overlay.ripples.filter(ripple => now - ripple.start < 600);
+            overlay.ripples.forEach((ripple) => {
+                const progress = Math.max(0, now - ripple.start) / 600;
+                overlayCtx.globalAlpha = 1 - progress;
+                overlayCtx.lineWidth = 2;
+                overlayCtx.strokeStyle = '#667eea';
+                overlayCtx.beginPath();
+                overlayCtx.arc(ripple.x, ripple.y, 20 * (1 + progress), 0, 2 * Math.PI);
+                overlayCtx.stroke();
             });
+
+            const trail = overlay.trail;
+            if (trail) {
+                const alpha = trail.fadeStart ? 1 - Math.max(0, now - trail.fadeStart) / 300 : 1;
+                if (alpha > 0) {
+                    drawSwipeTrail(trail.points, alpha);
+                } else {
+                    overlay.trail = null;
+                }
+            }
+            overlayCtx.globalAlpha = 1;
+
+            if (overlay.ripples.length || (overlay.trail && overlay.trail.fadeStart)) {
+                requestOverlay();
+            }
         }
 
-        // Add ripple animation
-        const style = document.createElement('style');
-        style.textContent = `
-            @keyframes ripple {
-                to {
-                    transform: scale(2);
-                    opacity: 0;
+        function clearSwipeVisualization(trail) {
+            // A newer swipe has replaced this one
+            if (overlay.trail !== trail) return;
+            trail.fadeStart = performance.now();
+            requestOverlay();
+        }
+    </script>
+</body>
+</html>
+"""
+
+@app.route('/')
+@app.route('/d/<serial>/')
+def index(serial=None):
+    """Serve the web interface, for one device under /d/<serial>/"""
+    if serial is not None and device_registry.get(serial) is None:
+        return unknown_device(serial)
+    base = url_for('index', serial=serial).rstrip('/') if serial else ""
+    return render_template_string(INDEX_HTML, websocket=sock is not None, tiles=np is not None,
+                                  base=base, serial=serial)
+
+def unknown_device(serial):
+    return jsonify({"success": False, "error": f"Device {serial} is not attached"}), 404
+
+def devices_status(attached):
+    """/devices payload: the attached devices and their mirroring state"""
+    if device_registry.last_error:
+        return {"success": False, "error": device_registry.last_error}
+
+    mirrored = {device.serial: device for device in device_registry.active()}
+    result = []
+    for info in attached:
+        device = mirrored.get(info["serial"])
+        result.append(dict(info,
+                           mirroring=device is not None and device.engine.active,
+                           capture_fps=round(device.engine.rate.rate(), 2) if device else 0))
+    return {"success": True, "devices": result}
+
+@app.route('/devices')
+def devices():
+    """List attached devices and which of them are being mirrored"""
+    return jsonify(devices_status(device_registry.refresh(force=True)))
+
+WALL_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>ADB Screen Mirror - All Devices</title>
+    <style>
+        * {
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }
+
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            min-height: 100vh;
+            padding: 20px;
+        }
+
+        h1 {
+            color: white;
+            margin-bottom: 4px;
+        }
+
+        .subtitle {
+            color: rgba(255, 255, 255, 0.8);
+            margin-bottom: 20px;
+            font-size: 14px;
+        }
+
+        .subtitle a {
+            color: white;
+        }
+
+        .wall {
+            display: grid;
+            grid-template-columns: repeat(auto-fill, minmax(160px, 1fr));
+            gap: 12px;
+        }
+
+        .tile {
+            background: white;
+            border-radius: 10px;
+            padding: 8px;
+            cursor: pointer;
+            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.2);
+        }
+
+        .tile.focused {
+            grid-column: 1 / -1;
+            cursor: default;
+        }
+
+        .tile-header {
+            display: flex;
+            justify-content: space-between;
+            gap: 6px;
+            font-size: 12px;
+            color: #333;
+            margin-bottom: 6px;
+        }
+
+        .tile-header span {
+            overflow: hidden;
+            text-overflow: ellipsis;
+            white-space: nowrap;
+        }
+
+        .tile img {
+            display: block;
+            width: 100%;
+            background: #000;
+            border-radius: 6px;
+        }
+
+        .tile.focused img {
+            width: auto;
+            max-width: 100%;
+            max-height: 80vh;
+            margin: 0 auto;
+        }
+
+        .tile-state {
+            font-size: 12px;
+            color: #dc3545;
+            padding: 20px 0;
+            text-align: center;
+        }
+    </style>
+</head>
+<body>
+    <h1>📱 All Devices</h1>
+    <p class="subtitle">Click a device to watch it at full rate, click again to go back. <a href="/">Single device view</a></p>
+    <div id="wall" class="wall"></div>
+
+    <script>
+        const thumbnailQuery = 'encoding=jpeg&quality={{ quality }}&max={{ size }}&thumb=1';
+        const refreshInterval = {{ interval }};
+        const wall = document.getElementById('wall');
+        const tiles = new Map();
+        let focusedSerial = null;
+        let focusGeneration = 0;
+
+        const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+        const devicePath = (serial) => `/d/${encodeURIComponent(serial)}`;
+
+        function loadImage(img, src) {
+            return new Promise((resolve) => {
+                img.onload = img.onerror = resolve;
+                img.src = src;
+            });
+        }
+
+        function createTile(device) {
+            const element = document.createElement('div');
+            element.className = 'tile';
+            element.innerHTML = '<div class="tile-header"><span class="name"></span>' +
+                '<a class="open" title="Open controls">↗</a></div>' +
+                '<img alt=""><div class="tile-state"></div>';
+            element.querySelector('.name').textContent = device.model
+                ? `${device.model.replace(/_/g, ' ')} · ${device.serial}` : device.serial;
+            element.querySelector('.open').href = devicePath(device.serial) + '/';
+            element.addEventListener('click', (e) => {
+                if (e.target.classList.contains('open')) return;
+                focus(focusedSerial === device.serial ? null : device.serial);
+            });
+            const tile = { element, img: element.querySelector('img'),
+                           state: element.querySelector('.tile-state'), seq: 0 };
+            wall.appendChild(element);
+            tiles.set(device.serial, tile);
+            return tile;
+        }
+
+        function focus(serial) {
+            if (focusedSerial) {
+                const previous = tiles.get(focusedSerial);
+                if (previous) {
+                    previous.element.classList.remove('focused');
+                    previous.seq = 0;  // reload as a thumbnail
+                }
+            }
+            focusedSerial = serial;
+            focusGeneration++;
+            if (serial) {
+                tiles.get(serial).element.classList.add('focused');
+                focusLoop(serial, focusGeneration);
+            }
+        }
+
+        // The focused device follows the server's full capture rate
+        async function focusLoop(serial, generation) {
+            const tile = tiles.get(serial);
+            let seq = 0;
+            while (focusedSerial === serial && generation === focusGeneration) {
+                try {
+                    const data = await (await fetch(`${devicePath(serial)}/screenshot?after=${seq}`)).json();
+                    if (!data.success) throw new Error(data.error);
+                    if (data.seq === seq) continue;
+                    seq = data.seq;
+                    await loadImage(tile.img, `${devicePath(serial)}/screen?seq=${seq}&encoding=jpeg`);
+                } catch (error) {
+                    await sleep(1000);
+                }
+            }
+        }
+
+        async function refreshWall() {
+            const data = await (await fetch('/wall/frames')).json();
+            const seen = new Set();
+            (data.devices || []).forEach((device) => {
+                seen.add(device.serial);
+                const tile = tiles.get(device.serial) || createTile(device);
+                const problem = device.state !== 'device' ? device.state : device.error;
+                tile.state.textContent = problem || '';
+                tile.state.style.display = problem ? 'block' : 'none';
+                if (device.serial === focusedSerial || !device.seq || device.seq === tile.seq) return;
+                tile.seq = device.seq;
+                tile.img.src = `${devicePath(device.serial)}/screen?seq=${device.seq}&${thumbnailQuery}`;
+            });
+            tiles.forEach((tile, serial) => {
+                if (seen.has(serial)) return;
+                if (serial === focusedSerial) focus(null);
+                tile.element.remove();
+                tiles.delete(serial);
+            });
+        }
+
+        async function wallLoop() {
+            while (true) {
+                const started = Date.now();
+                try {
+                    await refreshWall();
+                } catch (error) {
+                    // Server restarting, try again next round
                 }
+                await sleep(Math.max(0, refreshInterval - (Date.now() - started)));
             }
-        `;
-        document.head.appendChild(style);
+        }
+
+        wallLoop();
     </script>
 </body>
 </html>
+"""
+
+@app.route('/wall')
+def wall():
+    """Serve the wall view: every attached device as a live thumbnail"""
+    return render_template_string(WALL_HTML, size=WALL_THUMBNAIL_SIZE, quality=WALL_THUMBNAIL_QUALITY,
+                                  interval=round(WALL_FRAME_INTERVAL * 1000))
+
+def wall_status(attached):
+    """/wall/frames payload, keeps every online device capturing thumbnails"""
+    if device_registry.last_error:
+        return {"success": False, "error": device_registry.last_error}
+
+    result = []
+    for info in attached:
+        entry = dict(info, seq=0)
+        device = (device_registry.get(info["serial"], refresh=False)
+                  if info["state"] == "device" else None)
+        if device is not None:
+            device.engine.touch(thumbnail=True)
+            frame = device.engine.latest()
+            if frame is not None:
+                entry.update(seq=frame.seq, width=frame.width, height=frame.height)
+            entry["error"] = device.engine.last_error
+        result.append(entry)
+    return {"success": True, "devices": result}
+
+@app.route('/wall/frames')
+def wall_frames():
+    """Latest frame of every attached device, for the wall view
+
+    Polling this keeps all online devices capturing at the thumbnail rate.
     """
-    return render_template_string(html)
+    return jsonify(wall_status(device_registry.refresh()))
+
+REPLAY_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>ADB Screen Mirror - Replay</title>
+    <style>
+        * {
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }
+
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            min-height: 100vh;
+            padding: 20px;
+        }
+
+        h1 {
+            color: white;
+            margin-bottom: 4px;
+        }
+
+        .subtitle {
+            color: rgba(255, 255, 255, 0.8);
+            margin-bottom: 20px;
+            font-size: 14px;
+        }
+
+        .subtitle a {
+            color: white;
+        }
+
+        .player {
+            background: white;
+            border-radius: 10px;
+            padding: 12px;
+            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.2);
+            max-width: 900px;
+            margin: 0 auto;
+        }
+
+        .controls {
+            display: flex;
+            gap: 8px;
+            align-items: center;
+            margin-bottom: 10px;
+            font-size: 13px;
+            color: #333;
+        }
+
+        .controls select {
+            flex: 1;
+            min-width: 0;
+        }
+
+        .controls input[type=range] {
+            flex: 3;
+        }
+
+        button {
+            padding: 6px 14px;
+            border: none;
+            border-radius: 6px;
+            background: #667eea;
+            color: white;
+            cursor: pointer;
+        }
+
+        #screen {
+            display: block;
+            max-width: 100%;
+            max-height: 75vh;
+            margin: 0 auto;
+            background: #000;
+            border-radius: 6px;
+        }
+
+        #events {
+            font-family: monospace;
+            font-size: 12px;
+            color: #555;
+            margin-top: 10px;
+            max-height: 120px;
+            overflow-y: auto;
+        }
+
+        .event.current {
+            color: #667eea;
+            font-weight: bold;
+        }
+    </style>
+</head>
+<body>
+    <h1>⏺ Recorded Sessions</h1>
+    <p class="subtitle">Drag the slider to jump anywhere in a session. <a href="/">Live view</a></p>
+    <div class="player">
+        <div class="controls">
+            <select id="recording"></select>
+            <button id="play">▶</button>
+            <input id="position" type="range" min="0" max="0" step="0.1" value="0">
+            <span id="time">0.0 s</span>
+        </div>
+        <img id="screen" alt="">
+        <div id="events"></div>
+    </div>
+
+    <script>
+        const select = document.getElementById('recording');
+        const position = document.getElementById('position');
+        const screen = document.getElementById('screen');
+        const timeLabel = document.getElementById('time');
+        const playButton = document.getElementById('play');
+        const eventList = document.getElementById('events');
+        let recording = null;
+        let wanted = 0;
+        let loading = false;
+        let playing = false;
+
+        function loadImage(src) {
+            return new Promise((resolve) => {
+                screen.onload = screen.onerror = resolve;
+                screen.src = src;
+            });
+        }
+
+        // One frame request at a time; while it loads only the newest position is kept
+        async function show(t) {
+            wanted = t;
+            if (loading || !recording) {
+                return;
+            }
+            loading = true;
+            let shown;
+            do {
+                shown = wanted;
+                await loadImage(`/recordings/frame?name=${encodeURIComponent(recording.name)}&t=${shown}&encoding=jpeg`);
+            } while (shown !== wanted);
+            loading = false;
+            timeLabel.textContent = `${shown.toFixed(1)} s`;
+            for (const item of eventList.children) {
+                item.classList.toggle('current', Math.abs(item.dataset.t - shown) < 0.5);
+            }
+        }
+
+        async function selectRecording() {
+            recording = recordings.find(item => item.name === select.value);
+            playing = false;
+            playButton.textContent = '▶';
+            position.max = recording ? recording.duration : 0;
+            position.value = 0;
+            eventList.innerHTML = '';
+            if (!recording) {
+                return;
+            }
+            const response = await fetch(`/recordings/events?name=${encodeURIComponent(recording.name)}`);
+            const data = await response.json();
+            for (const event of data.events || []) {
+                const item = document.createElement('div');
+                const t = event.timestamp - recording.started;
+                item.className = 'event';
+                item.dataset.t = t;
+                item.textContent = `${t.toFixed(1)} s  ${event.type}  ${JSON.stringify(event)}`;
+                item.onclick = () => { position.value = t; show(t); };
+                eventList.appendChild(item);
+            }
+            show(0);
+        }
+
+        async function play() {
+            let last = Date.now();
+            while (playing) {
+                const now = Date.now();
+                const t = Math.min(Number(position.value) + (now - last) / 1000, recording.duration);
+                last = now;
+                position.value = t;
+                await show(t);
+                if (t >= recording.duration) {
+                    playing = false;
+                    playButton.textContent = '▶';
+                }
+            }
+        }
+
+        playButton.onclick = () => {
+            if (!recording) {
+                return;
+            }
+            playing = !playing;
+            playButton.textContent = playing ? '⏸' : '▶';
+            if (playing) {
+                if (Number(position.value) >= recording.duration) {
+                    position.value = 0;
+                }
+                play();
+            }
+        };
+        position.oninput = () => show(Number(position.value));
+        select.onchange = selectRecording;
+
+        let recordings = [];
+        fetch('/recordings').then(response => response.json()).then(data => {
+            recordings = data.recordings || [];
+            for (const item of recordings) {
+                const option = document.createElement('option');
+                option.value = item.name;
+                option.textContent = `${item.name} (${item.duration.toFixed(0)} s)`;
+                select.appendChild(option);
+            }
+            const requested = new URLSearchParams(location.search).get('name');
+            if (requested) {
+                select.value = requested;
+            }
+            selectRecording();
+        });
+    </script>
+</body>
+</html>
+"""
+
+@app.route('/replay')
+def replay():
+    """Serve the replay view for recorded sessions"""
+    return render_template_string(REPLAY_HTML)
+
+@app.route('/recordings')
+def recordings_list():
+    """List recorded sessions, newest first"""
+    return jsonify({"success": True, "recordings": list_recordings()})
+
+@app.route('/recordings/frame')
+def recording_frame():
+    """The screen of a recording t seconds after it started"""
+    options, error = frame_options(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    data, result, timestamp = replay_frame(request.args.get('name'),
+                                           request.args.get('t', 0, type=float), options)
+    if data is None:
+        return jsonify({"error": result}), 404
+    response = Response(data, mimetype=FRAME_MIMETYPES[result])
+    response.headers['X-Frame-Time'] = f"{timestamp:.3f}"
+    return response
+
+@app.route('/recordings/events')
+def recording_events():
+    """Input events of a recording, optionally between two timestamps"""
+    recording = open_recording(request.args.get('name'))
+    if recording is None:
+        return jsonify({"success": False, "error": "Unknown recording"}), 404
+    events = recording.events(request.args.get('from', 0, type=float),
+                              request.args.get('to', float("inf"), type=float))
+    return jsonify({"success": True, "events": events})
+
+def connection_status(serial, success, attached, error):
+    """/test payload from the result of list_devices()"""
+    online = [info["serial"] for info in attached if info["state"] == "device"]
+    if serial is not None:
+        online = [device for device in online if device == serial]
+
+    if success and online:
+        return {"success": True, "device": online[0], "devices": online}
+
+    return {"success": False, "error": error or "No devices found"}
 
 @app.route('/test')
-def test_connection():
+@app.route('/d/<serial>/test')
+def test_connection(serial=None):
     """Test ADB connection"""
-    success, output, error = run_adb_command("adb devices")
+    return jsonify(connection_status(serial, *list_devices()))
 
-    if success and output:
-        lines = output.strip().split('\n')
-        if len(lines) > 1:
-            device = lines[1].split('\t')[0] if '\t' in lines[1] else "Unknown"
-            return jsonify({"success": True, "device": device})
-
-    return jsonify({"success": False, "error": error or "No devices found"})
+def frame_status(engine, frame):
+    """/screenshot payload for frame, which may be None"""
+    if frame is not None:
+        return {"success": True, "seq": frame.seq, "timestamp": frame.timestamp,
+                "width": frame.width, "height": frame.height, "display": frame.display}
+    else:
+        return {"success": False, "error": engine.last_error or "No frame captured yet"}
 
 @app.route('/screenshot')
-def screenshot():
-    """Capture and return screenshot status"""
-    success, result = capture_screenshot()
+@app.route('/d/<serial>/screenshot')
+def screenshot(serial=None):
+    """Return the sequence number of the latest captured frame
 
-    if success:
-        return jsonify({"success": True})
+    With ?after=<seq> the request waits until a newer frame exists, so
+    clients can follow the server's adaptive capture rate.
+    """
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    engine = device.engine
+    engine.touch()
+    after = request.args.get('after', type=int)
+    if after is not None:
+        frame = engine.wait_for_frame(after)
     else:
-        return jsonify({"success": False, "error": result})
+        frame = engine.latest() or engine.wait_for_frame()
+    return jsonify(frame_status(engine, frame))
 
 @app.route('/screen')
-def get_screen():
-    """Serve the screenshot image"""
-    if os.path.exists(LOCAL_SCREENSHOT):
-        return send_file(LOCAL_SCREENSHOT, mimetype='image/png')
+@app.route('/d/<serial>/screen')
+def get_screen(serial=None):
+    """Serve the requested (or latest) frame from memory
+
+    Query options: encoding (png/jpeg/webp), quality (1-100) and max
+    (longest side in pixels) trade fidelity for throughput per viewer.
+    thumb=1 marks a thumbnail viewer that does not need the full frame rate.
+    """
+    start = time.time()
+    options, error = frame_options(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    engine = device.engine
+    engine.touch(thumbnail=request.args.get('thumb') == '1')
+    seq = request.args.get('seq', type=int)
+    frame = (seq and engine.get(seq)) or engine.latest()
+
+    if frame is not None:
+        encoding, etag = frame_etag(frame, options)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            # The encoded bytes go out as they are, no file wrapper or copy
+            response = Response(frame.encode(**options), mimetype=FRAME_MIMETYPES[encoding])
+        response.set_etag(etag)
+        response.headers['X-Frame-Seq'] = str(frame.seq)
+        response.headers.update(frame_transform(frame, options))
+        response.headers['Cache-Control'] = 'no-cache'
+        device.delivery_rates["poll"].mark()
+        metrics.observe("delivery_seconds", time.time() - start, path="poll", **device.labels)
+        return response
     else:
         return jsonify({"error": "No screenshot available"}), 404
 
-@app.route('/tap', methods=['POST'])
-def tap():
-    """Handle tap command"""
-    data = request.json
-    x = data.get('x')
-    y = data.get('y')
+@app.route('/stream')
+@app.route('/d/<serial>/stream')
+def stream(serial=None):
+    """Push frames as an MJPEG (multipart/x-mixed-replace) stream"""
+    options, error = frame_options(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    # MJPEG parts are always JPEG, only quality and size are adjustable
+    options["encoding"] = "jpeg"
+
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    engine = device.engine
+
+    def generate():
+        device.count_stream(1)
+        subscriber = engine.subscribe()
+        try:
+            while True:
+                frame = subscriber.next()
+                if frame is None:
+                    continue
+                data = frame.encode(**options)
+                device.delivery_rates["stream"].mark()
+                yield mjpeg_header(data)
+                # The server writes the frame out before resuming the generator
+                start = time.time()
+                yield data
+                metrics.observe("delivery_seconds", time.time() - start, path="stream",
+                                **device.labels)
+        finally:
+            subscriber.close()
+            device.count_stream(-1)
+
+    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-store'})
+
+def device_stats(device):
+    """/stats payload: capture and delivery rates of one device"""
+    engine = device.engine
+    delivery_rates = device.delivery_rates
+    return {
+        "device": device.serial,
+        "capture_fps": round(engine.rate.rate(), 2),
+        "poll_fps": round(delivery_rates["poll"].rate(), 2),
+        "stream_fps": round(delivery_rates["stream"].rate(), 2),
+        "stream_clients": device.stream_clients,
+        "websocket_fps": round(delivery_rates["websocket"].rate(), 2),
+        "frames_captured": engine.rate.total,
+        "frames_unchanged": engine.unchanged,
+        "subscribers": engine.subscribers,
+        "frames_skipped": engine.skipped,
+        "last_capture_ms": round(engine.latest().latency * 1000) if engine.latest() else None,
+        "capture_format": CAPTURE_FORMAT,
+        "input": dict(device.input.stats(), shell_restarts=device.input.shell.restarts),
+        "rate_control": dict(engine.controller.status(),
+                             achieved_fps=round(engine.rate.rate(), 2)),
+        "pipeline": engine.pipeline.stats(),
+        "capture_pool": capture_pool.stats(),
+        "encode_pool": encode_pool.stats(),
+        "frame_store": frame_store.stats(),
+        "video": device.video.stats(),
+        "spawn_pool": device.spawn_pool.stats(),
+        "display": device.geometry.stats(),
+        "recording": device.recorder.stats() if device.recorder is not None else None,
+        "timings": metrics.summary(**device.labels),
+    }
 
-    if x is None or y is None:
-        return jsonify({"success": False, "error": "Missing x or y coordinate"})
+@app.route('/stats')
+@app.route('/d/<serial>/stats')
+def stats(serial=None):
+    """Report capture and delivery frame rates"""
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    return jsonify(device_stats(device))
+
+def metrics_text():
+    """/metrics payload: latency histograms plus frame and input counters"""
+    lines = metrics.prometheus()
+    counters = {
+        "frames_captured_total": ("counter", "Frames captured", []),
+        "frames_unchanged_total": ("counter", "Captures identical to the previous frame", []),
+        "frames_skipped_total": ("counter", "Frames viewers skipped to catch up", []),
+        "frames_delivered_total": ("counter", "Frames handed to viewers", []),
+        "input_events_total": ("counter", "Input events by outcome", []),
+        "subscribers": ("gauge", "Viewers following the capture stream", []),
+    }
+    for device in device_registry.active():
+        labels = tuple(device.labels.items())
+        engine = device.engine
+        counters["frames_captured_total"][2].append((labels, engine.rate.total))
+        counters["frames_unchanged_total"][2].append((labels, engine.unchanged))
+        counters["frames_skipped_total"][2].append((labels, engine.skipped))
+        counters["subscribers"][2].append((labels, engine.subscribers))
+        for path, meter in device.delivery_rates.items():
+            counters["frames_delivered_total"][2].append((labels + (("path", path),), meter.total))
+        for outcome, count in device.input.stats().items():
+            if outcome != "pending":
+                counters["input_events_total"][2].append((labels + (("outcome", outcome),), count))
+
+    for name, (kind, description, samples) in counters.items():
+        metric = METRIC_PREFIX + name
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+        lines += [f"{metric}{prometheus_labels(labels)} {value}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for all devices (per-device summaries are in /stats)"""
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+# Handler time per endpoint; streams and WebSockets live as long as the viewer
+UNTIMED_ENDPOINTS = ("stream", "websocket", "device_websocket")
+
+@app.before_request
+def start_timer():
+    request.environ["adb_mirror.start"] = time.time()
+
+@app.after_request
+def record_request_time(response):
+    start = request.environ.get("adb_mirror.start")
+    if start is not None and request.endpoint and request.endpoint not in UNTIMED_ENDPOINTS:
+        metrics.observe("http_request_seconds", time.time() - start, endpoint=request.endpoint)
+    return response
 
-    success, error = send_tap(x, y)
+@app.route('/tap', methods=['POST'])
+@app.route('/d/<serial>/tap', methods=['POST'])
+def tap(serial=None):
+    """Handle tap command"""
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    success, error = handle_input(device, "tap", request.json)
 
     if success:
         return jsonify({"success": True})
@@ -775,20 +4998,30 @@ def tap():
         return jsonify({"success": False, "error": error})
 
 @app.route('/swipe', methods=['POST'])
-def swipe():
+@app.route('/d/<serial>/swipe', methods=['POST'])
+def swipe(serial=None):
     """Handle swipe command"""
-    data = request.json
-    x1 = data.get('x1')
-    y1 = data.get('y1')
-    x2 = data.get('x2')
-    y2 = data.get('y2')
-    duration = data.get('duration', 300)  # Default 300ms swipe duration
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    success, error = handle_input(device, "swipe", request.json)
 
-    if None in [x1, y1, x2, y2]:
-        return jsonify({"success": False, "error": "Missing coordinates"})
+    if success:
+        return jsonify({"success": True})
+    else:
+        return jsonify({"success": False, "error": error})
+
+@app.route('/touch', methods=['GET', 'POST'])
+@app.route('/d/<serial>/touch', methods=['GET', 'POST'])
+def touch(serial=None):
+    """Stream touch down/move/up events, GET reports the injection backend"""
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    if request.method == 'GET':
+        return jsonify(dict(device.injector.capabilities(), success=True))
 
-    # ADB swipe command: adb shell input swipe x1 y1 x2 y2 duration
-    success, _, error = run_adb_command(f"adb shell input swipe {x1} {y1} {x2} {y2} {duration}")
+    success, error = handle_input(device, "touch", request.json)
 
     if success:
         return jsonify({"success": True})
@@ -796,22 +5029,207 @@ def swipe():
         return jsonify({"success": False, "error": error})
 
 @app.route('/key', methods=['POST'])
-def send_key():
+@app.route('/d/<serial>/key', methods=['POST'])
+def send_key(serial=None):
     """Send a keyevent to Android"""
-    data = request.json
-    key = data.get('key')
-
-    if key is None:
-        return jsonify({"success": False, "error": "Missing key"})
-
-    # ADB: adb shell input keyevent <KEYCODE>
-    success, _, error = run_adb_command(f"adb shell input keyevent {key}")
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    success, error = handle_input(device, "key", request.json)
 
     if success:
         return jsonify({"success": True})
     else:
         return jsonify({"success": False, "error": error})
 
+@app.route('/record', methods=['GET', 'POST'])
+@app.route('/d/<serial>/record', methods=['GET', 'POST'])
+def record(serial=None):
+    """Start or stop recording the session, GET reports the recording"""
+    device = device_registry.get(serial)
+    if device is None:
+        return unknown_device(serial)
+    if request.method == 'POST':
+        success, error = record_control(device, request.json)
+        if not success:
+            return jsonify({"success": False, "error": error})
+    recorder = device.recorder
+    return jsonify({"success": True, "recording": recorder.stats() if recorder else None})
+
+class WebSocketSession:
+    """Frame push and input handling for one WebSocket client
+
+    Frames are sent as binary messages (WS_FRAME_HEADER followed by the image)
+    and the client acknowledges each one. At most WS_MAX_IN_FLIGHT frames are
+    unacknowledged at a time; frames captured meanwhile are skipped, so a slow
+    client always gets the newest frame next instead of a growing backlog.
+    With tiles enabled only the regions that changed since the previously
+    sent frame are pushed (WS_MSG_TILES) for the client to composite.
+    In video mode the device's H.264 stream is pushed instead, every access
+    unit in order (WS_MSG_VIDEO) without acknowledgements.
+    Input events arrive as JSON text messages and are answered with a result
+    message carrying the same id.
+    """
+
+    def __init__(self, ws, device, options, tiles=False, video=False):
+        self.ws = ws
+        self.device = device
+        self.options = options
+        self.tiles = tiles and np is not None
+        self.video = video
+        if options["encoding"] is None:
+            options["encoding"] = FRAME_ENCODING
+        self.send_lock = threading.Lock()
+        self.credit = threading.Condition()
+        self.in_flight = 0
+        self.closed = False
+
+    def send(self, message):
+        with self.send_lock:
+            self.ws.send(message)
+
+    def _frame_message(self, frame):
+        encoding = self.options["encoding"]
+        header = WS_FRAME_HEADER.pack(WS_MSG_FRAME, frame.seq, frame.timestamp,
+                                      frame.width, frame.height, WS_ENCODINGS[encoding])
+        return header + frame.encode(**self.options)
+
+    def _tiles_message(self, frame, rects):
+        encoding = self.options["encoding"]
+        parts = [WS_FRAME_HEADER.pack(WS_MSG_TILES, frame.seq, frame.timestamp,
+                                      frame.width, frame.height, WS_ENCODINGS[encoding]),
+                 WS_TILE_COUNT.pack(len(rects))]
+        for rect in rects:
+            data = frame.encode_region(rect, encoding, self.options["quality"],
+                                       self.options["max_size"])
+            parts.append(WS_TILE_HEADER.pack(*rect, len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+    def _push_frames(self):
+        previous = None
+        subscriber = self.device.engine.subscribe()
+        try:
+            while not self.closed:
+                with self.credit:
+                    while self.in_flight >= WS_MAX_IN_FLIGHT and not self.closed:
+                        self.credit.wait(1)
+                if self.closed:
+                    break
+
+                frame = subscriber.next(timeout=1)
+                if frame is None:
+                    continue
+
+                rects = frame.dirty_rects(previous) if self.tiles and previous else None
+                previous = frame
+                if rects is not None and not rects:
+                    # Changed and changed back since the last frame we sent
+                    continue
+                changed = sum(rect[2] * rect[3] for rect in rects) if rects else 0
+                if rects and changed <= TILE_MAX_AREA * frame.width * frame.height:
+                    message = self._tiles_message(frame, rects)
+                else:
+                    message = self._frame_message(frame)
+
+                with self.credit:
+                    self.in_flight += 1
+                start = time.time()
+                self.send(message)
+                self.device.delivery_rates["websocket"].mark()
+                metrics.observe("delivery_seconds", time.time() - start, path="websocket",
+                                **self.device.labels)
+        except WS_CLOSED_ERRORS:
+            self.closed = True
+        except Exception:
+            app.logger.exception("WebSocket frame push failed")
+            self.closed = True
+        finally:
+            subscriber.close()
+
+    def _push_video(self):
+        video = self.device.video
+        video.subscribe()
+        config = None
+        seq = 0
+        try:
+            while not self.closed:
+                units = video.units_after(seq, timeout=1)
+                if not units and not video.running:
+                    self.send(json.dumps({"type": "error", "error": video.error
+                                          or "Video stream stopped"}))
+                    break
+                if units and video.config() != config:
+                    config = video.config()
+                    self.send(json.dumps(config))
+                for unit_seq, keyframe, timestamp, data in units:
+                    start = time.time()
+                    self.send(WS_VIDEO_HEADER.pack(WS_MSG_VIDEO, unit_seq, timestamp, keyframe)
+                              + data)
+                    seq = unit_seq
+                    self.device.delivery_rates["websocket"].mark()
+                    metrics.observe("delivery_seconds", time.time() - start, path="video",
+                                    **self.device.labels)
+        except WS_CLOSED_ERRORS:
+            self.closed = True
+        except Exception:
+            app.logger.exception("WebSocket video push failed")
+            self.closed = True
+        finally:
+            video.unsubscribe()
+
+    def run(self):
+        pusher = threading.Thread(target=self._push_video if self.video else self._push_frames,
+                                  daemon=True)
+        pusher.start()
+        try:
+            while not self.closed:
+                message = self.ws.receive()
+                if message is None:
+                    break
+                try:
+                    event = json.loads(message)
+                except (TypeError, ValueError):
+                    continue
+
+                kind = event.get("type")
+                if kind == "ack":
+                    with self.credit:
+                        self.in_flight = max(0, self.in_flight - 1)
+                        self.credit.notify_all()
+                    continue
+
+                success, error = handle_input(self.device, kind, event)
+                reply = {"type": "result", "id": event.get("id"), "success": success}
+                if not success:
+                    reply["error"] = error
+                self.send(json.dumps(reply))
+        except WS_CLOSED_ERRORS:
+            pass
+        except Exception:
+            app.logger.exception("WebSocket session failed")
+        finally:
+            with self.credit:
+                self.closed = True
+                self.credit.notify_all()
+
+if sock is not None:
+    def websocket(ws, serial=None):
+        """Binary frame push and input events over a single WebSocket"""
+        options, error = frame_options(request.args)
+        if error:
+            ws.close(message=error)
+            return
+        device = device_registry.get(serial)
+        if device is None:
+            ws.close(message=f"Device {serial} is not attached")
+            return
+        WebSocketSession(ws, device, options, request.args.get('tiles') == '1',
+                         request.args.get('video') == '1').run()
+
+    sock.route('/ws')(websocket)
+    sock.route('/d/<serial>/ws', endpoint='device_websocket')(websocket)
+
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -826,4 +5244,6 @@ if __name__ == '__main__':
     print("=" * 60)
     print()
 
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # One thread per request, so long-polls and streams for one device never
+    # hold up requests for another
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
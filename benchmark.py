@@ -0,0 +1,589 @@
+"""
+Benchmarks for py-adb-mirror.
+
+By default everything runs against fake_adb.py: a fake adb server on a free
+port for the socket backend and a fake adb executable put first in PATH for
+the subprocess backend, so results are reproducible without a phone. Pass
+--real to measure the real adb server and the connected device instead.
+
+    python benchmark.py transport --iterations 50
+    python benchmark.py capture --latency 0.05 --width 1080 --height 2400
+    python benchmark.py pipeline --latency 0.15 --transfer 0.15
+    python benchmark.py encode-pool --iterations 200
+    python benchmark.py fanout --viewers 1 4 16 --duration 5 --latency 0.05
+    python benchmark.py all --json results.json
+
+Latencies are wall-clock per call. cpu_ms is the CPU time this process
+spent per call; the fake adb server runs inside it, the adb binary and the
+fake executable do not. rss_mb is the resident memory after the case ran.
+--json writes every result together with the settings and the platform,
+so runs can be compared between releases.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+import fake_adb
+from adb_client import AdbClient
+
+try:
+    import resource
+except ImportError:  # Not on Windows, memory is then left out
+    resource = None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def rss_mb():
+    """Resident memory of this process in MB, or None if it cannot be read"""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # Peak rather than current, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+    return None
+
+
+def measure(function, iterations, pause=0):
+    """Call function iterations times and return latency, CPU and memory stats
+
+    pause seconds pass between calls, untimed, for paths that prepare the
+    next call in the background.
+    """
+    function()  # warm up: spawn caches, pooled connections, shells
+    samples = []
+    cpu_start = time.process_time()
+    for _ in range(iterations):
+        time.sleep(pause)
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    cpu = time.process_time() - cpu_start
+    return {
+        "mean_ms": round(statistics.mean(samples), 2),
+        "p50_ms": round(percentile(samples, 0.5), 2),
+        "p99_ms": round(percentile(samples, 0.99), 2),
+        "per_sec": round(1000 / statistics.mean(samples), 1),
+        "cpu_ms": round(cpu * 1000 / iterations, 2),
+        "rss_mb": rss_mb(),
+    }
+
+
+def succeeded(result):
+    """Raise if an adb_screen (success, ...) result failed, so broken cases are not timed"""
+    if not result[0]:
+        raise RuntimeError(result[-1])
+    return result
+
+
+@contextlib.contextmanager
+def settings(module, **values):
+    """Temporarily set module-level configuration"""
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+@contextlib.contextmanager
+def fresh_state():
+    """Give one benchmark a device registry and frame store of its own
+
+    Engines and video streams the benchmark started through the registry
+    are stopped when it ends, so with `all` they do not keep capturing from
+    the fake device (and sharing its encoder) while the next benchmark is
+    measured.
+    """
+    import adb_screen
+
+    registry = adb_screen.DeviceRegistry()
+    with settings(adb_screen, device_registry=registry, frame_store=adb_screen.FrameStore()):
+        try:
+            yield
+        finally:
+            devices = registry.active()
+            for device in devices:
+                # The next step finds the engine (and screenrecord) idle
+                device.engine.last_request = 0
+                device.video.last_viewer = 0
+            deadline = time.time() + 5
+            while (any(device.engine.active or device.video.running for device in devices)
+                   and time.time() < deadline):
+                time.sleep(0.05)
+            for device in devices:
+                device.input.shell.close()
+
+
+def host_client(port):
+    return AdbClient(port=port) if port else AdbClient()
+
+
+@contextlib.contextmanager
+def fake_environment(devices=1, latency=0.0, width=fake_adb.SCREEN_WIDTH,
+                     height=fake_adb.SCREEN_HEIGHT, transfer=0.0):
+    """Run a fake adb server and put a fake adb executable first in PATH
+
+    Yields the server port.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        shim = os.path.join(directory, "adb")
+        script = os.path.abspath(fake_adb.__file__)
+        with open(shim, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(shim, 0o755)
+
+        saved = {key: os.environ.get(key) for key in
+                 ("PATH", "FAKE_ADB_DIR", "FAKE_ADB_DEVICES", "FAKE_ADB_LATENCY",
+                  "FAKE_ADB_WIDTH", "FAKE_ADB_HEIGHT", "FAKE_ADB_TRANSFER")}
+        os.environ.update({
+            "PATH": directory + os.pathsep + os.environ.get("PATH", ""),
+            "FAKE_ADB_DIR": directory,
+            "FAKE_ADB_DEVICES": str(devices),
+            "FAKE_ADB_LATENCY": str(latency),
+            "FAKE_ADB_WIDTH": str(width),
+            "FAKE_ADB_HEIGHT": str(height),
+            "FAKE_ADB_TRANSFER": str(transfer),
+        })
+
+        server = fake_adb.FakeAdbServer(
+            ("127.0.0.1", 0),
+            fake_adb.make_devices(devices, latency=latency, width=width, height=height,
+                                  storage=directory, transfer=transfer))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            yield server.server_address[1]
+        finally:
+            server.shutdown()
+            server.server_close()
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+
+
+@contextlib.contextmanager
+def serve_app(port):
+    """Serve the Flask app over real HTTP on a free port, yields the base URL"""
+    import adb_screen
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with settings(adb_screen, adb_client=host_client(port), ADB_BACKEND="socket"):
+        server = make_server("127.0.0.1", 0, adb_screen.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            yield f"http://127.0.0.1:{server.server_port}"
+        finally:
+            server.shutdown()
+
+
+def bench_transport(options, port):
+    """adb binary via a host shell or exec'd directly vs. native protocol client, per call"""
+    import adb_screen
+
+    pooled = host_client(port)
+    unpooled = AdbClient(port=port, pool_size=0) if port else AdbClient(pool_size=0)
+    with settings(adb_screen, ADB_BACKEND="socket"):
+        device = adb_screen.Device()
+        device.client = pooled
+        shell = adb_screen.AdbShell(device)
+        spawn_pool = adb_screen.SpawnPool(device)
+
+        cases = {
+            "subprocess exec-out screencap -p":
+                lambda: adb_screen.run_adb_binary(["exec-out", "screencap", "-p"]),
+            "socket exec-out screencap -p":
+                lambda: pooled.exec_out("screencap -p"),
+            "socket exec-out screencap -p (no pool)":
+                lambda: unpooled.exec_out("screencap -p"),
+            # The old path: a host shell parses the command line, then runs adb
+            "host shell adb shell input tap":
+                lambda: subprocess.run("adb shell input tap 1 1", shell=True, capture_output=True,
+                                       timeout=adb_screen.ADB_COMMAND_TIMEOUT),
+            "subprocess shell input tap":
+                lambda: adb_screen.run_adb_command(["shell", "input tap 1 1"]),
+            "socket shell input tap":
+                lambda: pooled.shell("input tap 1 1"),
+            "persistent shell input tap":
+                lambda: shell.run("input tap 1 1"),
+        }
+        results = {name: measure(case, options.iterations) for name, case in cases.items()}
+        # One-off commands are not back to back in practice, give the pool
+        # time to start the next process
+        for name, case in (("host shell adb shell input tap, 0.2s apart",
+                            cases["host shell adb shell input tap"]),
+                           ("subprocess shell input tap, 0.2s apart",
+                            cases["subprocess shell input tap"]),
+                           ("spawn pool shell input tap, 0.2s apart",
+                            lambda: spawn_pool.run("input tap 1 1"))):
+            results[name] = measure(case, options.iterations, pause=0.2)
+    spawn_pool.close()
+    shell.close()
+    pooled.close()
+    return results
+
+
+def bench_capture(options, port):
+    """capture_screenshot() for every adb backend, capture mode and frame format"""
+    import adb_screen
+
+    client = host_client(port)
+    results = {}
+    for backend in ("socket", "subprocess"):
+        for mode in ("exec-out", "pull"):
+            for capture_format in ("png", "raw"):
+                with settings(adb_screen, adb_client=client, ADB_BACKEND=backend,
+                              CAPTURE_MODE=mode, CAPTURE_FORMAT=capture_format):
+                    device = adb_screen.Device()
+                    results[f"{backend} {mode} {capture_format}"] = measure(
+                        lambda: succeeded(adb_screen.capture_screenshot(device)),
+                        options.iterations)
+    client.close()
+    return results
+
+
+def bench_encode(options, port):
+    """Host-side decoding and encoding of one captured frame per output variant"""
+    import adb_screen
+
+    client = host_client(port)
+    sources = {}
+    with settings(adb_screen, adb_client=client, ADB_BACKEND="socket", CAPTURE_MODE="exec-out"):
+        device = adb_screen.Device()
+        for capture_format in ("png", "raw"):
+            with settings(adb_screen, CAPTURE_FORMAT=capture_format):
+                sources[capture_format] = succeeded(adb_screen.capture_screenshot(device))[1]
+    client.close()
+
+    variants = {
+        "jpeg q80": {"encoding": "jpeg", "quality": 80},
+        "jpeg q50 720px": {"encoding": "jpeg", "quality": 50, "max_size": 720},
+        "webp q80": {"encoding": "webp", "quality": 80},
+        "png": {"encoding": "png"},
+        "wall thumbnail": {"encoding": "jpeg", "quality": adb_screen.WALL_THUMBNAIL_QUALITY,
+                           "max_size": adb_screen.WALL_THUMBNAIL_SIZE},
+    }
+    # A new Frame per call, since encode() caches every variant it produced.
+    # Encoded in this process: encode-pool measures the worker processes.
+    results = {"png decode": measure(lambda: adb_screen.Frame(1, sources["png"], 0, 0).image(),
+                                     options.iterations)}
+    with settings(adb_screen, encode_pool=adb_screen.EncodePool("inline")):
+        for source_name, source in sources.items():
+            for name, variant in variants.items():
+                results[f"{source_name} -> {name}"] = measure(
+                    lambda: adb_screen.Frame(1, source, 0, 0).encode(**variant),
+                    options.iterations)
+    return results
+
+
+def bench_encode_pool(options, port):
+    """Frames encoded per second by the encode pool as its worker count grows
+
+    Every case encodes --iterations fresh PNG frames to JPEG from as many
+    request threads as there are workers (at least two), as concurrent
+    viewers would. "inline" encodes in those threads under the GIL.
+    cpu_percent is this process only, the workers come on top.
+    """
+    import adb_screen
+
+    client = host_client(port)
+    with settings(adb_screen, adb_client=client, ADB_BACKEND="socket",
+                  CAPTURE_MODE="exec-out", CAPTURE_FORMAT="png"):
+        source = succeeded(adb_screen.capture_screenshot(adb_screen.Device()))[1]
+    client.close()
+
+    cores = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, cores} & set(range(1, max(cores, 2) + 1)))
+    cases = [("inline", max(counts + [2]))] + [("process", workers) for workers in counts]
+    results = {}
+    baseline = None
+    for mode, workers in cases:
+        pool = adb_screen.EncodePool(mode, workers)
+        with settings(adb_screen, encode_pool=pool):
+            adb_screen.Frame(0, source, 0, 0).encode("jpeg")  # start the workers
+            frames = [adb_screen.Frame(seq, source, 0, 0) for seq in range(options.iterations)]
+            start, cpu_start = time.time(), time.process_time()
+            with ThreadPoolExecutor(max(workers, 2)) as threads:
+                list(threads.map(lambda frame: frame.encode("jpeg"), frames))
+            elapsed, cpu = time.time() - start, time.process_time() - cpu_start
+        pool.close()
+
+        per_sec = len(frames) / elapsed
+        baseline = baseline or per_sec
+        name = f"process, {workers} workers" if mode == "process" else f"inline, {workers} threads"
+        results[name] = {
+            "frames_per_sec": round(per_sec, 1),
+            "speedup": round(per_sec / baseline, 2),
+            "cpu_percent": round(cpu / elapsed * 100, 1),
+            "host_cores": cores,
+        }
+    return results
+
+
+def bench_input(options, port):
+    """send_tap() through the input queue, one at a time and in concurrent bursts
+
+    In a burst all taps are queued at once and coalesced into few shell
+    commands; per_sec counts taps, latencies are per burst.
+    """
+    import adb_screen
+
+    client = host_client(port)
+    results = {}
+    with settings(adb_screen, adb_client=client, ADB_BACKEND="socket"):
+        device = adb_screen.Device()
+        results["send_tap"] = measure(lambda: succeeded(adb_screen.send_tap(device, 10, 10)),
+                                      options.iterations)
+        results["send_keyevent"] = measure(
+            lambda: succeeded(adb_screen.send_keyevent(device, 3)), options.iterations)
+
+        with ThreadPoolExecutor(options.burst) as pool:
+            def burst():
+                list(pool.map(lambda _: adb_screen.send_tap(device, 10, 10), range(options.burst)))
+            stats = measure(burst, options.iterations)
+        stats["per_sec"] = round(stats["per_sec"] * options.burst, 1)
+        results[f"send_tap burst of {options.burst}"] = stats
+        device.input.shell.close()
+    client.close()
+    return results
+
+
+def bench_routes(options, port):
+    """HTTP round trips through the Flask app for the main routes"""
+    def get(path):
+        return lambda: urlopen(base + path).read()
+
+    def post(path, payload):
+        return lambda: urlopen(Request(base + path, data=json.dumps(payload).encode(),
+                                       headers={"Content-Type": "application/json"})).read()
+
+    with serve_app(port) as base:
+        urlopen(base + "/screenshot").read()  # start capturing
+        cases = {
+            "GET /screenshot": get("/screenshot"),
+            "GET /screen": get("/screen"),
+            "GET /screen?encoding=jpeg": get("/screen?encoding=jpeg"),
+            "GET /screen?encoding=webp&max=720": get("/screen?encoding=webp&max=720"),
+            "GET /stats": get("/stats"),
+            "POST /tap": post("/tap", {"x": 10, "y": 10}),
+        }
+        return {name: measure(case, options.iterations) for name, case in cases.items()}
+
+
+def bench_fanout(options, port):
+    """Device captures vs. delivered frames as the number of viewers grows
+
+    Every viewer runs the web UI's polling loop (/screenshot?after= then
+    /screen) against a real HTTP server. With one capture engine per device
+    the capture rate must stay flat while deliveries grow with viewers.
+    Give the fake device a --latency: with instant captures a few
+    milliseconds of jitter look like saturation to the rate controller,
+    which then backs off.
+    """
+    import adb_screen
+
+    def view(stop, delivered):
+        seq = 0
+        while not stop.is_set():
+            info = json.load(urlopen(f"{base}/screenshot?after={seq}"))
+            if info.get("success") and info["seq"] != seq:
+                seq = info["seq"]
+                urlopen(f"{base}/screen?seq={seq}").read()
+                delivered.append(seq)
+
+    results = {}
+    with serve_app(port) as base:
+        engine = adb_screen.device_registry.get().engine
+        for viewers in options.viewers:
+            stop = threading.Event()
+            delivered = []
+            threads = [threading.Thread(target=view, args=(stop, delivered), daemon=True)
+                       for _ in range(viewers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(1)  # let the viewers and the rate controller settle
+
+            captured, count = engine.rate.total, len(delivered)
+            start, cpu_start = time.time(), time.process_time()
+            time.sleep(options.duration)
+            elapsed, cpu = time.time() - start, time.process_time() - cpu_start
+            captured, count = engine.rate.total - captured, len(delivered) - count
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            results[f"{viewers} viewers"] = {
+                "captures_per_sec": round(captured / elapsed, 1),
+                "delivered_per_sec": round(count / elapsed, 1),
+                "per_viewer_fps": round(count / elapsed / viewers, 1),
+                "cpu_percent": round(cpu / elapsed * 100, 1),
+                "rss_mb": rss_mb(),
+            }
+    return results
+
+
+def bench_pipeline(options, port):
+    """Sustained capture rate of one device per capture pipeline depth
+
+    Pipelining pays off when screencap and the transfer take comparable
+    time, e.g. --latency 0.15 --transfer 0.15 on the fake device. The auto
+    depth tries one more capture in flight every PIPELINE_TUNE_INTERVAL
+    seconds, so that case captures long enough to reach the deepest
+    pipeline before it is measured.
+    """
+    import adb_screen
+
+    client = host_client(port)
+    results = {}
+    for depth in list(range(1, adb_screen.CAPTURE_PIPELINE_MAX + 1)) + [0]:
+        for mode in ("exec-out", "pull"):
+            with settings(adb_screen, adb_client=client, ADB_BACKEND="socket", CAPTURE_MODE=mode,
+                          CAPTURE_PIPELINE_DEPTH=depth):
+                device = adb_screen.Device()
+                engine = device.engine
+                # Let the pipeline fill and the rate controller (and the depth tuner) settle
+                settle = 1 if depth else adb_screen.PIPELINE_TUNE_INTERVAL * adb_screen.CAPTURE_PIPELINE_MAX
+                deadline = time.time() + settle
+                while time.time() < deadline:
+                    engine.touch()
+                    time.sleep(0.1)
+
+                captured, stale = engine.rate.total, engine.pipeline.stale
+                start, cpu_start = time.time(), time.process_time()
+                deadline = start + options.duration
+                while time.time() < deadline:
+                    engine.touch()
+                    time.sleep(0.1)
+                elapsed, cpu = time.time() - start, time.process_time() - cpu_start
+                # Stop capturing: the next step finds the engine idle
+                engine.last_request = 0
+
+                results[f"depth {depth or 'auto'} {mode}"] = {
+                    "captures_per_sec": round((engine.rate.total - captured) / elapsed, 1),
+                    "stale_per_sec": round((engine.pipeline.stale - stale) / elapsed, 1),
+                    "final_depth": engine.pipeline.depth,
+                    "latency_ms": engine.controller.status()["capture_latency_ms"],
+                    "cpu_percent": round(cpu / elapsed * 100, 1),
+                }
+                time.sleep(options.latency + options.transfer + 0.2)  # let captures in flight end
+    client.close()
+    return results
+
+
+def print_results(results):
+    for benchmark, cases in results.items():
+        if len(results) > 1:
+            print(f"\n{benchmark}")
+        width = max(len(name) for name in cases)
+        columns = list(next(iter(cases.values())))
+        widths = [max(len(column), 8) for column in columns]
+        print(f"{'case':<{width}}  " + "  ".join(
+            f"{column:>{column_width}}" for column, column_width in zip(columns, widths)))
+        for name, stats in cases.items():
+            print(f"{name:<{width}}  " + "  ".join(
+                f"{'-' if stats[column] is None else stats[column]:>{column_width}}"
+                for column, column_width in zip(columns, widths)))
+
+
+def report(options, results):
+    """Everything needed to compare a run with later ones, as a JSON-able dict"""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "adb": "real" if options.real else "fake",
+        "settings": {key: value for key, value in vars(options).items() if key != "json"},
+        "platform": {
+            "python": platform.python_version(),
+            "system": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+BENCHMARKS = {
+    "transport": bench_transport,
+    "capture": bench_capture,
+    "encode": bench_encode,
+    "encode-pool": bench_encode_pool,
+    "input": bench_input,
+    "routes": bench_routes,
+    "pipeline": bench_pipeline,
+    "fanout": bench_fanout,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="py-adb-mirror benchmarks")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS) + ["all"])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--real", action="store_true",
+                        help="use the real adb server and device instead of fake_adb")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds each fake screencap takes")
+    parser.add_argument("--transfer", type=float, default=0.0,
+                        help="seconds each fake screenshot takes over the USB link")
+    parser.add_argument("--width", type=int, default=fake_adb.SCREEN_WIDTH,
+                        help="fake screen width in pixels")
+    parser.add_argument("--height", type=int, default=fake_adb.SCREEN_HEIGHT,
+                        help="fake screen height in pixels")
+    parser.add_argument("--burst", type=int, default=8,
+                        help="concurrent taps per burst in the input benchmark")
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 4, 16],
+                        help="viewer counts for the fanout benchmark")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="seconds each fanout and pipeline round is measured")
+    parser.add_argument("--json", metavar="PATH",
+                        help="also write the results as JSON to PATH ('-' for stdout only)")
+    options = parser.parse_args()
+
+    names = list(BENCHMARKS) if options.benchmark == "all" else [options.benchmark]
+    results = {}
+    if options.real:
+        for name in names:
+            with fresh_state():
+                results[name] = BENCHMARKS[name](options, None)
+    else:
+        with fake_environment(latency=options.latency, width=options.width,
+                              height=options.height, transfer=options.transfer) as port:
+            for name in names:
+                with fresh_state():
+                    results[name] = BENCHMARKS[name](options, port)
+
+    if options.json == "-":
+        print(json.dumps(report(options, results), indent=2))
+        return
+    print_results(results)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report(options, results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+"""
+Fake adb for exercising py-adb-mirror without a phone.
+
+Server mode speaks the adb host protocol, so adb_client.AdbClient (and the
+mirror with ANDROID_ADB_SERVER_PORT set) can talk to it like to a real adb
+server:
+
+    python fake_adb.py server --port 5038 --devices 2
+
+Any other arguments make it behave like the adb binary for the commands the
+mirror runs. Put a script called "adb" that runs `python fake_adb.py "$@"`
+first in PATH to use it in place of the real one:
+
+    python fake_adb.py exec-out screencap -p > frame.png
+
+Executable mode is configured through FAKE_ADB_* environment variables (see
+below). Frames are a synthetic test pattern rendered once and cached in the
+storage directory, so neither mode spends time in Pillow per frame.
+
+`screenrecord --output-format=h264 -` plays a recorded Annex B stream when
+one is given (--h264 or FAKE_ADB_H264), for example one captured from a
+phone with
+
+    adb exec-out screenrecord --output-format=h264 --time-limit 10 - > sample.h264
+
+and otherwise synthetic NAL units that are framed like the real thing but
+do not decode to a picture.
+
+A device has one screenshot encoder and one USB link: screencaps take
+--latency seconds each, one after another, and moving a screenshot to the
+host (exec-out output or a pull) takes --transfer seconds on the link, so
+overlapping captures behave like on a phone in server mode.
+"""
+
+import argparse
+import os
+import re
+import shlex
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+STORAGE_DIR = os.environ.get("FAKE_ADB_DIR", os.path.join(tempfile.gettempdir(), "fake_adb"))
+SCREEN_WIDTH = int(os.environ.get("FAKE_ADB_WIDTH", 720))
+SCREEN_HEIGHT = int(os.environ.get("FAKE_ADB_HEIGHT", 1280))
+SCREEN_DENSITY = 320
+SCREENCAP_LATENCY = float(os.environ.get("FAKE_ADB_LATENCY", 0))  # seconds per screencap
+TRANSFER_TIME = float(os.environ.get("FAKE_ADB_TRANSFER", 0))  # seconds per screenshot on the link
+DEVICE_COUNT = int(os.environ.get("FAKE_ADB_DEVICES", 1))
+H264_SAMPLE = os.environ.get("FAKE_ADB_H264")  # recorded Annex B stream for screenrecord
+RECORD_LIMIT = float(os.environ.get("FAKE_ADB_RECORD_LIMIT", 180))  # seconds screenrecord runs
+PTY_SHELL = os.environ.get("FAKE_ADB_PTY") == "1"  # interactive shells like old devices, see --pty
+FRAME_COUNT = 8          # distinct frames cycled through
+FRAME_RATE = 10          # how often the picture changes per second
+SYNC_CHUNK = 64 * 1024
+START_CODE = b"\x00\x00\x00\x01"
+# Synthetic stream: baseline profile parameter sets, keyframe every FRAME_COUNT pictures
+SYNTHETIC_SPS = bytes.fromhex("6742c01fda0280bf")
+SYNTHETIC_PPS = bytes.fromhex("68ce3c80")
+
+
+def device_serial(index):
+    return f"fake-{index + 1:04d}"
+
+
+class FakeDevice:
+    """The device side: a screen, a tiny file system and a few shell commands"""
+
+    def __init__(self, serial=None, width=SCREEN_WIDTH, height=SCREEN_HEIGHT,
+                 latency=SCREENCAP_LATENCY, storage=STORAGE_DIR, pty=PTY_SHELL, usb="1-1",
+                 h264=H264_SAMPLE, record_limit=RECORD_LIMIT, transfer=TRANSFER_TIME):
+        self.serial = serial or device_serial(0)
+        self.width = width
+        self.height = height
+        self.latency = latency
+        self.transfer_time = transfer
+        self.encoder = threading.Lock()
+        self.link = threading.Lock()
+        self.h264 = h264
+        self.record_limit = record_limit
+        self.storage = storage
+        # Old devices run the interactive shell on a pty: input is echoed and
+        # output uses CRLF line endings
+        self.pty = pty
+        self.usb = usb
+        self.rotation = 0
+        self.commands = 0
+        os.makedirs(storage, exist_ok=True)
+
+    def _frame_path(self, index, raw):
+        extension = "raw" if raw else "png"
+        return os.path.join(self.storage, f"frame-{self.width}x{self.height}-{index}.{extension}")
+
+    def _render(self, index):
+        from PIL import Image, ImageDraw
+
+        image = Image.new("RGBA", (self.width, self.height), (32, 32, 48, 255))
+        draw = ImageDraw.Draw(image)
+        bar = self.height // FRAME_COUNT
+        draw.rectangle((0, index * bar, self.width, (index + 1) * bar), fill=(102, 126, 234, 255))
+        draw.text((10, 10), f"{self.serial} frame {index}", fill=(255, 255, 255, 255))
+
+        image.save(self._frame_path(index, False), format="PNG")
+        with open(self._frame_path(index, True), "wb") as f:
+            f.write(struct.pack("<III", self.width, self.height, 1) + image.tobytes())
+
+    def frame(self, raw=False):
+        """Return the current screen as screencap output (PNG or raw)"""
+        index = int(time.time() * FRAME_RATE) % FRAME_COUNT
+        path = self._frame_path(index, raw)
+        if not os.path.exists(path):
+            self._render(index)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _h264_units(self):
+        """NAL units (without start codes) of the stream screenrecord plays"""
+        if self.h264:
+            with open(self.h264, "rb") as f:
+                units = [unit.rstrip(b"\x00") for unit in re.split(b"\x00\x00\x01", f.read())[1:]]
+            return [unit for unit in units if unit]
+
+        units = [SYNTHETIC_SPS, SYNTHETIC_PPS]
+        for index in range(FRAME_COUNT):
+            # Slice header bits: first_mb_in_slice 0, then filler without start codes
+            if index == 0:
+                units.append(b"\x65\x88\x84" + b"\xaa" * (16 * 1024))
+            else:
+                units.append(b"\x41\x9a" + bytes([index]) + b"\xaa" * 1024)
+        return units
+
+    def _h264_pictures(self):
+        """Split the stream into (parameter sets, pictures) as Annex B bytes"""
+        header, pictures, picture = [], [], []
+        for unit in self._h264_units():
+            kind = unit[0] & 0x1f
+            if kind in (7, 8) and not pictures and not picture:
+                header.append(unit)
+                continue
+            new_picture = kind in (1, 5) and len(unit) > 1 and unit[1] & 0x80
+            if new_picture and any(part[0] & 0x1f in (1, 5) for part in picture):
+                pictures.append(picture)
+                picture = []
+            picture.append(unit)
+        if picture:
+            pictures.append(picture)
+        join = lambda units: b"".join(START_CODE + unit for unit in units)
+        return join(header), [join(picture) for picture in pictures]
+
+    def screenrecord(self, args, write):
+        """Stream H.264 like `screenrecord --output-format=h264 -` until the time limit
+
+        Each picture is one write, FRAME_RATE pictures per second; the
+        recorded stream is looped from its first picture.
+        """
+        limit = self.record_limit
+        if "--time-limit" in args:
+            limit = min(limit, float(args[args.index("--time-limit") + 1]))
+        header, pictures = self._h264_pictures()
+        deadline = time.time() + limit
+        write(header)
+        index = 0
+        while time.time() < deadline:
+            write(pictures[index % len(pictures)])
+            index += 1
+            time.sleep(1 / FRAME_RATE)
+
+    def transfer(self):
+        """Occupy the USB link for one screenshot"""
+        if self.transfer_time:
+            with self.link:
+                time.sleep(self.transfer_time)
+
+    def file_path(self, device_path):
+        safe = device_path.strip("/").replace("/", "_")
+        return os.path.join(self.storage, f"{self.serial}-fs-{safe}")
+
+    def _run_args(self, args):
+        name = args[0]
+        if name == "screencap":
+            with self.encoder:
+                time.sleep(self.latency)
+            paths = [arg for arg in args[1:] if not arg.startswith("-")]
+            if paths:
+                raw = not paths[0].endswith(".png") and "-p" not in args
+                with open(self.file_path(paths[0]), "wb") as f:
+                    f.write(self.frame(raw))
+                return b"", 0
+            self.transfer()
+            return self.frame("-p" not in args), 0
+        if name == "rm":
+            for path in args[1:]:
+                if not path.startswith("-") and os.path.exists(self.file_path(path)):
+                    os.remove(self.file_path(path))
+            return b"", 0
+        if name == "getevent" and "-p" in args:
+            return self._getevent(), 0
+        if name == "wm" and args[1:2] == ["size"]:
+            return f"Physical size: {self.width}x{self.height}\n".encode(), 0
+        if name == "wm" and args[1:2] == ["density"]:
+            return f"Physical density: {SCREEN_DENSITY}\n".encode(), 0
+        if name == "dumpsys" and args[1:2] == ["input"]:
+            return f"INPUT MANAGER (dumpsys input)\n    SurfaceOrientation: {self.rotation}\n".encode(), 0
+        if name == "exit":
+            return b"", int(args[1]) if len(args) > 1 else 0
+        if name in ("input", "sendevent", "true", "test"):
+            return b"", 0
+        if name == "false":
+            return b"", 1
+        if name == "echo":
+            return (" ".join(args[1:]) + "\n").encode(), 0
+        if name == "sleep":
+            time.sleep(float(args[1]))
+            return b"", 0
+        return f"{name}: not found\n".encode(), 127
+
+    def _getevent(self):
+        """getevent -p output for a protocol B touchscreen matching the screen"""
+        return (
+            "add device 1: /dev/input/event1\n"
+            '  name:     "fake-touchscreen"\n'
+            "  events:\n"
+            "    KEY (0001): 014a\n"
+            "    ABS (0003): 002f  : value 0, min 0, max 9, fuzz 0, flat 0, resolution 0\n"
+            f"                0035  : value 0, min 0, max {self.width - 1}, fuzz 0, flat 0, resolution 0\n"
+            f"                0036  : value 0, min 0, max {self.height - 1}, fuzz 0, flat 0, resolution 0\n"
+            "                0039  : value 0, min 0, max 65535, fuzz 0, flat 0, resolution 0\n"
+        ).encode()
+
+    def run(self, line, status=0):
+        """Run a shell line and return (output, status)
+
+        Commands can be separated by ';' or '&&'; "$?" expands to the
+        previous exit status, status before the first command.
+        """
+        self.commands += 1
+        lexer = shlex.shlex(line, posix=True, punctuation_chars=";&")
+        lexer.whitespace_split = True
+        commands = [(";", [])]
+        for token in lexer:
+            if token in (";", "&&"):
+                commands.append((token, []))
+            else:
+                commands[-1][1].append(token)
+
+        output = []
+        for separator, args in commands:
+            if not args or (separator == "&&" and status != 0):
+                continue
+            args = [arg.replace("$?", str(status)) for arg in args]
+            out, status = self._run_args(args)
+            output.append(out)
+        return b"".join(output), status
+
+    def interactive(self, read_line, write, eof=True):
+        """Serve an interactive shell until an exit line or read_line returns b''
+
+        Returns the status of the last command, like sh reading from stdin.
+        With eof False the end of input is not passed on, like old adbd does,
+        and the shell only ends with exit.
+        """
+        status = 0
+        for line in iter(read_line, b""):
+            text = line.decode(errors="replace").rstrip("\r\n")
+            if self.pty:
+                write(text.encode() + b"\r\n")
+            output, status = self.run(text, status)
+            if text.split()[:1] == ["exit"]:
+                return status
+            if self.pty:
+                output = output.replace(b"\n", b"\r\n") + b"shell@fake:/ $ "
+            write(output)
+        if not eof:
+            threading.Event().wait()
+        return status
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    """One client connection to the fake adb server"""
+
+    def _recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _okay(self):
+        self.request.sendall(b"OKAY")
+
+    def _fail(self, message):
+        data = message.encode()
+        self.request.sendall(b"FAIL" + b"%04x" % len(data) + data)
+
+    def _send_prefixed(self, data):
+        self.request.sendall(b"%04x" % len(data) + data)
+
+    def handle(self):
+        device = None
+        while True:
+            length = self._recv_exact(4)
+            if length is None:
+                return
+            service = self._recv_exact(int(length, 16)).decode()
+
+            if service == "host:version":
+                self._okay()
+                self._send_prefixed(b"0029")
+                return
+            if service in ("host:devices", "host:devices-l"):
+                self._okay()
+                lines = []
+                for item in self.server.devices.values():
+                    extra = f" usb:{item.usb} product:fake model:Fake_Device" if service.endswith("-l") else ""
+                    lines.append(f"{item.serial}\tdevice{extra}\n")
+                self._send_prefixed("".join(lines).encode())
+                return
+            if service.startswith("host:transport"):
+                serial = service.split(":", 2)[2] if service.startswith("host:transport:") else None
+                if serial is None and len(self.server.devices) == 1:
+                    device = next(iter(self.server.devices.values()))
+                else:
+                    device = self.server.devices.get(serial)
+                if device is None:
+                    self._fail(f"device '{serial}' not found" if serial else "more than one device")
+                    return
+                self._okay()
+                continue
+
+            if device is None:
+                self._fail(f"unknown host service: {service}")
+                return
+
+            if service.startswith("exec:screenrecord"):
+                self._okay()
+                try:
+                    device.screenrecord(service[5:].split(), self.request.sendall)
+                except OSError:
+                    pass  # the client stopped reading
+            elif service.startswith("exec:"):
+                self._okay()
+                output, _ = device.run(service[5:])
+                self.request.sendall(output)
+            elif service == "shell:":
+                self._okay()
+                reader = self.request.makefile("rb")
+                device.interactive(reader.readline, self.request.sendall)
+            elif service.startswith("shell:"):
+                self._okay()
+                output, _ = device.run(service[6:])
+                self.request.sendall(output)
+            elif service == "sync:":
+                self._okay()
+                self._sync(device)
+            else:
+                self._fail(f"unknown service: {service}")
+            return
+
+    def _sync(self, device):
+        while True:
+            header = self._recv_exact(8)
+            if header is None:
+                return
+            kind, length = header[:4], struct.unpack("<I", header[4:])[0]
+            path = self._recv_exact(length).decode() if length else ""
+
+            if kind == b"RECV":
+                local = device.file_path(path)
+                if not os.path.exists(local):
+                    message = f"remote object '{path}' does not exist".encode()
+                    self.request.sendall(b"FAIL" + struct.pack("<I", len(message)) + message)
+                    return
+                device.transfer()
+                with open(local, "rb") as f:
+                    while True:
+                        chunk = f.read(SYNC_CHUNK)
+                        if not chunk:
+                            break
+                        self.request.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+                self.request.sendall(b"DONE" + struct.pack("<I", 0))
+            elif kind == b"STAT":
+                local = device.file_path(path)
+                if os.path.exists(local):
+                    info = os.stat(local)
+                    self.request.sendall(b"STAT" + struct.pack("<III", 0o100644, info.st_size,
+                                                               int(info.st_mtime)))
+                else:
+                    self.request.sendall(b"STAT" + struct.pack("<III", 0, 0, 0))
+            else:
+                return
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """adb host protocol server backed by FakeDevice instances"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, devices):
+        self.devices = {device.serial: device for device in devices}
+        super().__init__(address, FakeAdbHandler)
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().server_bind()
+
+
+def make_devices(count=DEVICE_COUNT, **options):
+    return [FakeDevice(device_serial(i), usb=f"1-{i + 1}", **options) for i in range(count)]
+
+
+def run_cli(argv):
+    """Behave like the adb binary for the commands the mirror uses"""
+    args = list(argv)
+    serial = None
+    if args[:1] == ["-s"]:
+        serial, args = args[1], args[2:]
+
+    devices = {device.serial: device for device in make_devices()}
+    if args[:1] == ["devices"]:
+        print("List of devices attached")
+        for device in devices.values():
+            extra = f" usb:{device.usb} product:fake model:Fake_Device" if "-l" in args else ""
+            print(f"{device.serial}\tdevice{extra}")
+        return 0
+
+    device = devices.get(serial) if serial else next(iter(devices.values()))
+    if device is None:
+        sys.stderr.write(f"adb: device '{serial}' not found\n")
+        return 1
+
+    out = sys.stdout.buffer
+    if args[:2] == ["exec-out", "screenrecord"]:
+        def write(data):
+            out.write(data)
+            out.flush()
+        try:
+            device.screenrecord(args[1:], write)
+        except BrokenPipeError:
+            pass
+        return 0
+    if args[:1] == ["exec-out"] or (args[:1] == ["shell"] and len(args) > 1):
+        output, status = device.run(" ".join(shlex.quote(arg) if " " in arg else arg
+                                             for arg in args[1:]))
+        out.write(output)
+        return status
+    if args == ["shell"]:
+        def write(data):
+            out.write(data)
+            out.flush()
+        return device.interactive(sys.stdin.buffer.readline, write, eof=not device.pty)
+    if args[:1] == ["pull"] and len(args) == 3:
+        source = device.file_path(args[1])
+        if not os.path.exists(source):
+            sys.stderr.write(f"adb: error: remote object '{args[1]}' does not exist\n")
+            return 1
+        shutil.copyfile(source, args[2])
+        print(f"{args[1]}: 1 file pulled")
+        return 0
+    if args[:1] in (["start-server"], ["version"]):
+        return 0
+
+    sys.stderr.write(f"fake adb: unsupported command: {' '.join(argv)}\n")
+    return 1
+
+
+def main():
+    if sys.argv[1:2] != ["server"]:
+        sys.exit(run_cli(sys.argv[1:]))
+
+    parser = argparse.ArgumentParser(description="Fake adb server speaking the host protocol")
+    parser.add_argument("server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5038)
+    parser.add_argument("--devices", type=int, default=DEVICE_COUNT)
+    parser.add_argument("--width", type=int, default=SCREEN_WIDTH)
+    parser.add_argument("--height", type=int, default=SCREEN_HEIGHT)
+    parser.add_argument("--latency", type=float, default=SCREENCAP_LATENCY,
+                        help="seconds each screencap takes")
+    parser.add_argument("--transfer", type=float, default=TRANSFER_TIME,
+                        help="seconds each screenshot takes over the USB link")
+    parser.add_argument("--pty", action="store_true",
+                        help="echo input and use CRLF in interactive shells like old devices")
+    parser.add_argument("--h264", default=H264_SAMPLE,
+                        help="recorded Annex B H.264 stream played by screenrecord")
+    parser.add_argument("--record-limit", type=float, default=RECORD_LIMIT,
+                        help="seconds screenrecord runs before it exits")
+    options = parser.parse_args()
+
+    devices = make_devices(options.devices, width=options.width, height=options.height,
+                           latency=options.latency, pty=options.pty, h264=options.h264,
+                           record_limit=options.record_limit, transfer=options.transfer)
+    server = FakeAdbServer((options.host, options.port), devices)
+    print(f"Fake adb server with {len(devices)} device(s) on {options.host}:{options.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Shared fixtures: a fake adb server and fresh mirror state per test"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adb_screen  # noqa: E402
+import benchmark  # noqa: E402
+from adb_client import AdbClient  # noqa: E402
+
+
+@pytest.fixture
+def fake_environment(monkeypatch):
+    """A fake adb server (port yielded) with the adb shim first in PATH"""
+    with benchmark.fake_environment(1, width=200, height=400) as port:
+        monkeypatch.setattr(adb_screen, "adb_client", AdbClient(port=port))
+        yield port
+
+
+@pytest.fixture
+def device(fake_environment):
+    """The fake phone's Device, in a registry and frame store of its own
+
+    Its capture engine and video stream are stopped before the fake adb
+    server goes away.
+    """
+    with benchmark.fresh_state():
+        yield adb_screen.device_registry.get(None)
@@ -0,0 +1,133 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import fake_adb
+from adb_client import AdbClient, AdbError
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Two fake devices behind an adb server on a free port"""
+    devices = [fake_adb.FakeDevice(fake_adb.device_serial(i), usb=f"1-{i + 1}", storage=str(tmp_path))
+               for i in range(2)]
+    server = fake_adb.FakeAdbServer(("127.0.0.1", 0), devices)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    client = AdbClient(fake_adb.device_serial(0), port=server.server_address[1], pool_size=1)
+    yield client
+    client.close()
+
+
+def wait_for_pool(client, size=1, timeout=5):
+    deadline = time.time() + timeout
+    while len(client.pool) < size and time.time() < deadline:
+        time.sleep(0.01)
+    return len(client.pool) >= size
+
+
+def test_devices(server):
+    client = AdbClient(port=server.server_address[1])
+
+    assert client.version() == 0x29
+    assert client.devices() == [
+        {"serial": "fake-0001", "state": "device", "usb": "1-1", "product": "fake", "model": "Fake_Device"},
+        {"serial": "fake-0002", "state": "device", "usb": "1-2", "product": "fake", "model": "Fake_Device"},
+    ]
+
+
+def test_shell_and_exec_out(client, server):
+    assert client.shell("echo hello; echo $?") == "hello\n0\n"
+    assert client.exec_out("echo raw") == b"raw\n"
+    assert server.devices["fake-0001"].commands == 2
+    assert server.devices["fake-0002"].commands == 0
+
+
+def test_pooled_connections_are_reused(client, monkeypatch):
+    transports = []
+    transport = client._transport
+    monkeypatch.setattr(client, "_transport", lambda: transports.append(1) or transport())
+
+    client.shell("true")
+    assert wait_for_pool(client)
+    opened = len(transports)
+    for _ in range(3):
+        # Each service takes the pooled socket and a refill replaces it
+        assert client.shell("echo again") == "again\n"
+        assert wait_for_pool(client)
+
+    assert opened == 2
+    assert len(transports) == opened + 3
+    assert len(client.pool) == 1
+
+
+def test_stale_pooled_connection_is_replaced(client):
+    client.shell("true")
+    assert wait_for_pool(client)
+    client.pool[0].sock.shutdown(socket.SHUT_RDWR)
+
+    assert client.shell("echo fresh") == "fresh\n"
+
+
+def test_pull_reuses_the_sync_connection(client, server):
+    device = server.devices["fake-0001"]
+    with open(device.file_path("/sdcard/a.bin"), "wb") as f:
+        f.write(os.urandom(200 * 1024))
+    with open(device.file_path("/sdcard/a.bin"), "rb") as f:
+        expected = f.read()
+
+    assert client.pull("/sdcard/a.bin") == expected
+    sync_conn = client.sync_conn
+    assert client.pull("/sdcard/a.bin") == expected
+    assert client.sync_conn is sync_conn
+
+
+def test_pull_of_a_missing_file_fails(client, server):
+    device = server.devices["fake-0001"]
+    with open(device.file_path("/sdcard/b.bin"), "wb") as f:
+        f.write(b"data")
+
+    with pytest.raises(AdbError, match="does not exist"):
+        client.pull("/sdcard/missing.bin")
+    # The server ended the sync session, the next pull opens a new one
+    assert client.sync_conn is None
+    assert client.pull("/sdcard/b.bin") == b"data"
+
+
+def test_unknown_device_fails(server):
+    client = AdbClient("nope", port=server.server_address[1])
+
+    with pytest.raises(AdbError, match="device 'nope' not found"):
+        client.shell("true")
+
+
+def test_any_device_fails_with_several_devices(server):
+    client = AdbClient(port=server.server_address[1])
+
+    with pytest.raises(AdbError, match="more than one device"):
+        client.shell("true")
+
+
+def test_unknown_service_fails(client):
+    with pytest.raises(AdbError, match="unknown service"):
+        client.open_service("frobnicate:")
+
+
+def test_server_down_raises_os_error(server):
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+    with pytest.raises(OSError):
+        AdbClient(port=port).shell("true")
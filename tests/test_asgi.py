@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import adb_screen
+
+# Importing adb_asgi hands capturing to its event loop pool; the other tests
+# use the thread pool, so each test here installs a pool of its own
+thread_pool = adb_screen.capture_pool
+import adb_asgi  # noqa: E402
+adb_screen.capture_pool = thread_pool
+
+
+def request(method, path, body=b""):
+    scope = {"method": method, "path": path, "query_string": b"",
+             "headers": [(b"content-type", b"application/json")]}
+    return adb_asgi.Request(scope, body)
+
+
+def run(device, monkeypatch, coroutine):
+    pool = adb_asgi.AsyncCapturePool()
+    monkeypatch.setattr(adb_screen, "capture_pool", pool)
+    monkeypatch.setattr(adb_asgi, "capture_pool", pool)
+
+    async def main():
+        pool.bind(asyncio.get_running_loop())
+        try:
+            return await coroutine(pool)
+        finally:
+            await pool.close()
+
+    return asyncio.run(main())
+
+
+def test_async_pool_recovers_from_a_capture_that_raises(device, monkeypatch):
+    monkeypatch.setattr(adb_screen, "CAPTURE_ERROR_BACKOFF", 0.05)
+    capture = adb_asgi.capture_screenshot
+    calls = []
+
+    async def failing_capture(device, timings=None, slot=0):
+        calls.append(slot)
+        if len(calls) <= 2:
+            raise ValueError("truncated image")
+        return await capture(device, timings, slot)
+
+    monkeypatch.setattr(adb_asgi, "capture_screenshot", failing_capture)
+
+    async def wait_for_frame(pool):
+        device.engine.touch()
+        return await pool.wait_for_frame(device.engine, timeout=10)
+
+    assert run(device, monkeypatch, wait_for_frame) is not None
+    assert len(calls) > 2
+
+
+def test_input_status_matches_flask(device, monkeypatch):
+    flask = adb_screen.app.test_client()
+
+    async def post(pool, body):
+        return await adb_asgi.dispatch(request("POST", "/tap", body))
+
+    for body in (b"[1, 2]", b'"tap"', b'{"x": 1}'):
+        response = run(device, monkeypatch, lambda pool: post(pool, body))
+        expected = flask.post("/tap", data=body, content_type="application/json")
+        assert response.status == expected.status_code == 200
+        assert json.loads(response.body) == expected.json
+
+    response = run(device, monkeypatch, lambda pool: post(pool, b"{not json"))
+    expected = flask.post("/tap", data=b"{not json", content_type="application/json")
+    assert response.status == expected.status_code == 400
+
+
+def test_capture_settings_are_read_at_call_time(device, monkeypatch):
+    exec_outs = []
+    monkeypatch.setattr(adb_asgi, "exec_out", lambda *args: exec_outs.append(args))
+    monkeypatch.setattr(adb_screen, "CAPTURE_MODE", "pull")
+    monkeypatch.setattr(adb_screen, "CAPTURE_FORMAT", "raw")
+
+    async def capture(pool):
+        return await adb_asgi.capture_screenshot(device)
+
+    success, frame = run(device, monkeypatch, capture)
+
+    assert success and not exec_outs
+    # A raw capture is decoded on the host into an image, not kept as PNG bytes
+    assert not isinstance(frame, bytes)
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import adb_screen
+
+
+def test_decode_capture_rejects_truncated_png():
+    assert adb_screen.decode_capture(adb_screen.PNG_SIGNATURE + b"\0" * 4, raw=False) is None
+
+
+def test_engine_recovers_from_a_capture_that_raises(device, monkeypatch):
+    monkeypatch.setattr(adb_screen, "CAPTURE_ERROR_BACKOFF", 0.05)
+    capture = adb_screen.capture_screenshot
+    calls = []
+
+    def failing_capture(device, timings=None, slot=0):
+        calls.append(slot)
+        if len(calls) <= 2:
+            # Gets past decode_capture() but not Frame()
+            raise ValueError("truncated image")
+        return capture(device, timings, slot)
+
+    monkeypatch.setattr(adb_screen, "capture_screenshot", failing_capture)
+    engine = device.engine
+    engine.touch()
+    frame = engine.wait_for_frame(timeout=10)
+
+    assert frame is not None
+    assert len(calls) > 2
+    assert engine.active
+
+
+def test_failing_captures_release_the_pipeline(device, monkeypatch):
+    monkeypatch.setattr(adb_screen, "CAPTURE_ERROR_BACKOFF", 0.01)
+    calls = []
+
+    def failing_capture(device, timings=None, slot=0):
+        calls.append(slot)
+        raise ValueError("truncated image")
+
+    monkeypatch.setattr(adb_screen, "capture_screenshot", failing_capture)
+    device.engine.touch()
+    # A leaked ticket per failure would fill the pipeline after a few captures
+    deadline = time.time() + 5
+    while len(calls) < 3 * adb_screen.CAPTURE_PIPELINE_MAX and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert len(calls) >= 3 * adb_screen.CAPTURE_PIPELINE_MAX
+    assert device.engine.last_error == "Capture failed: truncated image"
+
+
+def test_stream_clients_are_counted_across_threads(device):
+    def open_and_close():
+        for _ in range(2000):
+            device.count_stream(1)
+            device.count_stream(-1)
+
+    threads = [threading.Thread(target=open_and_close) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    device.count_stream(1)
+    for thread in threads:
+        thread.join()
+
+    assert device.stream_clients == 1
+
+
+def test_exec_out_falls_back_to_pull_after_repeated_invalid_images(device, monkeypatch):
+    exec_out = adb_screen.adb_exec_out
+    calls = []
+    mangled = [True]
+
+    def flaky_exec_out(device, command):
+        calls.append(command)
+        success, data, error = exec_out(device, command)
+        return success, data.replace(b"\n", b"\r\n") if mangled[0] else data, error
+
+    monkeypatch.setattr(adb_screen, "adb_exec_out", flaky_exec_out)
+    for _ in range(adb_screen.EXEC_OUT_MAX_FAILURES + 2):
+        # Invalid images are pulled again instead
+        assert adb_screen.capture_screenshot(device)[0]
+    assert len(calls) == adb_screen.EXEC_OUT_MAX_FAILURES
+
+    # Tried again later, and kept once it works
+    device.exec_out_failed -= adb_screen.EXEC_OUT_RETRY_AFTER
+    mangled[0] = False
+    assert adb_screen.capture_screenshot(device)[0]
+    assert adb_screen.capture_screenshot(device)[0]
+    assert len(calls) == adb_screen.EXEC_OUT_MAX_FAILURES + 2
+    assert device.exec_out_failures == 0
+
+
+def test_single_invalid_exec_out_image_does_not_disable_exec_out(device, monkeypatch):
+    device.exec_out_checked(False)
+    device.exec_out_checked(True)
+    for _ in range(adb_screen.EXEC_OUT_MAX_FAILURES - 1):
+        device.exec_out_checked(False)
+
+    assert device.exec_out_enabled()
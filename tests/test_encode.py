@@ -0,0 +1,114 @@
+import gc
+import io
+from multiprocessing import shared_memory
+
+import pytest
+from PIL import Image, ImageDraw
+
+import adb_screen
+
+
+CASES = [
+    ("png", 80, 0, None),
+    ("jpeg", 80, 0, None),
+    ("jpeg", 50, 120, None),
+    ("webp", 80, 0, None),
+    ("jpeg", 80, 0, (64, 64, 64, 128)),
+    ("png", 80, 120, (0, 128, 200, 64)),
+]
+
+
+def screen():
+    image = Image.new("RGBA", (200, 400), (32, 32, 48, 255))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 40, 180, 120), fill=(102, 126, 234, 255))
+    draw.ellipse((40, 200, 160, 360), fill=(240, 200, 40, 255))
+    return image
+
+
+def png_frame():
+    output = io.BytesIO()
+    screen().save(output, format="PNG")
+    return adb_screen.Frame(1, output.getvalue(), 0, 0)
+
+
+def raw_frame():
+    return adb_screen.Frame(1, screen(), 0, 0)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = adb_screen.EncodePool("process", workers=1)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("make_frame", [png_frame, raw_frame])
+def test_pool_output_matches_inline(pool, make_frame):
+    frame = make_frame()
+    pooled = pool.stats()["pooled"]
+
+    for encoding, quality, max_size, rect in CASES:
+        data = pool.render(frame, encoding, quality, max_size, rect)
+        assert data == adb_screen.render_image(frame.image(), encoding, quality, max_size, rect)
+
+    assert pool.stats()["pooled"] == pooled + len(CASES)
+    assert pool.stats()["error"] is None
+
+
+def test_frame_encode_goes_through_the_pool(pool, monkeypatch):
+    monkeypatch.setattr(adb_screen, "encode_pool", pool)
+    frame = raw_frame()
+    pooled = pool.stats()["pooled"]
+
+    data = frame.encode("jpeg", 70, 0)
+
+    assert pool.stats()["pooled"] == pooled + 1
+    assert data == adb_screen.render_image(frame.image(), "jpeg", 70, 0)
+
+
+def test_single_core_host_encodes_inline(monkeypatch):
+    monkeypatch.setattr(adb_screen.os, "cpu_count", lambda: 1)
+    pool = adb_screen.EncodePool("auto")
+    monkeypatch.setattr(adb_screen, "encode_pool", pool)
+    frame = png_frame()
+
+    assert pool.render(frame, "jpeg", 80, 0) is None
+    data = frame.encode("jpeg", 80, 0)
+
+    assert data == adb_screen.render_image(frame.image(), "jpeg", 80, 0)
+    assert pool.stats()["enabled"] is False
+    assert pool.stats()["workers"] == 0
+    assert pool.stats()["inline"] == 2
+    assert frame._shared is None  # nothing was copied to shared memory
+
+
+def test_render_error_keeps_the_pool_and_frees_shared_memory(pool):
+    frame = raw_frame()
+    errors = pool.stats()["errors"]
+
+    # A crop box with a negative width fails in the worker
+    assert pool.render(frame, "jpeg", 80, 0, (50, 50, -10, 10)) is None
+    name = frame._shared[1][0]
+
+    assert pool.stats()["errors"] == errors + 1
+    assert pool.enabled()
+    assert pool.render(frame, "jpeg", 80, 0) is not None
+
+    # The block is freed with the frame
+    del frame
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name)
+
+
+def test_missing_segment_in_the_worker_keeps_the_pool(pool, monkeypatch):
+    frame = raw_frame()
+    errors = pool.stats()["errors"]
+    # The worker cannot open the block and raises FileNotFoundError
+    monkeypatch.setattr(frame, "shared_source", lambda: ("adb_screen_gone", 1, "RGBA", (1, 1)))
+
+    assert pool.render(frame, "jpeg", 80, 0) is None
+
+    assert pool.stats()["errors"] == errors + 1
+    assert pool.enabled() and pool.stats()["error"] is None
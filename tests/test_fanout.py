@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+import benchmark
+import fake_adb
+
+
+MEASURE_SECONDS = 2
+# Captures per second with 8 viewers, relative to one viewer
+CAPTURE_RATE_TOLERANCE = 0.5
+
+
+def viewer_round(base, viewers, screencaps):
+    """Run viewers polling like the web UI, returns (screencaps, frames delivered) per second"""
+    stop = threading.Event()
+    delivered = []
+
+    def view():
+        seq = 0
+        while not stop.is_set():
+            info = json.load(urlopen(f"{base}/screenshot?after={seq}"))
+            if info.get("success") and info["seq"] != seq:
+                seq = info["seq"]
+                urlopen(f"{base}/screen?seq={seq}").read()
+                delivered.append(seq)
+
+    threads = [threading.Thread(target=view, daemon=True) for _ in range(viewers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(1)  # let the viewers and the rate controller settle
+
+    captured, count, start = len(screencaps), len(delivered), time.time()
+    time.sleep(MEASURE_SECONDS)
+    elapsed = time.time() - start
+    captured, count = len(screencaps) - captured, len(delivered) - count
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return captured / elapsed, count / elapsed
+
+
+def test_device_load_stays_flat_as_viewers_grow(monkeypatch):
+    screencaps = []
+    run_args = fake_adb.FakeDevice._run_args
+
+    def counting_run_args(self, args):
+        if args[0] == "screencap":
+            screencaps.append(time.time())
+        return run_args(self, args)
+
+    monkeypatch.setattr(fake_adb.FakeDevice, "_run_args", counting_run_args)
+    # A realistic screencap time, instant captures make the rate controller back off
+    with benchmark.fake_environment(1, latency=0.05, width=200, height=400) as port, \
+            benchmark.fresh_state(), benchmark.serve_app(port) as base:
+        one_captures, one_delivered = viewer_round(base, 1, screencaps)
+        many_captures, many_delivered = viewer_round(base, 8, screencaps)
+
+    assert one_captures > 1
+    assert abs(many_captures - one_captures) <= CAPTURE_RATE_TOLERANCE * one_captures
+    # The captured frames still reach every viewer
+    assert many_delivered > 3 * one_delivered
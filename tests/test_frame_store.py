@@ -0,0 +1,82 @@
+import io
+import os
+
+from PIL import Image
+
+import adb_screen
+
+
+def frame(seq):
+    """A frame holding a PNG of noise, about 3 KB that does not compress"""
+    image = Image.frombytes("RGB", (32, 32), os.urandom(32 * 32 * 3))
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return adb_screen.Frame(seq, output.getvalue(), seq, 0)
+
+
+def seqs(store, serial="a"):
+    return [seq for key, seq in store.frames if key == serial]
+
+
+def test_unpinned_frames_are_evicted_oldest_first_over_the_limit():
+    frames = [frame(seq) for seq in range(1, 9)]
+    size = max(frame.nbytes() for frame in frames)
+    store = adb_screen.FrameStore(buffer_size=100, limit=int(size * 3.5))
+
+    for item in frames:
+        store.add("a", item)
+
+    assert seqs(store) == [6, 7, 8]
+    assert store.stats()["evicted"] == 5
+    assert store.stats()["bytes"] <= store.limit
+
+
+def test_pinned_frame_survives_the_limit_until_released():
+    frames = [frame(seq) for seq in range(1, 9)]
+    size = max(frame.nbytes() for frame in frames)
+    store = adb_screen.FrameStore(buffer_size=100, limit=int(size * 1.5))
+    store.add("a", frames[0])
+    store.acquire("a", frames[0])
+
+    for item in frames[1:]:
+        store.add("a", item)
+
+    # The pinned frame stays addressable over the limit, the others make room
+    assert store.get("a", 1) is frames[0]
+    assert seqs(store) == [1, 8]
+    assert store.stats()["bytes"] > store.limit
+    assert store.stats()["pinned"] == 1
+
+    # Released, it is the oldest frame and goes first
+    store.release("a", frames[0])
+
+    assert store.get("a", 1) is None
+    assert seqs(store) == [8]
+    assert store.stats()["pinned"] == 0
+
+
+def test_eviction_spans_devices_and_keeps_each_newest_frame():
+    frames = [frame(seq) for seq in range(1, 7)]
+    size = max(frame.nbytes() for frame in frames)
+    store = adb_screen.FrameStore(buffer_size=100, limit=int(size * 2.5))
+
+    store.add("a", frames[0])
+    for item in frames[1:]:
+        store.add("b", item)
+
+    # The oldest frames go first whatever device they belong to, but a is
+    # left with its only (newest) frame
+    assert seqs(store, "a") == [1]
+    assert seqs(store, "b") == [6]
+    assert store.latest("a") is frames[0]
+
+
+def test_buffer_size_applies_per_device_without_counting_as_evicted():
+    store = adb_screen.FrameStore(buffer_size=2, limit=0)
+
+    for seq in range(1, 5):
+        store.add("a", frame(seq))
+        store.add("b", frame(seq))
+
+    assert seqs(store, "a") == seqs(store, "b") == [3, 4]
+    assert store.stats()["evicted"] == 0
@@ -0,0 +1,40 @@
+import adb_screen
+
+
+SEPARATOR = adb_screen.GEOMETRY_SEPARATOR + "\n"
+WM_SIZE = "Physical size: 1080x2400\nOverride size: 720x1600\n"
+WM_DENSITY = "Physical density: 420\nOverride density: 320\n"
+DUMPSYS_INPUT = (
+    "INPUT MANAGER (dumpsys input)\n"
+    "  Viewport INTERNAL: displayId=0, orientation=1, logicalFrame=[0, 0, 1600, 720]\n"
+    "    Device 3: touchscreen\n"
+    "      Raw touch size: 1080x2400\n"
+    "      density: 480\n"
+    "    SurfaceOrientation: 1\n"
+)
+
+
+def test_parse_geometry_takes_size_and_density_from_wm_only():
+    output = WM_SIZE + SEPARATOR + WM_DENSITY + SEPARATOR + DUMPSYS_INPUT
+
+    assert adb_screen.parse_geometry(output) == {"natural": (720, 1600), "density": 320, "rotation": 1}
+
+
+def test_parse_geometry_with_missing_values():
+    output = "Physical size: 1080x2400\r\n" + adb_screen.GEOMETRY_SEPARATOR + "\r\n" + SEPARATOR + DUMPSYS_INPUT
+
+    assert adb_screen.parse_geometry(output) == {"natural": (1080, 2400), "density": None, "rotation": 1}
+    assert adb_screen.parse_geometry("") == {"natural": None, "density": None, "rotation": None}
+
+
+def test_parse_geometry_ignores_the_echoed_command_line():
+    output = adb_screen.geometry_command() + "\n" + WM_SIZE + SEPARATOR + WM_DENSITY + SEPARATOR + DUMPSYS_INPUT
+
+    assert adb_screen.parse_geometry(output)["natural"] == (720, 1600)
+
+
+def test_first_frame_carries_the_display(device):
+    device.engine.touch()
+    frame = device.engine.wait_for_frame(timeout=10)
+
+    assert frame.display == {"rotation": 0, "density": 320, "natural_width": 200, "natural_height": 400}
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import adb_screen
+
+
+def submitted_lines(device, monkeypatch):
+    """Record the shell lines input submits, while still running them"""
+    lines = []
+    submit = device.input.submit
+
+    def recording_submit(kind, command):
+        lines.append((time.time(), kind, command))
+        return submit(kind, command)
+
+    monkeypatch.setattr(device.input, "submit", recording_submit)
+    return lines
+
+
+def test_swipe_path_is_paced_over_its_duration(device, monkeypatch):
+    assert device.injector.probe() is not None  # the fake touchscreen is writable
+    lines = submitted_lines(device, monkeypatch)
+    points = [(10, 10 + i * 5) for i in range(40)]
+
+    start = time.time()
+    assert device.injector.swipe_path(points, 500) == (True, "")
+
+    assert time.time() - start >= 0.45
+    assert len(lines) > 1
+    assert lines[-1][0] - lines[0][0] >= 0.4
+    assert "-1" not in lines[0][2] and "-1" in lines[-1][2]  # tracking id released at the end
+    moves = [command.count(f" {adb_screen.ABS_MT_POSITION_X} ") for _, _, command in lines]
+    assert sum(moves) == len(points)
+    assert max(moves) <= adb_screen.SWIPE_PATH_CHUNK
+
+
+def test_fast_swipe_path_is_split_into_short_lines(device, monkeypatch):
+    device.injector.probe()
+    lines = submitted_lines(device, monkeypatch)
+    points = [(i, i) for i in range(100)]
+
+    assert device.injector.swipe_path(points, 0) == (True, "")
+
+    assert len(lines) == -(-len(points) // adb_screen.SWIPE_PATH_CHUNK)
+    assert all(kind == "touch" for _, kind, _ in lines)
+
+
+def item(kind, command="true", age=0):
+    queued = time.time() - age
+    return {"kind": kind, "command": command, "queued": queued,
+            "deadline": queued + adb_screen.INPUT_WAIT_TIMEOUT}
+
+
+def test_scheduler_never_sheds_taps(device):
+    stale = adb_screen.INPUT_STALE_AFTER + 1
+    batch = [item("tap", age=stale), item("swipe", age=stale), item("tap", age=stale),
+             item("key", age=stale), item("tap"), item("move"), item("move"), item("swipe")]
+
+    keep, dropped = device.input._shed(batch)
+
+    assert dropped == [batch[1], batch[5]]
+    assert [entry["kind"] for entry in keep] == ["tap", "tap", "key", "tap", "move", "swipe"]
+
+
+def test_stale_swipe_is_kept_without_a_newer_swipe(device):
+    batch = [item("swipe", age=adb_screen.INPUT_STALE_AFTER + 1), item("tap")]
+
+    assert device.input._shed(batch) == (batch, [])
+
+
+def test_batch_reports_each_command_status(device):
+    batch = [item("tap", "true"), item("tap", "echo broken; false"), item("key", "true; echo fine")]
+
+    assert device.input._execute(batch) == [(True, ""), (False, "broken"), (True, "")]
+
+
+def test_batch_fails_commands_that_did_not_run(device, monkeypatch):
+    monkeypatch.setattr(device.input.shell, "run", lambda command, timeout: (False, "Command timed out"))
+
+    assert device.input._execute([item("tap"), item("tap")]) == [(False, "Command timed out")] * 2
+
+
+def test_slow_batch_has_one_outcome(device, monkeypatch):
+    monkeypatch.setattr(adb_screen, "INPUT_WAIT_TIMEOUT", 0.5)
+    scheduler = device.input
+    executed = []
+    execute = scheduler._execute
+    monkeypatch.setattr(scheduler, "_execute", lambda batch: executed.append(batch) or execute(batch))
+
+    start = time.time()
+    result = scheduler.submit("key", "sleep 3")
+
+    # The shell is stopped by the time the caller hears back, and the
+    # caller gets the batch's own result
+    assert result == (False, "Command timed out")
+    assert time.time() - start < 2
+    assert executed[0][0]["result"] == result
+    assert scheduler.submit("tap", "echo ok") == (True, "")
+
+
+def test_event_out_of_time_in_queue_is_not_run(device, monkeypatch):
+    scheduler = device.input
+    executed = []
+    monkeypatch.setattr(scheduler, "_execute",
+                        lambda batch: executed.append(batch) or [(True, "")] * len(batch))
+    late = item("tap", age=adb_screen.INPUT_WAIT_TIMEOUT + 1)
+    late["done"] = threading.Event()
+    scheduler.pending.put(late)
+
+    assert late["done"].wait(5)
+    assert late["result"] == (False, "Input command timed out in queue")
+    assert not executed
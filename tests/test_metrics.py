@@ -0,0 +1,84 @@
+import pytest
+
+import adb_screen
+
+
+PREFIX = adb_screen.METRIC_PREFIX
+# One on a bucket bound (le includes it), one inside a bucket, one past the last
+OBSERVED = (0.001, 0.003, 0.3, 20)
+
+
+def test_histogram_buckets_sum_and_count():
+    histogram = adb_screen.Histogram()
+    for seconds in OBSERVED:
+        histogram.observe(seconds)
+
+    counts = dict(zip(histogram.bounds(), histogram.counts))
+    assert counts["0.001"] == 1
+    assert counts["0.005"] == 1
+    assert counts["0.5"] == 1
+    assert counts["+Inf"] == 1
+    assert sum(histogram.counts) == histogram.count == 4
+    assert histogram.sum == pytest.approx(20.304)
+    assert (histogram.min, histogram.max) == (0.001, 20)
+
+
+def test_histogram_quantiles_stay_within_observed_values():
+    histogram = adb_screen.Histogram()
+    for _ in range(100):
+        histogram.observe(0.04)
+
+    assert histogram.quantile(0.5) == pytest.approx(0.04)
+    assert histogram.summary()["p99_ms"] == 40
+    assert adb_screen.Histogram().summary()["mean_ms"] is None
+
+
+def test_prometheus_exposition():
+    metrics = adb_screen.Metrics()
+    for seconds in OBSERVED:
+        metrics.observe("capture_seconds", seconds, device="fake-0001", model="Fake")
+    metrics.observe("http_request_seconds", 0.002, endpoint='say "hi"')
+
+    lines = metrics.prometheus()
+    metric = PREFIX + "capture_seconds"
+    labels = 'device="fake-0001",model="Fake"'
+
+    assert lines[0] == f"# HELP {metric} {adb_screen.Metrics.HELP['capture_seconds']}"
+    assert lines[1] == f"# TYPE {metric} histogram"
+    buckets = [line for line in lines if line.startswith(metric + "_bucket")]
+    assert buckets == [
+        f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        for bound, cumulative in zip(
+            ["0.001", "0.0025", "0.005", "0.01", "0.025", "0.05", "0.1", "0.25", "0.5",
+             "1", "2.5", "5", "10", "+Inf"],
+            [1, 1, 2, 2, 2, 2, 2, 2, 3, 3, 3, 3, 3, 4])]
+    assert f"{metric}_sum{{{labels}}} 20.304000" in lines
+    assert f"{metric}_count{{{labels}}} 4" in lines
+    # Label values are escaped
+    assert f'{PREFIX}http_request_seconds_count{{endpoint="say \\"hi\\""}} 1' in lines
+
+
+def test_metrics_endpoint(device, monkeypatch):
+    monkeypatch.setattr(adb_screen, "metrics", adb_screen.Metrics())
+    client = adb_screen.app.test_client()
+    assert client.get("/screenshot").get_json()["success"]
+
+    response = client.get("/metrics")
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert response.mimetype == "text/plain"
+    assert "version=0.0.4" in response.headers["Content-Type"]
+    labels = adb_screen.prometheus_labels(tuple(device.labels.items()))
+    assert f"# TYPE {PREFIX}capture_seconds histogram" in lines
+    assert f"# TYPE {PREFIX}frames_captured_total counter" in lines
+    assert f"# TYPE {PREFIX}subscribers gauge" in lines
+    sample = f"{PREFIX}frames_captured_total{labels} "
+    captured = [line for line in lines if line.startswith(sample)]
+    assert len(captured) == 1 and int(captured[0].split()[-1]) >= 1
+    # The /screenshot request was timed, /metrics is timed after its body is built
+    assert any(line.startswith(f'{PREFIX}http_request_seconds_count{{endpoint="screenshot"}} ')
+               for line in lines)
+    # Every sample line is "name{labels} value"
+    for line in lines:
+        if not line.startswith("#"):
+            float(line.rsplit(" ", 1)[1])
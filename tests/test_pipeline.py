@@ -0,0 +1,105 @@
+import types
+
+import pytest
+
+import adb_screen
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(adb_screen, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def test_out_of_order_completion_is_dropped():
+    pipeline = adb_screen.CapturePipeline(depth=2)
+    first, first_slot = pipeline.begin()
+    second, second_slot = pipeline.begin()
+
+    assert pipeline.begin() is None
+    assert first_slot != second_slot
+    # The later capture finishes first and is published
+    assert pipeline.finish(second)
+    assert not pipeline.finish(first)
+    assert pipeline.stats()["stale_dropped"] == 1
+    assert pipeline.stats()["in_flight"] == 0
+    # Both slots are free again
+    assert {pipeline.begin()[1], pipeline.begin()[1]} == {0, 1}
+
+
+def test_in_order_completions_are_published():
+    pipeline = adb_screen.CapturePipeline(depth=3)
+    tickets = [pipeline.begin()[0] for _ in range(3)]
+
+    assert all(pipeline.finish(ticket) for ticket in tickets)
+    assert pipeline.stale == 0
+
+
+def run(pipeline, clock, seconds, latency, rate, state="normal", interval=0.1):
+    """Publish captures for seconds of simulated time at rate(depth) frames per second"""
+    depths = []
+    end = clock.now + seconds
+    while clock.now < end:
+        clock.now += 1 / rate(pipeline.depth)
+        pipeline.tune(state, interval, latency)
+        depths.append(pipeline.depth)
+    return depths
+
+
+def test_auto_depth_goes_up_while_it_pays_off(clock):
+    pipeline = adb_screen.CapturePipeline(depth=0)
+    # latency / depth stays above the 0.1s target interval, so overlap can help
+    latency = 0.45
+    # Two captures in flight double the rate, a third one adds nothing
+    rate = lambda depth: min(depth, 2) / latency
+
+    depths = run(pipeline, clock, adb_screen.PIPELINE_TUNE_INTERVAL * 4 + 1, latency, rate)
+
+    assert max(depths) == 3          # the deeper pipeline was tried
+    assert pipeline.depth == 2       # and given up again
+    assert pipeline.stats()["mode"] == "auto"
+
+
+def test_auto_depth_goes_down_when_the_device_saturates(clock):
+    pipeline = adb_screen.CapturePipeline(depth=0)
+    latency = 0.45
+    run(pipeline, clock, adb_screen.PIPELINE_TUNE_INTERVAL * 2 + 1, latency,
+        lambda depth: depth / latency)
+    assert pipeline.depth == 3
+
+    pipeline.tune("backoff", 0.1, latency)
+    assert pipeline.depth == 2
+    pipeline.tune("backoff", 0.1, latency)
+    pipeline.tune("backoff", 0.1, latency)
+    assert pipeline.depth == 1
+
+    # Held at the lower depth for a while before trying again
+    run(pipeline, clock, adb_screen.PIPELINE_TUNE_INTERVAL * 2, latency,
+        lambda depth: depth / latency)
+    assert pipeline.depth == 1
+
+
+def test_depth_stays_when_the_interval_limits_the_rate(clock):
+    pipeline = adb_screen.CapturePipeline(depth=0)
+
+    run(pipeline, clock, adb_screen.PIPELINE_TUNE_INTERVAL * 3, 0.05, lambda depth: 10)
+
+    assert pipeline.depth == 1
+
+
+def test_fixed_depth_is_not_tuned(clock):
+    pipeline = adb_screen.CapturePipeline(depth=2)
+
+    run(pipeline, clock, adb_screen.PIPELINE_TUNE_INTERVAL * 3, 0.45, lambda depth: depth / 0.45)
+    pipeline.tune("backoff", 0.1, 0.45)
+
+    assert pipeline.depth == 2
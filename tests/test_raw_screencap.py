@@ -0,0 +1,87 @@
+import struct
+
+import pytest
+
+import adb_screen
+
+
+WIDTH, HEIGHT = 3, 2
+# Red, green, blue, white, black and grey, row by row
+COLOURS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255), (0, 0, 0), (128, 128, 128)]
+# The same pixels in each pixel format
+PIXELS = {
+    1: b"".join(bytes(colour) + b"\xff" for colour in COLOURS),
+    2: b"".join(bytes(colour) + b"\x00" for colour in COLOURS),
+    3: b"".join(bytes(colour) for colour in COLOURS),
+    # 5 bits red, 6 green, 5 blue, little-endian
+    4: struct.pack("<6H", 0xF800, 0x07E0, 0x001F, 0xFFFF, 0x0000, 0x8410),
+    5: b"".join(bytes(colour[::-1]) + b"\xff" for colour in COLOURS),
+}
+
+
+def capture(pixel_format, pixels=None, colorspace=None, width=WIDTH, height=HEIGHT):
+    """Raw screencap output: the v0 header, or v1 with a colour space field"""
+    header = struct.pack("<III", width, height, pixel_format)
+    if colorspace is not None:
+        header += struct.pack("<I", colorspace)
+    return header + (PIXELS[pixel_format] if pixels is None else pixels)
+
+
+def colours(image):
+    return [image.getpixel((x, y))[:3] for y in range(HEIGHT) for x in range(WIDTH)]
+
+
+@pytest.mark.parametrize("pixel_format", sorted(PIXELS))
+@pytest.mark.parametrize("colorspace", [None, 0, 1])
+def test_headers_and_pixel_formats(pixel_format, colorspace):
+    image = adb_screen.parse_raw_screencap(capture(pixel_format, colorspace=colorspace))
+
+    assert image.size == (WIDTH, HEIGHT)
+    assert image.mode == adb_screen.RAW_PIXEL_FORMATS[pixel_format][1]
+    if pixel_format == 4:
+        # RGB 565 keeps the top 5 or 6 bits of each channel
+        assert [tuple(c >> 3 for c in colour) for colour in colours(image)] == \
+            [tuple(c >> 3 for c in colour) for colour in COLOURS]
+    else:
+        assert colours(image) == COLOURS
+
+
+def test_alpha_is_kept_for_rgba():
+    pixels = bytes((10, 20, 30, 40)) * (WIDTH * HEIGHT)
+
+    image = adb_screen.parse_raw_screencap(capture(1, pixels))
+
+    assert image.getpixel((0, 0)) == (10, 20, 30, 40)
+
+
+def test_pixels_from_a_bytearray_are_not_copied():
+    data = bytearray(capture(1, colorspace=1))
+
+    image = adb_screen.parse_raw_screencap(data)
+    data[16:19] = b"\x01\x02\x03"
+
+    assert image.getpixel((0, 0))[:3] == (1, 2, 3)
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    capture(1)[:11],                                   # header cut short
+    capture(1)[:-1],                                   # last pixel cut short
+    capture(1, colorspace=1)[:-2],                     # v1 header, pixels cut short
+    capture(1, colorspace=1) + b"\x00",                # trailing garbage
+    capture(1, PIXELS[1] + b"\x00" * 8),               # rows padded to a wider stride
+    capture(1, width=WIDTH + 1),                       # header wider than the pixels
+    struct.pack("<III", 3, 2, 9),                      # unknown format, no pixels
+    struct.pack("<III", 3, 2, 9) + PIXELS[1],          # unknown format with pixels
+], ids=["empty", "short-header", "short-pixels", "short-v1", "trailing", "stride",
+        "too-wide", "unknown-empty", "unknown"])
+def test_malformed_captures_are_rejected(data):
+    assert adb_screen.parse_raw_screencap(data) is None
+
+
+def test_decode_capture_checks_png_and_raw():
+    assert adb_screen.decode_capture(capture(3), raw=True).size == (WIDTH, HEIGHT)
+    assert adb_screen.decode_capture(capture(3)[:-1], raw=True) is None
+    assert adb_screen.decode_capture(capture(3), raw=False) is None
+    assert adb_screen.decode_capture(adb_screen.PNG_SIGNATURE + b"\x00" * 16, raw=False)
+    assert adb_screen.decode_capture(adb_screen.PNG_SIGNATURE, raw=False) is None
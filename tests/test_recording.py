@@ -0,0 +1,139 @@
+import queue
+import time
+
+import pytest
+from PIL import Image, ImageDraw
+
+import adb_screen
+
+
+START = 1000.0
+FRAME_INTERVAL = 0.5
+FRAME_COUNT = 24
+
+
+class FeedEngine:
+    """Stands in for a CaptureEngine, handing the recorder frames from a queue"""
+
+    def __init__(self):
+        self.frames = queue.Queue()
+
+    def subscribe(self):
+        return self
+
+    def next(self, timeout):
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        pass
+
+
+class FeedDevice:
+    def __init__(self):
+        self.serial = "fake-0001"
+        self.labels = {"device": self.serial, "model": "Fake_Device"}
+        self.engine = FeedEngine()
+
+
+def screen(number):
+    """A 256x256 screen with one 64 pixel tile changed per frame"""
+    image = Image.new("RGB", (256, 256), (32, 32, 48))
+    draw = ImageDraw.Draw(image)
+    for index in range(number + 1):
+        x, y = index % 4 * 64, index // 4 % 4 * 64
+        draw.rectangle((x, y, x + 63, y + 63), fill=(index * 10 % 256, 100, 200))
+    return image
+
+
+@pytest.fixture
+def recording(tmp_path, monkeypatch):
+    """A finished recording of FRAME_COUNT frames, and their screens"""
+    monkeypatch.setattr(adb_screen, "RECORDINGS_DIR", str(tmp_path))
+    # Lossless, so replayed screens can be compared exactly
+    monkeypatch.setattr(adb_screen, "RECORDING_ENCODING", "png")
+    monkeypatch.setattr(adb_screen, "RECORDING_KEYFRAME_INTERVAL", 2)
+    monkeypatch.setattr(adb_screen, "RECORDING_SEGMENT_SIZE", 4000)
+    monkeypatch.setattr(adb_screen, "RECORDING_FLUSH_INTERVAL", 0.05)
+
+    device = FeedDevice()
+    recorder = adb_screen.SessionRecorder(device)
+    screens = [screen(number) for number in range(FRAME_COUNT)]
+    for number, image in enumerate(screens):
+        timestamp = START + number * FRAME_INTERVAL
+        device.engine.frames.put(adb_screen.Frame(number + 1, image, timestamp, 0))
+    deadline = time.time() + 10
+    while recorder.counters["keyframes"] + recorder.counters["deltas"] < FRAME_COUNT:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    recorder.stop()
+
+    recording = adb_screen.Recording(recorder.path)
+    yield recording, recorder, screens
+    recording.close()
+
+
+def same(a, b):
+    return a.convert("RGB").tobytes() == b.convert("RGB").tobytes()
+
+
+def test_recorder_writes_keyframes_and_deltas(recording):
+    recording, recorder, _ = recording
+
+    assert recorder.error is None
+    assert recorder.counters["deltas"] > recorder.counters["keyframes"] > 1
+    assert len(recording.segments()) > 1
+    assert recording.span() == (START, START + (FRAME_COUNT - 1) * FRAME_INTERVAL)
+
+
+def test_frame_at_every_frame_in_any_order(recording):
+    recording, _, screens = recording
+    order = list(range(FRAME_COUNT))
+    # Forward (continuing from the last seek) and backward (from a keyframe)
+    for number in order + order[::-1]:
+        image, timestamp = recording.frame_at(START + number * FRAME_INTERVAL)
+        assert timestamp == START + number * FRAME_INTERVAL
+        assert same(image, screens[number])
+
+
+def test_frame_at_between_frames_and_outside_the_recording(recording):
+    recording, _, screens = recording
+
+    for number in range(FRAME_COUNT):
+        image, timestamp = recording.frame_at(START + number * FRAME_INTERVAL + FRAME_INTERVAL / 2)
+        assert timestamp == START + number * FRAME_INTERVAL
+        assert same(image, screens[number])
+    assert same(recording.frame_at(START - 5)[0], screens[0])
+    assert same(recording.frame_at(START + 1000)[0], screens[-1])
+
+
+def test_frame_at_segment_boundaries(recording):
+    recording, _, screens = recording
+    index, _ = recording._map(recording.segments()[1])
+    first = adb_screen.IndexTimestamps(index)[0]
+    number = round((first - START) / FRAME_INTERVAL)
+
+    # A segment starts with a keyframe; just before it is the previous segment's last frame
+    assert adb_screen.RECORD_INDEX.unpack_from(index, 0)[3] == adb_screen.RECORD_KEYFRAME
+    assert same(recording.frame_at(first)[0], screens[number])
+    assert same(recording.frame_at(first - 0.01)[0], screens[number - 1])
+    assert same(recording.frame_at(first + 0.01)[0], screens[number])
+
+
+def test_grown_segment_is_mapped_again_and_old_maps_closed(recording, tmp_path):
+    recording, _, _ = recording
+    segment = recording.segments()[-1]
+    index, data = recording._map(segment)
+    size = len(index)
+    path = tmp_path / recording.name / (segment + ".idx")
+    with open(path, "ab") as f:
+        f.write(adb_screen.RECORD_INDEX.pack(START + 100, 0, 1, adb_screen.RECORD_INPUT))
+
+    new_index, _ = recording._map(segment)
+
+    assert len(new_index) == size + adb_screen.RECORD_INDEX.size
+    assert index.closed and data.closed
+    recording.close()
+    assert new_index.closed and not recording.maps
@@ -0,0 +1,83 @@
+from PIL import Image, ImageDraw
+
+import adb_screen
+
+
+TILE = adb_screen.TILE_SIZE
+
+
+def frame(seq, *boxes, size=(200, 400)):
+    """A frame of size with the given (x0, y0, x1, y1) boxes painted white"""
+    image = Image.new("RGB", size, (0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for box in boxes:
+        draw.rectangle(box, fill=(255, 255, 255))
+    return adb_screen.Frame(seq, image, seq, 0)
+
+
+def test_dirty_rects_of_identical_frames():
+    assert frame(2).dirty_rects(frame(1)) == []
+
+
+def test_dirty_rects_single_pixel_marks_its_tile():
+    rects = frame(2, (TILE + 5, 2 * TILE + 5, TILE + 5, 2 * TILE + 5)).dirty_rects(frame(1))
+
+    assert rects == [(TILE, 2 * TILE, TILE, TILE)]
+
+
+def test_dirty_rects_merge_runs_and_rows():
+    # Tiles 0-1 of rows 0-1 form one rectangle, tile 2 of row 4 another
+    boxes = ((0, 0, 2 * TILE - 1, 2 * TILE - 1), (2 * TILE, 4 * TILE, 2 * TILE, 4 * TILE))
+
+    rects = frame(2, *boxes).dirty_rects(frame(1))
+
+    assert sorted(rects) == [(0, 0, 2 * TILE, 2 * TILE), (2 * TILE, 4 * TILE, TILE, TILE)]
+
+
+def test_dirty_rects_split_when_runs_differ_between_rows():
+    boxes = ((0, 0, 2 * TILE - 1, TILE - 1), (0, TILE, TILE - 1, TILE))
+
+    rects = frame(2, *boxes).dirty_rects(frame(1))
+
+    assert sorted(rects) == [(0, 0, 2 * TILE, TILE), (0, TILE, TILE, TILE)]
+
+
+def test_dirty_rects_edge_tiles_are_clipped_to_the_frame():
+    # 200x400 is not a multiple of the tile size in either direction
+    rects = frame(2, (199, 399, 199, 399)).dirty_rects(frame(1))
+
+    x, y = 200 // TILE * TILE, 400 // TILE * TILE
+    assert rects == [(x, y, 200 - x, 400 - y)]
+
+
+def test_dirty_rects_of_differently_sized_frames():
+    assert frame(2, size=(400, 200)).dirty_rects(frame(1)) is None
+
+
+def test_screen_etag_uses_the_quality_it_encodes_with(device):
+    client = adb_screen.app.test_client()
+    seq = client.get("/screenshot").get_json()["seq"]
+
+    clamped = client.get(f"/screen?seq={seq}&encoding=jpeg&quality=500")
+    exact = client.get(f"/screen?seq={seq}&encoding=jpeg&quality=100")
+    lower = client.get(f"/screen?seq={seq}&encoding=jpeg&quality=50")
+
+    assert clamped.headers["ETag"] == exact.headers["ETag"] != lower.headers["ETag"]
+    assert clamped.data == exact.data
+
+
+def test_screen_if_none_match_is_not_modified(device):
+    client = adb_screen.app.test_client()
+    seq = client.get("/screenshot").get_json()["seq"]
+    first = client.get(f"/screen?seq={seq}&encoding=jpeg")
+
+    again = client.get(f"/screen?seq={seq}&encoding=jpeg",
+                       headers={"If-None-Match": first.headers["ETag"]})
+    other = client.get(f"/screen?seq={seq}&encoding=png",
+                       headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.status_code == 200 and first.data
+    assert again.status_code == 304 and not again.data
+    assert again.headers["ETag"] == first.headers["ETag"]
+    assert again.headers["X-Frame-Seq"] == str(seq)
+    assert other.status_code == 200 and other.data
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+import adb_screen
+
+
+@pytest.fixture(params=["0", "1"], ids=["eof", "no-eof"])
+def pool(device, monkeypatch, request):
+    """A SpawnPool on the fake adb binary, with "no-eof" behaving like old adbd
+
+    Old devices run the interactive shell on a pty and do not pass on the
+    end of stdin, so the shell only ends when it reads exit.
+    """
+    monkeypatch.setenv("FAKE_ADB_PTY", request.param)
+    pool = adb_screen.SpawnPool(device, size=1)
+    yield pool
+    pool.close()
+
+
+def test_run_returns_before_the_timeout(pool):
+    start = time.time()
+
+    success, output, error = pool.run("echo hello", timeout=5)
+
+    assert time.time() - start < 3
+    assert success, error
+    assert "hello" in output
+
+
+def test_run_reports_the_command_status(pool):
+    assert pool.run("false", timeout=5)[0] is False
+    # Through a process started ahead of time
+    deadline = time.time() + 5
+    while not pool.stats()["idle"] and time.time() < deadline:
+        time.sleep(0.05)
+    assert pool.run("true", timeout=5)[0] is True
+    assert pool.stats()["reused"] == 1
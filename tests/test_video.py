@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import adb_screen
+
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample.h264")
+# Two keyframes with SPS and PPS in front, the first one in two slices
+SAMPLE_KINDS = [7, 8, 5, 5, 1, 1, 7, 8, 5, 1]
+
+
+def sample():
+    with open(SAMPLE, "rb") as f:
+        return f.read()
+
+
+def split(data, chunk_size):
+    splitter = adb_screen.AnnexBSplitter()
+    units = []
+    for offset in range(0, len(data), chunk_size):
+        units += splitter.feed(data[offset:offset + chunk_size])
+    return units + splitter.flush()
+
+
+def test_splitter_finds_every_unit():
+    units = split(sample(), len(sample()))
+
+    assert [unit[0] & 0x1f for unit in units] == SAMPLE_KINDS
+    # Emulation prevention bytes stay, trailing zeros before a start code go
+    assert b"\x00\x00\x03\x01" in units[2]
+    assert all(unit[-1] != 0 for unit in units)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64])
+def test_splitter_handles_start_codes_split_across_chunks(chunk_size):
+    assert split(sample(), chunk_size) == split(sample(), len(sample()))
+
+
+def test_sps_gives_the_codec_string():
+    stream = adb_screen.VideoStream(None)
+    stream._add_units(split(sample(), 16)[:2])
+
+    assert stream.codec == "avc1.42c01f"
+    assert stream.config()["codec"] == "avc1.42c01f"
+    assert stream.pps[0] & 0x1f == adb_screen.NAL_PPS
+
+
+def test_access_units_and_keyframes():
+    stream = adb_screen.VideoStream(None)
+    units = split(sample(), 16)
+    stream._add_units(units[:6])
+    stream._publish()
+
+    # Both slices of the first keyframe make one access unit
+    assert [keyframe for _, keyframe, _, _ in stream.units] == [True, False, False]
+    data = stream.units[0][3]
+    assert data.startswith(adb_screen.NAL_START_CODE + stream.sps + adb_screen.NAL_START_CODE + stream.pps)
+    assert data.count(adb_screen.NAL_START_CODE) == 4
+
+    stream._add_units(units[6:])
+    stream._publish()
+
+    # A keyframe starts a new group of pictures
+    assert stream.seq == 5
+    assert [(seq, keyframe) for seq, keyframe, _, _ in stream.units] == [(4, True), (5, False)]
@@ -0,0 +1,45 @@
+import logging
+
+import pytest
+from werkzeug.datastructures import MultiDict
+from simple_websocket import ConnectionClosed
+
+import adb_screen
+
+
+class FailingSocket:
+    """A WebSocket whose sends raise error"""
+
+    def __init__(self, error):
+        self.error = error
+
+    def send(self, message):
+        raise self.error
+
+    def receive(self):
+        return None
+
+
+def push_frames(device, error):
+    options, _ = adb_screen.frame_options(MultiDict())
+    session = adb_screen.WebSocketSession(FailingSocket(error), device, options)
+    session._push_frames()
+    return session
+
+
+@pytest.mark.parametrize("error", [ConnectionClosed(), BrokenPipeError()])
+def test_closed_socket_ends_the_push_quietly(device, caplog, error):
+    with caplog.at_level(logging.ERROR):
+        session = push_frames(device, error)
+
+    assert session.closed
+    assert not caplog.records
+
+
+def test_other_push_errors_are_logged(device, caplog):
+    with caplog.at_level(logging.ERROR):
+        session = push_frames(device, ValueError("bad frame"))
+
+    assert session.closed
+    assert "WebSocket frame push failed" in caplog.text
+    assert "bad frame" in caplog.text